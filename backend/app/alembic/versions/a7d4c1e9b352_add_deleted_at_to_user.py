@@ -0,0 +1,42 @@
+"""Add deleted_at to user
+
+Revision ID: a7d4c1e9b352
+Revises: f3b9d2c6a815
+Create Date: 2026-10-18 21:12:08.513426
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a7d4c1e9b352"
+down_revision = "f3b9d2c6a815"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("user", sa.Column("deleted_at", sa.DateTime(), nullable=True))
+    # Users pending deletion are marked, they no longer hold their email
+    op.execute(
+        'UPDATE "user" SET deleted_at = userdeletion.created_at FROM userdeletion '
+        "WHERE userdeletion.user_id = \"user\".id AND userdeletion.status = 'pending'"
+    )
+    op.drop_index("ix_user_email", table_name="user")
+    op.create_index(
+        "ix_user_email",
+        "user",
+        ["email"],
+        unique=True,
+        postgresql_where=sa.text("deleted_at IS NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_user_email",
+        table_name="user",
+        postgresql_where=sa.text("deleted_at IS NULL"),
+    )
+    op.create_index("ix_user_email", "user", ["email"], unique=True)
+    op.drop_column("user", "deleted_at")
@@ -0,0 +1,46 @@
+"""Add item title trigram index
+
+Revision ID: b5c7e9d1f3a2
+Revises: d8e2f4a6b913
+Create Date: 2026-10-19 10:14:27.604381
+
+"""
+import logging
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b5c7e9d1f3a2"
+down_revision = "d8e2f4a6b913"
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+
+def upgrade():
+    available = (
+        op.get_bind()
+        .execute(
+            sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        )
+        .scalar()
+    )
+    if not available:
+        # e.g. a Postgres build without the contrib modules, short searches then
+        # scan the items in id order
+        logger.warning("pg_trgm is not available, skipping ix_item_title_trgm")
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index(
+        "ix_item_title_trgm",
+        "item",
+        [sa.literal_column("lower(title) gin_trgm_ops")],
+        unique=False,
+        postgresql_using="gin",
+    )
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_item_title_trgm")
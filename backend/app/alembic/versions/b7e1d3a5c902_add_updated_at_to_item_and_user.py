@@ -0,0 +1,60 @@
+"""Add updated_at to item and user
+
+Revision ID: b7e1d3a5c902
+Revises: 8c4e2b7d9f31
+Create Date: 2026-10-18 14:21:09.402716
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b7e1d3a5c902"
+down_revision = "8c4e2b7d9f31"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows get the time of the migration as their first version
+    op.add_column(
+        "user",
+        sa.Column(
+            "updated_at",
+            sa.DateTime(),
+            nullable=False,
+            server_default=sa.text("timezone('utc', now())"),
+        ),
+    )
+    op.add_column(
+        "item",
+        sa.Column(
+            "updated_at",
+            sa.DateTime(),
+            nullable=False,
+            server_default=sa.text("timezone('utc', now())"),
+        ),
+    )
+    op.drop_index("ix_item_owner_id_id", table_name="item")
+    op.create_index(
+        "ix_item_owner_id_id",
+        "item",
+        ["owner_id", "id"],
+        unique=False,
+        postgresql_include=["updated_at"],
+    )
+    op.create_index(
+        "ix_item_id_version",
+        "item",
+        ["id"],
+        unique=False,
+        postgresql_include=["owner_id", "updated_at"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_item_id_version", table_name="item")
+    op.drop_index("ix_item_owner_id_id", table_name="item")
+    op.create_index("ix_item_owner_id_id", "item", ["owner_id", "id"], unique=False)
+    op.drop_column("item", "updated_at")
+    op.drop_column("user", "updated_at")
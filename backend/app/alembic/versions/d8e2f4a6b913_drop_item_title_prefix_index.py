@@ -0,0 +1,29 @@
+"""Drop item title prefix index
+
+Revision ID: d8e2f4a6b913
+Revises: a7d4c1e9b352
+Create Date: 2026-10-18 23:05:41.207118
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d8e2f4a6b913"
+down_revision = "a7d4c1e9b352"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Short search queries match word prefixes with the full-text index now
+    op.drop_index("ix_item_title_prefix", table_name="item")
+
+
+def downgrade():
+    op.create_index(
+        "ix_item_title_prefix",
+        "item",
+        [sa.literal_column("lower(title) text_pattern_ops")],
+        unique=False,
+    )
@@ -1,4 +1,6 @@
-from collections.abc import Generator
+import hashlib
+import time
+from collections.abc import AsyncGenerator
 from typing import Annotated
 
 import jwt
@@ -6,50 +8,170 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
 from pydantic import ValidationError
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core import security
+from app.core.cache import recent_writers, token_cache, user_cache, user_tag
 from app.core.config import settings
-from app.core.db import engine
-from app.models import TokenPayload, User
+from app.core.db import async_engine, replicas
+from app.core.revocation import token_denylist
+from app.models import CachedUser, TokenPayload, User, UserClaims
 
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/login/access-token"
 )
 
 
-def get_db() -> Generator[Session, None, None]:
-    with Session(engine) as session:
+@event.listens_for(Session, "after_commit")
+def _on_commit(session: Session) -> None:
+    session.info["committed"] = True
+
+
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
         yield session
+        user_id = session.info.get("user_id")
+        if session.info.get("committed") and user_id is not None:
+            await recent_writers.aset(str(user_id), True)
 
 
-SessionDep = Annotated[Session, Depends(get_db)]
+SessionDep = Annotated[AsyncSession, Depends(get_db)]
 TokenDep = Annotated[str, Depends(reusable_oauth2)]
 
 
-def get_current_user(session: SessionDep, token: TokenDep) -> User:
-    try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
+async def get_token_payload(token: str) -> TokenPayload:
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    token_data: TokenPayload | None = await token_cache.aget(digest)
+    if token_data is None:
+        try:
+            payload = jwt.decode(
+                token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
+            )
+            token_data = TokenPayload(**payload)
+        except (InvalidTokenError, ValidationError):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Could not validate credentials",
+            )
+        if "exp" in payload:
+            # Evicted when the token expires, so it is never served past its lifetime
+            tags = [] if token_data.sub is None else [user_tag(token_data.sub)]
+            await token_cache.aset(
+                digest, token_data, ttl=payload["exp"] - time.time(), tags=tags
+            )
+    # Checked on every use, so revoking needs no token cache invalidation
+    if token_denylist.is_revoked(token_data):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Could not validate credentials",
         )
-        token_data = TokenPayload(**payload)
-    except (InvalidTokenError, ValidationError):
+    return token_data
+
+
+async def get_access_token_payload(token: str) -> TokenPayload:
+    token_data = await get_token_payload(token)
+    if token_data.type != "access":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    user = session.get(User, token_data.sub)
+    return token_data
+
+
+async def get_current_user(session: SessionDep, token: TokenDep) -> User:
+    token_data = await get_access_token_payload(token)
+    user = None
+    if token_data.sub is not None and (
+        cached := await user_cache.aget(str(token_data.sub))
+    ):
+        # Attach a copy to the session as if it was just loaded from the database
+        user = User(**cached.model_dump())
+        make_transient_to_detached(user)
+        session.add(user)
+    if not user:
+        user = await session.get(User, token_data.sub)
+        if user and user.id is not None:
+            await user_cache.aset(str(user.id), CachedUser(**user.model_dump()))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
+    # Lets get_db send the user's next reads to the primary after a write
+    session.info["user_id"] = user.id
     return user
 
 
 CurrentUser = Annotated[User, Depends(get_current_user)]
 
 
-def get_current_active_superuser(current_user: CurrentUser) -> User:
+async def get_current_user_claims(session: SessionDep, token: TokenDep) -> UserClaims:
+    """
+    The requesting user from the claims of a stateless access token, without a
+    database query. For other tokens the user is loaded like CurrentUser.
+    """
+    token_data = await get_access_token_payload(token)
+    if (
+        token_data.sub is None
+        or token_data.is_active is None
+        or token_data.is_superuser is None
+    ):
+        user = await get_current_user(session, token)
+        return UserClaims(
+            id=user.id, is_active=user.is_active, is_superuser=user.is_superuser
+        )
+    if not token_data.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    session.info["user_id"] = token_data.sub
+    return UserClaims(
+        id=token_data.sub,
+        is_active=token_data.is_active,
+        is_superuser=token_data.is_superuser,
+    )
+
+
+CurrentUserClaims = Annotated[UserClaims, Depends(get_current_user_claims)]
+
+
+async def get_read_db(
+    session: SessionDep, current_user: CurrentUserClaims
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Session on a read replica, or the request's session on the primary when no
+    replica is available or right after the user wrote. Reusing it keeps a read
+    request to one primary connection, which the user lookup may already hold.
+    """
+    engine = async_engine
+    if replicas.replicas and not await recent_writers.aget(str(current_user.id)):
+        engine = await replicas.choose()
+    if engine is async_engine:
+        yield session
+        return
+    async with replicas.session(engine) as replica_session:
+        yield replica_session
+
+
+ReadSessionDep = Annotated[AsyncSession, Depends(get_read_db)]
+
+
+async def get_current_active_superuser(current_user: CurrentUser) -> User:
+    if not current_user.is_superuser:
+        raise HTTPException(
+            status_code=403, detail="The user doesn't have enough privileges"
+        )
+    return current_user
+
+
+async def get_current_active_superuser_claims(
+    current_user: CurrentUserClaims,
+) -> UserClaims:
+    """
+    Superuser check from the token claims, for read-only routes. The claims of a
+    demoted superuser stay valid until the token expires, so routes that change
+    anything must use get_current_active_superuser.
+    """
     if not current_user.is_superuser:
         raise HTTPException(
             status_code=403, detail="The user doesn't have enough privileges"
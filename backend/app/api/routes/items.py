@@ -1,60 +1,404 @@
-from typing import Any
+import csv
+import io
+import json
+import re
+from collections import Counter
+from collections.abc import AsyncIterator, Sequence
+from typing import Annotated, Any, Literal
 
-from fastapi import APIRouter, HTTPException
-from sqlmodel import func, select
+from fastapi import APIRouter, Body, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Row, and_, func, literal, or_
+from sqlmodel import col, delete, select
 
-from app.api.deps import CurrentUser, SessionDep
-from app.models import Item, ItemCreate, ItemPublic, ItemsPublic, ItemUpdate, Message
+from app import crud
+from app.api.deps import (
+    CurrentUser,
+    CurrentUserClaims,
+    ReadSessionDep,
+    SessionDep,
+)
+from app.core.config import settings
+from app.core.db import async_engine
+from app.core.timing import TimedORJSONResponse
+from app.models import (
+    Item,
+    ItemBulkResult,
+    ItemBulkUpdate,
+    ItemCreate,
+    ItemPublic,
+    ItemsBulkResult,
+    ItemsPublic,
+    ItemUpdate,
+    Message,
+    User,
+)
+from app.utils import (
+    decode_cursor,
+    decode_search_cursor,
+    encode_cursor,
+    encode_search_cursor,
+    etag_matches,
+    make_etag,
+)
 
 router = APIRouter()
 
+BulkBody = Body(min_length=1, max_length=settings.ITEMS_BULK_MAX_SIZE)
+
+EXPORT_COLUMNS = ("id", "title", "description", "owner_id")
+# Rows fetched from the server-side cursor and written per chunk
+EXPORT_BATCH_SIZE = 1000
+# Must match the configuration of Item.search_vector
+SEARCH_CONFIG = "simple"
+# Shorter queries match too many prefixes to rank them all, they match the title
+# with the trigram index instead
+SEARCH_FULL_TEXT_MIN_LENGTH = 3
+
 
 @router.get("/", response_model=ItemsPublic)
-def read_items(
-    session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100
+async def read_items(
+    session: ReadSessionDep,
+    current_user: CurrentUserClaims,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    include_count: bool = True,
+    if_none_match: Annotated[str | None, Header()] = None,
 ) -> Any:
     """
     Retrieve items.
+
+    Items are ordered by id. Pass the `next_cursor` of a page as `cursor` to get
+    the following page by keyset instead of `skip`. Set `include_count` to false
+    to skip the total, e.g. after the first page. Answers 304 Not Modified when
+    `If-None-Match` has the current ETag of the page.
     """
 
-    if current_user.is_superuser:
-        count_statement = select(func.count()).select_from(Item)
-        count = session.exec(count_statement).one()
-        statement = select(Item).offset(skip).limit(limit)
-        items = session.exec(statement).all()
+    # Plain rows serialized with orjson, the ORM and response_model validation
+    # add nothing to a read only page
+    statement = (
+        select(*crud.public_columns(Item, ItemPublic))
+        .order_by(col(Item.id))
+        .limit(limit)
+    )
+    if not current_user.is_superuser:
+        statement = statement.where(Item.owner_id == current_user.id)
+    if cursor is not None:
+        last_id = decode_cursor(cursor)
+        if last_id is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        statement = statement.where(col(Item.id) > last_id)
     else:
-        count_statement = (
-            select(func.count())
-            .select_from(Item)
-            .where(Item.owner_id == current_user.id)
+        statement = statement.offset(skip)
+
+    count, count_is_estimate = None, False
+    if include_count and current_user.is_superuser:
+        count, count_is_estimate = await crud.async_count_rows(
+            session=session, model=Item
+        )
+    elif include_count:
+        count = await crud.async_get_item_count(
+            session=session, owner_id=current_user.id
+        )
+
+    if if_none_match is not None:
+        # Index-only scan of the page's versions, the rows are only read on a miss
+        version_statement = statement.with_only_columns(Item.id, Item.updated_at)
+        versions = (await session.exec(version_statement)).all()
+        etag = make_etag(count, count_is_estimate, [tuple(v) for v in versions])
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+    items = [row._asdict() for row in (await session.exec(statement)).all()]
+    etag = make_etag(
+        count, count_is_estimate, [(item["id"], item["updated_at"]) for item in items]
+    )
+
+    next_cursor = None
+    if items and len(items) == limit:
+        next_cursor = encode_cursor(items[-1]["id"])
+    return TimedORJSONResponse(
+        {
+            "data": items,
+            "count": count,
+            "count_is_estimate": count_is_estimate,
+            "next_cursor": next_cursor,
+        },
+        headers={"ETag": etag},
+    )
+
+
+def _bulk_row_error(
+    current_user: User, id: int, owners: dict[int | None, int | None]
+) -> ItemBulkResult | None:
+    if id not in owners:
+        return ItemBulkResult(id=id, status_code=404, detail="Item not found")
+    if not current_user.is_superuser and (owners[id] != current_user.id):
+        return ItemBulkResult(id=id, status_code=400, detail="Not enough permissions")
+    return None
+
+
+@router.post("/bulk", response_model=ItemsBulkResult)
+async def create_items_bulk(
+    *,
+    session: SessionDep,
+    current_user: CurrentUser,
+    items_in: Annotated[list[ItemCreate], BulkBody],
+) -> Any:
+    """
+    Create many items in a single transaction.
+    """
+    items = [
+        Item.model_validate(item_in, update={"owner_id": current_user.id})
+        for item_in in items_in
+    ]
+    # Flushed as multi-row INSERT ... RETURNING statements
+    session.add_all(items)
+    await crud.async_add_item_counts(
+        session=session,
+        counts={current_user.id: len(items)},  # type: ignore[dict-item]
+    )
+    await session.commit()
+    data = [
+        ItemBulkResult(
+            id=item.id, status_code=200, item=ItemPublic.model_validate(item)
+        )
+        for item in items
+    ]
+    return ItemsBulkResult(data=data, count=len(items))
+
+
+@router.patch("/bulk", response_model=ItemsBulkResult)
+async def update_items_bulk(
+    *,
+    session: SessionDep,
+    current_user: CurrentUser,
+    items_in: Annotated[list[ItemBulkUpdate], BulkBody],
+) -> Any:
+    """
+    Update many items in a single transaction.
+
+    Rows that don't exist or belong to another user are reported and skipped.
+    """
+    statement = select(Item).where(col(Item.id).in_({i.id for i in items_in}))
+    items = {item.id: item for item in (await session.exec(statement)).all()}
+    owners = {id: item.owner_id for id, item in items.items()}
+    data: list[ItemBulkResult] = []
+    for item_in in items_in:
+        error = _bulk_row_error(current_user, item_in.id, owners)
+        if error:
+            data.append(error)
+            continue
+        item = items[item_in.id]
+        item.sqlmodel_update(item_in.model_dump(exclude={"id"}, exclude_unset=True))
+        session.add(item)
+        data.append(ItemBulkResult(id=item_in.id, status_code=200))
+    await session.commit()
+    for result in data:
+        if result.status_code == 200:
+            result.item = ItemPublic.model_validate(items[result.id])
+    return ItemsBulkResult(
+        data=data, count=sum(result.status_code == 200 for result in data)
+    )
+
+
+@router.delete("/bulk", response_model=ItemsBulkResult)
+async def delete_items_bulk(
+    *,
+    session: SessionDep,
+    current_user: CurrentUser,
+    ids: Annotated[list[int], BulkBody],
+) -> Any:
+    """
+    Delete many items in a single transaction.
+
+    Rows that don't exist or belong to another user are reported and skipped.
+    """
+    statement = select(Item.id, Item.owner_id).where(col(Item.id).in_(set(ids)))
+    owners = dict((await session.exec(statement)).all())
+    data: list[ItemBulkResult] = []
+    deleted = set()
+    for id in ids:
+        error = _bulk_row_error(current_user, id, owners)
+        if error:
+            data.append(error)
+            continue
+        deleted.add(id)
+        data.append(ItemBulkResult(id=id, status_code=200))
+    if deleted:
+        delete_statement = delete(Item).where(col(Item.id).in_(deleted))
+        await session.exec(delete_statement)  # type: ignore
+        deleted_per_owner = Counter(owners[id] for id in deleted)
+        await crud.async_add_item_counts(
+            session=session,
+            counts={owner_id: -n for owner_id, n in deleted_per_owner.items()},  # type: ignore[misc]
+        )
+    await session.commit()
+    return ItemsBulkResult(data=data, count=len(deleted))
+
+
+def _format_ndjson(rows: Sequence[Row[Any]]) -> str:
+    return "".join(json.dumps(row._asdict()) + "\n" for row in rows)
+
+
+def _format_csv(rows: Sequence[Sequence[Any]]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+@router.get("/export")
+async def export_items(
+    current_user: CurrentUserClaims,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    since_id: int = 0,
+) -> StreamingResponse:
+    """
+    Stream all items, ordered by id, as NDJSON or CSV.
+
+    Resume an interrupted export by passing the last received id as `since_id`.
+    """
+    statement = (
+        select(*(getattr(Item, column) for column in EXPORT_COLUMNS))
+        .where(col(Item.id) > since_id)
+        .order_by(col(Item.id))
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    if not current_user.is_superuser:
+        statement = statement.where(Item.owner_id == current_user.id)
+    format_rows = _format_csv if format == "csv" else _format_ndjson
+
+    async def stream_rows() -> AsyncIterator[str]:
+        if format == "csv":
+            yield _format_csv([EXPORT_COLUMNS])
+        # The request session is closed before the body is sent, so the export
+        # holds its own connection with a server-side cursor
+        async with async_engine.connect() as connection:
+            result = await connection.stream(statement)
+            async for rows in result.partitions():
+                yield format_rows(rows)
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_rows(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="items.{format}"'},
+    )
+
+
+@router.get("/search", response_model=ItemsPublic)
+async def search_items(
+    session: ReadSessionDep,
+    current_user: CurrentUserClaims,
+    q: Annotated[str, Query(min_length=1, max_length=200)],
+    limit: int = 100,
+    cursor: str | None = None,
+) -> Any:
+    """
+    Search items by title and description.
+
+    Items are ranked by relevance, title matches first, and the last word of `q`
+    also matches as a prefix. Queries shorter than 3 characters match anywhere
+    in the title instead, ordered by id. Pass the `next_cursor` of a page as
+    `cursor` to get the following page.
+    """
+    words = re.findall(r"[^\W_]+", q.lower())
+    if not words:
+        return TimedORJSONResponse(
+            {"data": [], "count": None, "count_is_estimate": False, "next_cursor": None}
         )
-        count = session.exec(count_statement).one()
-        statement = (
-            select(Item)
-            .where(Item.owner_id == current_user.id)
-            .offset(skip)
-            .limit(limit)
+
+    rank: Any
+    ranked = len(q.strip()) >= SEARCH_FULL_TEXT_MIN_LENGTH
+    if not ranked:
+        # Unranked and in id order, so the scan stops at the page limit
+        pattern = re.sub(r"([\\%_])", r"\\\1", q.strip().lower())
+        condition = func.lower(Item.title).like(f"%{pattern}%")
+        rank = literal(0.0)
+    else:
+        query = func.to_tsquery(
+            SEARCH_CONFIG, " & ".join([*words[:-1], f"{words[-1]}:*"])
         )
-        items = session.exec(statement).all()
+        condition = Item.search_vector.op("@@")(query)  # type: ignore[union-attr]
+        rank = func.ts_rank_cd(Item.search_vector, query)
 
-    return ItemsPublic(data=items, count=count)
+    columns = [*crud.public_columns(Item, ItemPublic), rank.label("rank")]
+    statement = (
+        select(*columns)
+        .where(condition)
+        .order_by(*([rank.desc()] if ranked else []), col(Item.id))
+        .limit(limit)
+    )
+    if not current_user.is_superuser:
+        statement = statement.where(Item.owner_id == current_user.id)
+    if cursor is not None:
+        last = decode_search_cursor(cursor)
+        if last is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        last_rank, last_id = last
+        if ranked:
+            statement = statement.where(
+                or_(rank < last_rank, and_(rank == last_rank, col(Item.id) > last_id))
+            )
+        else:
+            statement = statement.where(col(Item.id) > last_id)
+    rows = (await session.exec(statement)).all()
+
+    items = [row._asdict() for row in rows]
+    for item in items:
+        del item["rank"]
+    next_cursor = None
+    if rows and len(rows) == limit:
+        next_cursor = encode_search_cursor(rows[-1].rank, rows[-1].id)
+    return TimedORJSONResponse(
+        {
+            "data": items,
+            "count": None,
+            "count_is_estimate": False,
+            "next_cursor": next_cursor,
+        }
+    )
 
 
 @router.get("/{id}", response_model=ItemPublic)
-def read_item(session: SessionDep, current_user: CurrentUser, id: int) -> Any:
+async def read_item(
+    session: ReadSessionDep,
+    current_user: CurrentUserClaims,
+    id: int,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> Any:
     """
     Get item by ID.
+
+    Answers 304 Not Modified when `If-None-Match` has the current ETag.
     """
-    item = session.get(Item, id)
-    if not item:
+    if if_none_match is not None:
+        # Index-only lookup of the version, the row is only read on a miss
+        version_statement = select(Item.owner_id, Item.updated_at).where(Item.id == id)
+        version = (await session.exec(version_statement)).first()
+        if not version:
+            raise HTTPException(status_code=404, detail="Item not found")
+        owner_id, updated_at = version
+        if not current_user.is_superuser and (owner_id != current_user.id):
+            raise HTTPException(status_code=400, detail="Not enough permissions")
+        etag = make_etag(id, updated_at)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+    statement = select(*crud.public_columns(Item, ItemPublic)).where(Item.id == id)
+    row = (await session.exec(statement)).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Item not found")
-    if not current_user.is_superuser and (item.owner_id != current_user.id):
+    if not current_user.is_superuser and (row.owner_id != current_user.id):
         raise HTTPException(status_code=400, detail="Not enough permissions")
-    return item
+    return TimedORJSONResponse(
+        row._asdict(), headers={"ETag": make_etag(id, row.updated_at)}
+    )
 
 
 @router.post("/", response_model=ItemPublic)
-def create_item(
+async def create_item(
     *, session: SessionDep, current_user: CurrentUser, item_in: ItemCreate
 ) -> Any:
     """
@@ -62,19 +406,23 @@ def create_item(
     """
     item = Item.model_validate(item_in, update={"owner_id": current_user.id})
     session.add(item)
-    session.commit()
-    session.refresh(item)
+    await crud.async_add_item_counts(
+        session=session,
+        counts={current_user.id: 1},  # type: ignore[dict-item]
+    )
+    await session.commit()
+    await session.refresh(item)
     return item
 
 
 @router.put("/{id}", response_model=ItemPublic)
-def update_item(
+async def update_item(
     *, session: SessionDep, current_user: CurrentUser, id: int, item_in: ItemUpdate
 ) -> Any:
     """
     Update an item.
     """
-    item = session.get(Item, id)
+    item = await session.get(Item, id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     if not current_user.is_superuser and (item.owner_id != current_user.id):
@@ -82,21 +430,27 @@ def update_item(
     update_dict = item_in.model_dump(exclude_unset=True)
     item.sqlmodel_update(update_dict)
     session.add(item)
-    session.commit()
-    session.refresh(item)
+    await session.commit()
+    await session.refresh(item)
     return item
 
 
 @router.delete("/{id}")
-def delete_item(session: SessionDep, current_user: CurrentUser, id: int) -> Message:
+async def delete_item(
+    session: SessionDep, current_user: CurrentUser, id: int
+) -> Message:
     """
     Delete an item.
     """
-    item = session.get(Item, id)
+    item = await session.get(Item, id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     if not current_user.is_superuser and (item.owner_id != current_user.id):
         raise HTTPException(status_code=400, detail="Not enough permissions")
-    session.delete(item)
-    session.commit()
+    await session.delete(item)
+    await crud.async_add_item_counts(
+        session=session,
+        counts={item.owner_id: -1},  # type: ignore[dict-item]
+    )
+    await session.commit()
     return Message(message="Item deleted successfully")
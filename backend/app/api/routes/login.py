@@ -1,50 +1,150 @@
+import secrets
 from datetime import timedelta
 from typing import Annotated, Any
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import HTMLResponse
 from fastapi.security import OAuth2PasswordRequestForm
 
 from app import crud
-from app.api.deps import CurrentUser, SessionDep, get_current_active_superuser
+from app.api.deps import (
+    CurrentUser,
+    SessionDep,
+    TokenDep,
+    get_access_token_payload,
+    get_current_active_superuser,
+    get_token_payload,
+)
 from app.core import security
+from app.core.cache import async_invalidate_user
 from app.core.config import settings
-from app.core.security import get_password_hash
-from app.models import Message, NewPassword, Token, UserPublic
+from app.core.ratelimit import (
+    account_failure_rate_limiter,
+    account_rate_limiter,
+    check_rate_limits,
+    ip_rate_limiter,
+)
+from app.core.revocation import (
+    token_denylist,
+    token_revocation,
+    user_tokens_revocation,
+)
+from app.core.security import async_get_password_hash
+from app.models import Message, NewPassword, RefreshToken, Token, User, UserPublic
 from app.utils import (
     generate_password_reset_token,
     generate_reset_password_email,
-    send_email,
     verify_password_reset_token,
 )
 
 router = APIRouter()
 
 
+def client_ip(request: Request) -> str:
+    # The proxy's address unless uvicorn runs with --proxy-headers
+    return request.client.host if request.client else "unknown"
+
+
+def create_tokens(user: User, sid: str | None = None) -> Token:
+    """Tokens of a new session, or of the session `sid` when refreshing it."""
+    session_claims = {"sid": sid or secrets.token_urlsafe(16)}
+    if not settings.AUTH_STATELESS:
+        access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        return Token(
+            access_token=security.create_access_token(
+                user.id, expires_delta=access_token_expires, claims=session_claims
+            )
+        )
+    return Token(
+        access_token=security.create_access_token(
+            user.id,
+            expires_delta=timedelta(
+                minutes=settings.STATELESS_ACCESS_TOKEN_EXPIRE_MINUTES
+            ),
+            claims={
+                **session_claims,
+                "is_active": user.is_active,
+                "is_superuser": user.is_superuser,
+            },
+        ),
+        refresh_token=security.create_refresh_token(
+            user.id,
+            expires_delta=timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES),
+            claims=session_claims,
+        ),
+    )
+
+
 @router.post("/login/access-token")
-def login_access_token(
-    session: SessionDep, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
+async def login_access_token(
+    request: Request,
+    session: SessionDep,
+    form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
 ) -> Token:
     """
     OAuth2 compatible token login, get an access token for future requests
     """
-    user = crud.authenticate(
+    # Before bcrypt runs, so guessing passwords can't tie up the hashing threads.
+    # The account is limited per client IP, so failing from one address can't
+    # lock the owner out from theirs, and its failures from every IP are capped.
+    ip = client_ip(request)
+    account = f"login:{form_data.username.lower()}"
+    await check_rate_limits((account_failure_rate_limiter, account), take=False)
+    await check_rate_limits(
+        (ip_rate_limiter, ip), (account_rate_limiter, f"{account}:{ip}")
+    )
+    user = await crud.async_authenticate(
         session=session, email=form_data.username, password=form_data.password
     )
     if not user:
+        await account_failure_rate_limiter.take(account)
         raise HTTPException(status_code=400, detail="Incorrect email or password")
     elif not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    return Token(
-        access_token=security.create_access_token(
-            user.id, expires_delta=access_token_expires
-        )
-    )
+    await account_rate_limiter.reset(f"{account}:{ip}")
+    return create_tokens(user)
+
+
+@router.post("/login/refresh-token")
+async def refresh_access_token(session: SessionDep, body: RefreshToken) -> Token:
+    """
+    New tokens for a refresh token, with the user's current claims
+    """
+    if not settings.AUTH_STATELESS:
+        raise HTTPException(status_code=404, detail="Refresh tokens are not enabled")
+    token_data = await get_token_payload(body.refresh_token)
+    if token_data.type != "refresh":
+        raise HTTPException(status_code=403, detail="Could not validate credentials")
+    user = await session.get(User, token_data.sub)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    elif not user.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return create_tokens(user, sid=token_data.sid)
+
+
+@router.post("/logout")
+async def logout(
+    session: SessionDep, token: TokenDep, body: RefreshToken | None = None
+) -> Message:
+    """
+    Revoke the access token, and the refresh token when given
+    """
+    token_data = await get_access_token_payload(token)
+    revocations = [token_revocation(token_data)]
+    if body is not None:
+        refresh_data = await get_token_payload(body.refresh_token)
+        if refresh_data.type != "refresh" or refresh_data.sub != token_data.sub:
+            raise HTTPException(
+                status_code=403, detail="Could not validate credentials"
+            )
+        revocations.append(token_revocation(refresh_data))
+    await crud.async_revoke_tokens(session=session, revocations=revocations)
+    return Message(message="Logged out")
 
 
 @router.post("/login/test-token", response_model=UserPublic)
-def test_token(current_user: CurrentUser) -> Any:
+async def test_token(current_user: CurrentUser) -> Any:
     """
     Test access token
     """
@@ -52,11 +152,17 @@ def test_token(current_user: CurrentUser) -> Any:
 
 
 @router.post("/password-recovery/{email}")
-def recover_password(email: str, session: SessionDep) -> Message:
+async def recover_password(
+    request: Request, email: str, session: SessionDep
+) -> Message:
     """
     Password Recovery
     """
-    user = crud.get_user_by_email(session=session, email=email)
+    await check_rate_limits(
+        (ip_rate_limiter, client_ip(request)),
+        (account_rate_limiter, f"recovery:{email.lower()}"),
+    )
+    user = await crud.async_get_user_by_email(session=session, email=email)
 
     if not user:
         raise HTTPException(
@@ -67,7 +173,8 @@ def recover_password(email: str, session: SessionDep) -> Message:
     email_data = generate_reset_password_email(
         email_to=user.email, email=email, token=password_reset_token
     )
-    send_email(
+    await crud.async_enqueue_email(
+        session=session,
         email_to=user.email,
         subject=email_data.subject,
         html_content=email_data.html_content,
@@ -76,14 +183,17 @@ def recover_password(email: str, session: SessionDep) -> Message:
 
 
 @router.post("/reset-password/")
-def reset_password(session: SessionDep, body: NewPassword) -> Message:
+async def reset_password(
+    request: Request, session: SessionDep, body: NewPassword
+) -> Message:
     """
     Reset password
     """
+    await check_rate_limits((ip_rate_limiter, client_ip(request)))
     email = verify_password_reset_token(token=body.token)
     if not email:
         raise HTTPException(status_code=400, detail="Invalid token")
-    user = crud.get_user_by_email(session=session, email=email)
+    user = await crud.async_get_user_by_email(session=session, email=email)
     if not user:
         raise HTTPException(
             status_code=404,
@@ -91,10 +201,14 @@ def reset_password(session: SessionDep, body: NewPassword) -> Message:
         )
     elif not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    hashed_password = get_password_hash(password=body.new_password)
+    hashed_password = await async_get_password_hash(password=body.new_password)
     user.hashed_password = hashed_password
-    session.add(user)
-    session.commit()
+    # Whoever took over the account loses its sessions
+    revocation = user_tokens_revocation(user.id)
+    session.add_all([user, revocation])
+    await session.commit()
+    await async_invalidate_user(user.id)
+    token_denylist.revoke(revocation)
     return Message(message="Password updated successfully")
 
 
@@ -103,11 +217,11 @@ def reset_password(session: SessionDep, body: NewPassword) -> Message:
     dependencies=[Depends(get_current_active_superuser)],
     response_class=HTMLResponse,
 )
-def recover_password_html_content(email: str, session: SessionDep) -> Any:
+async def recover_password_html_content(email: str, session: SessionDep) -> Any:
     """
     HTML Content for Password Recovery
     """
-    user = crud.get_user_by_email(session=session, email=email)
+    user = await crud.async_get_user_by_email(session=session, email=email)
 
     if not user:
         raise HTTPException(
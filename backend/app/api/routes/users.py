@@ -1,81 +1,135 @@
-from typing import Any
+from typing import Annotated, Any
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import col, delete, func, select
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlmodel import col, select
 
 from app import crud
 from app.api.deps import (
     CurrentUser,
+    CurrentUserClaims,
+    ReadSessionDep,
     SessionDep,
+    TokenDep,
+    get_access_token_payload,
     get_current_active_superuser,
+    get_current_active_superuser_claims,
 )
+from app.core.cache import async_invalidate_user
 from app.core.config import settings
-from app.core.security import get_password_hash, verify_password
+from app.core.revocation import token_denylist, user_tokens_revocation
+from app.core.security import async_get_password_hash, async_verify_password
+from app.core.timing import TimedORJSONResponse
 from app.models import (
-    Item,
     Message,
     UpdatePassword,
     User,
     UserCreate,
+    UserDeletion,
+    UserDeletionPublic,
     UserPublic,
     UserRegister,
     UsersPublic,
     UserUpdate,
     UserUpdateMe,
 )
-from app.utils import generate_new_account_email, send_email
+from app.utils import (
+    decode_cursor,
+    encode_cursor,
+    etag_matches,
+    generate_new_account_email,
+    make_etag,
+)
 
 router = APIRouter()
 
 
 @router.get(
     "/",
-    dependencies=[Depends(get_current_active_superuser)],
+    dependencies=[Depends(get_current_active_superuser_claims)],
     response_model=UsersPublic,
 )
-def read_users(session: SessionDep, skip: int = 0, limit: int = 100) -> Any:
+async def read_users(
+    session: ReadSessionDep,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    include_count: bool = True,
+) -> Any:
     """
     Retrieve users.
+
+    Users are ordered by id. Pass the `next_cursor` of a page as `cursor` to get
+    the following page by keyset instead of `skip`. Set `include_count` to false
+    to skip the total, e.g. after the first page.
     """
 
-    count_statement = select(func.count()).select_from(User)
-    count = session.exec(count_statement).one()
+    count, count_is_estimate = None, False
+    if include_count:
+        count, count_is_estimate = await crud.async_count_rows(
+            session=session, model=User, where=col(User.deleted_at).is_(None)
+        )
 
-    statement = select(User).offset(skip).limit(limit)
-    users = session.exec(statement).all()
+    statement = (
+        select(*crud.public_columns(User, UserPublic))
+        .where(col(User.deleted_at).is_(None))
+        .order_by(col(User.id))
+        .limit(limit)
+    )
+    if cursor is not None:
+        last_id = decode_cursor(cursor)
+        if last_id is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        statement = statement.where(col(User.id) > last_id)
+    else:
+        statement = statement.offset(skip)
+    users = [row._asdict() for row in (await session.exec(statement)).all()]
 
-    return UsersPublic(data=users, count=count)
+    next_cursor = None
+    if users and len(users) == limit:
+        next_cursor = encode_cursor(users[-1]["id"])
+    return TimedORJSONResponse(
+        {
+            "data": users,
+            "count": count,
+            "count_is_estimate": count_is_estimate,
+            "next_cursor": next_cursor,
+        }
+    )
 
 
 @router.post(
     "/", dependencies=[Depends(get_current_active_superuser)], response_model=UserPublic
 )
-def create_user(*, session: SessionDep, user_in: UserCreate) -> Any:
+async def create_user(*, session: SessionDep, user_in: UserCreate) -> Any:
     """
     Create new user.
     """
-    user = crud.get_user_by_email(session=session, email=user_in.email)
+    user = await crud.async_get_user_by_email(session=session, email=user_in.email)
     if user:
         raise HTTPException(
             status_code=400,
             detail="The user with this email already exists in the system.",
         )
 
-    user = crud.create_user(session=session, user_create=user_in)
+    email = None
     if settings.emails_enabled and user_in.email:
         email_data = generate_new_account_email(
             email_to=user_in.email, username=user_in.email, password=user_in.password
         )
-        send_email(
+        email = crud.outbox_email(
             email_to=user_in.email,
             subject=email_data.subject,
             html_content=email_data.html_content,
         )
+    # Committed together, so the user is never created without the email
+    user = await crud.async_create_user(
+        session=session, user_create=user_in, email=email
+    )
     return user
 
 
 @router.patch("/me", response_model=UserPublic)
-def update_user_me(
+async def update_user_me(
     *, session: SessionDep, user_in: UserUpdateMe, current_user: CurrentUser
 ) -> Any:
     """
@@ -83,7 +137,9 @@ def update_user_me(
     """
 
     if user_in.email:
-        existing_user = crud.get_user_by_email(session=session, email=user_in.email)
+        existing_user = await crud.async_get_user_by_email(
+            session=session, email=user_in.email
+        )
         if existing_user and existing_user.id != current_user.id:
             raise HTTPException(
                 status_code=409, detail="User with this email already exists"
@@ -91,41 +147,66 @@ def update_user_me(
     user_data = user_in.model_dump(exclude_unset=True)
     current_user.sqlmodel_update(user_data)
     session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
+    await session.commit()
+    await session.refresh(current_user)
+    await async_invalidate_user(current_user.id)
     return current_user
 
 
 @router.patch("/me/password", response_model=Message)
-def update_password_me(
-    *, session: SessionDep, body: UpdatePassword, current_user: CurrentUser
+async def update_password_me(
+    *,
+    session: SessionDep,
+    body: UpdatePassword,
+    current_user: CurrentUser,
+    token: TokenDep,
 ) -> Any:
     """
-    Update own password.
+    Update own password, the other sessions of the user end. The tokens of the
+    current session stay valid, its refresh token included.
     """
-    if not verify_password(body.current_password, current_user.hashed_password):
+    if not await async_verify_password(
+        body.current_password, current_user.hashed_password
+    ):
         raise HTTPException(status_code=400, detail="Incorrect password")
     if body.current_password == body.new_password:
         raise HTTPException(
             status_code=400, detail="New password cannot be the same as the current one"
         )
-    hashed_password = get_password_hash(body.new_password)
+    hashed_password = await async_get_password_hash(body.new_password)
     current_user.hashed_password = hashed_password
-    session.add(current_user)
-    session.commit()
+    revocation = user_tokens_revocation(
+        current_user.id, keep=await get_access_token_payload(token)
+    )
+    session.add_all([current_user, revocation])
+    await session.commit()
+    await async_invalidate_user(current_user.id)
+    token_denylist.revoke(revocation)
     return Message(message="Password updated successfully")
 
 
 @router.get("/me", response_model=UserPublic)
-def read_user_me(current_user: CurrentUser) -> Any:
+async def read_user_me(
+    response: Response,
+    current_user: CurrentUser,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> Any:
     """
     Get current user.
+
+    Answers 304 Not Modified when `If-None-Match` has the current ETag.
     """
+    etag = make_etag(current_user.id, current_user.updated_at)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return current_user
 
 
 @router.delete("/me", response_model=Message)
-def delete_user_me(session: SessionDep, current_user: CurrentUser) -> Any:
+async def delete_user_me(
+    response: Response, session: SessionDep, current_user: CurrentUser
+) -> Any:
     """
     Delete own user.
     """
@@ -133,15 +214,14 @@ def delete_user_me(session: SessionDep, current_user: CurrentUser) -> Any:
         raise HTTPException(
             status_code=403, detail="Super users are not allowed to delete themselves"
         )
-    statement = delete(Item).where(col(Item.owner_id) == current_user.id)
-    session.exec(statement)  # type: ignore
-    session.delete(current_user)
-    session.commit()
+    if not await crud.async_delete_user(session=session, db_user=current_user):
+        response.status_code = 202
+        return Message(message="User deletion started")
     return Message(message="User deleted successfully")
 
 
 @router.post("/signup", response_model=UserPublic)
-def register_user(session: SessionDep, user_in: UserRegister) -> Any:
+async def register_user(session: SessionDep, user_in: UserRegister) -> Any:
     """
     Create new user without the need to be logged in.
     """
@@ -150,32 +230,36 @@ def register_user(session: SessionDep, user_in: UserRegister) -> Any:
             status_code=403,
             detail="Open user registration is forbidden on this server",
         )
-    user = crud.get_user_by_email(session=session, email=user_in.email)
+    user = await crud.async_get_user_by_email(session=session, email=user_in.email)
     if user:
         raise HTTPException(
             status_code=400,
             detail="The user with this email already exists in the system",
         )
     user_create = UserCreate.model_validate(user_in)
-    user = crud.create_user(session=session, user_create=user_create)
+    user = await crud.async_create_user(session=session, user_create=user_create)
     return user
 
 
 @router.get("/{user_id}", response_model=UserPublic)
-def read_user_by_id(
-    user_id: int, session: SessionDep, current_user: CurrentUser
+async def read_user_by_id(
+    user_id: int, session: ReadSessionDep, current_user: CurrentUserClaims
 ) -> Any:
     """
     Get a specific user by id.
     """
-    user = session.get(User, user_id)
-    if user == current_user:
+    user = await session.get(User, user_id)
+    if user is not None and user.deleted_at is not None:
+        user = None
+    if user is not None and user.id == current_user.id:
         return user
     if not current_user.is_superuser:
         raise HTTPException(
             status_code=403,
             detail="The user doesn't have enough privileges",
         )
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
     return user
 
 
@@ -184,7 +268,7 @@ def read_user_by_id(
     dependencies=[Depends(get_current_active_superuser)],
     response_model=UserPublic,
 )
-def update_user(
+async def update_user(
     *,
     session: SessionDep,
     user_id: int,
@@ -194,39 +278,64 @@ def update_user(
     Update a user.
     """
 
-    db_user = session.get(User, user_id)
+    db_user = await session.get(User, user_id)
     if not db_user:
         raise HTTPException(
             status_code=404,
             detail="The user with this id does not exist in the system",
         )
+    if db_user.deleted_at is not None:
+        raise HTTPException(status_code=409, detail="User deletion in progress")
     if user_in.email:
-        existing_user = crud.get_user_by_email(session=session, email=user_in.email)
+        existing_user = await crud.async_get_user_by_email(
+            session=session, email=user_in.email
+        )
         if existing_user and existing_user.id != user_id:
             raise HTTPException(
                 status_code=409, detail="User with this email already exists"
             )
 
-    db_user = crud.update_user(session=session, db_user=db_user, user_in=user_in)
+    db_user = await crud.async_update_user(
+        session=session, db_user=db_user, user_in=user_in
+    )
     return db_user
 
 
 @router.delete("/{user_id}", dependencies=[Depends(get_current_active_superuser)])
-def delete_user(
-    session: SessionDep, current_user: CurrentUser, user_id: int
+async def delete_user(
+    response: Response, session: SessionDep, current_user: CurrentUser, user_id: int
 ) -> Message:
     """
     Delete a user.
+
+    Users with many items are deactivated and answered with 202, their items are
+    deleted in the background. Follow the progress at `/users/{user_id}/deletion`.
     """
-    user = session.get(User, user_id)
+    user = await session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if user == current_user:
         raise HTTPException(
             status_code=403, detail="Super users are not allowed to delete themselves"
         )
-    statement = delete(Item).where(col(Item.owner_id) == user_id)
-    session.exec(statement)  # type: ignore
-    session.delete(user)
-    session.commit()
+    if user.deleted_at is not None:
+        raise HTTPException(status_code=409, detail="User deletion already started")
+    if not await crud.async_delete_user(session=session, db_user=user):
+        response.status_code = 202
+        return Message(message="User deletion started")
     return Message(message="User deleted successfully")
+
+
+@router.get(
+    "/{user_id}/deletion",
+    dependencies=[Depends(get_current_active_superuser_claims)],
+    response_model=UserDeletionPublic,
+)
+async def read_user_deletion(session: SessionDep, user_id: int) -> Any:
+    """
+    Get the progress of a user deletion running in the background.
+    """
+    deletion = await session.get(UserDeletion, user_id)
+    if not deletion:
+        raise HTTPException(status_code=404, detail="User deletion not found")
+    return deletion
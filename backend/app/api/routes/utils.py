@@ -1,9 +1,18 @@
 from fastapi import APIRouter, Depends
 from pydantic.networks import EmailStr
 
-from app.api.deps import get_current_active_superuser
-from app.models import Message
-from app.utils import generate_test_email, send_email
+from app import crud
+from app.api.deps import (
+    SessionDep,
+    get_current_active_superuser,
+    get_current_active_superuser_claims,
+)
+from app.core.cache import token_cache, user_cache
+from app.core.config import settings
+from app.core.db import async_engine
+from app.core.pool import InstrumentedQueuePool, pool_stats
+from app.models import CacheStats, DatabasePoolStats, Message
+from app.utils import generate_test_email
 
 router = APIRouter()
 
@@ -13,14 +22,48 @@ router = APIRouter()
     dependencies=[Depends(get_current_active_superuser)],
     status_code=201,
 )
-def test_email(email_to: EmailStr) -> Message:
+async def test_email(session: SessionDep, email_to: EmailStr) -> Message:
     """
     Test emails.
     """
     email_data = generate_test_email(email_to=email_to)
-    send_email(
+    await crud.async_enqueue_email(
+        session=session,
         email_to=email_to,
         subject=email_data.subject,
         html_content=email_data.html_content,
     )
     return Message(message="Test email sent")
+
+
+@router.get(
+    "/cache-stats/",
+    dependencies=[Depends(get_current_active_superuser_claims)],
+)
+def cache_stats() -> dict[str, CacheStats]:
+    """
+    Hit and miss counters of this worker's caches.
+    """
+    return {
+        "users": CacheStats(**user_cache.stats()),
+        "tokens": CacheStats(**token_cache.stats()),
+    }
+
+
+@router.get(
+    "/db-pool-stats/",
+    dependencies=[Depends(get_current_active_superuser_claims)],
+)
+def db_pool_stats() -> DatabasePoolStats:
+    """
+    Connection pool usage of this worker, to size pools against max_connections.
+    """
+    pool = async_engine.pool
+    assert isinstance(pool, InstrumentedQueuePool)
+    return DatabasePoolStats(
+        pool_size=pool.size(),
+        max_overflow=settings.POSTGRES_MAX_OVERFLOW,
+        checked_out=pool.checkedout(),
+        overflow=max(pool.overflow(), 0),
+        **pool_stats.snapshot(),
+    )
@@ -0,0 +1,117 @@
+"""
+Picks the password hash cost that takes about a target time on this host.
+
+Run it on the production hardware and copy the printed settings into the
+environment:
+
+    python app/calibrate_password_hash.py --target-ms 250
+    python app/calibrate_password_hash.py --scheme argon2 --target-ms 250
+
+Hashes made with the previous settings are replaced at each user's next login.
+"""
+
+import argparse
+import statistics
+import time
+from collections.abc import Callable
+
+from passlib.hash import argon2, bcrypt
+
+from app.core.config import settings
+
+# Fewer rounds or passes than these are too weak whatever the timing says
+BCRYPT_MIN_ROUNDS = 10
+BCRYPT_MAX_ROUNDS = 20
+ARGON2_MIN_TIME_COST = 2
+ARGON2_MAX_TIME_COST = 20
+
+
+def _hash_ms(hash: Callable[[str], str], samples: int) -> float:
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hash("calibration password")
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def calibrate_bcrypt(target_ms: float, samples: int) -> tuple[int, float]:
+    """Highest rounds hashing within the target, with its time in ms."""
+    rounds = BCRYPT_MIN_ROUNDS
+    elapsed = _hash_ms(bcrypt.using(rounds=rounds).hash, samples)
+    while rounds < BCRYPT_MAX_ROUNDS:
+        # Every round doubles the time, stop before going over
+        if elapsed * 2 > target_ms:
+            break
+        rounds += 1
+        elapsed = _hash_ms(bcrypt.using(rounds=rounds).hash, samples)
+    return rounds, elapsed
+
+
+def calibrate_argon2(
+    target_ms: float, samples: int, *, memory_cost_kib: int, parallelism: int
+) -> tuple[int, float]:
+    """Highest time cost hashing within the target, with its time in ms."""
+
+    # Handlers derived with using() before the backend is loaded can't hash
+    argon2.get_backend()  # type: ignore[no-untyped-call]
+
+    def hash_ms(time_cost: int) -> float:
+        handler = argon2.using(  # type: ignore[no-untyped-call]
+            rounds=time_cost, memory_cost=memory_cost_kib, parallelism=parallelism
+        )
+        return _hash_ms(handler.hash, samples)
+
+    time_cost = ARGON2_MIN_TIME_COST
+    elapsed = hash_ms(time_cost)
+    while time_cost < ARGON2_MAX_TIME_COST:
+        # Each pass adds about the same time
+        if elapsed * (time_cost + 1) / time_cost > target_ms:
+            break
+        time_cost += 1
+        elapsed = hash_ms(time_cost)
+    return time_cost, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--scheme",
+        choices=["bcrypt", "argon2"],
+        default=settings.PASSWORD_HASH_SCHEME,
+    )
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--samples", type=int, default=3)
+    parser.add_argument(
+        "--memory-cost-kib", type=int, default=settings.PASSWORD_ARGON2_MEMORY_COST_KIB
+    )
+    parser.add_argument(
+        "--parallelism", type=int, default=settings.PASSWORD_ARGON2_PARALLELISM
+    )
+    args = parser.parse_args()
+
+    print(f"PASSWORD_HASH_SCHEME={args.scheme}")
+    if args.scheme == "bcrypt":
+        rounds, elapsed = calibrate_bcrypt(args.target_ms, args.samples)
+        at_minimum = rounds == BCRYPT_MIN_ROUNDS
+        print(f"PASSWORD_BCRYPT_ROUNDS={rounds}")
+    else:
+        time_cost, elapsed = calibrate_argon2(
+            args.target_ms,
+            args.samples,
+            memory_cost_kib=args.memory_cost_kib,
+            parallelism=args.parallelism,
+        )
+        at_minimum = time_cost == ARGON2_MIN_TIME_COST
+        print(f"PASSWORD_ARGON2_TIME_COST={time_cost}")
+        print(f"PASSWORD_ARGON2_MEMORY_COST_KIB={args.memory_cost_kib}")
+        print(f"PASSWORD_ARGON2_PARALLELISM={args.parallelism}")
+    print(f"# {elapsed:.0f} ms per hash on this host, target {args.target_ms:.0f} ms")
+    if at_minimum and elapsed > args.target_ms:
+        print("# The minimum cost is over the target, the host is too slow for it")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,755 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+from typing import Any, BinaryIO, Generic, TypeVar
+from urllib.parse import urlsplit
+
+import anyio
+import psycopg
+from psycopg import sql
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.core.metrics import cache_lookups
+from app.models import CachedUser, TokenPayload
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class CacheBackend(ABC):
+    """
+    Store of cached values with a time to live and tags.
+
+    Entries sharing a tag are invalidated together. Hits and misses are counted
+    per process. The stores shared between processes need string keys and keep
+    values as JSON, instances of `model` when it is given.
+
+    The async methods are for the event loop, stores doing I/O run them in a
+    worker thread.
+    """
+
+    # Whether get and set do I/O, which must not block the event loop
+    blocking = True
+
+    def __init__(
+        self,
+        *,
+        maxsize: int,
+        ttl: float,
+        name: str = "default",
+        model: type[BaseModel] | None = None,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+        self._hit_metric = cache_lookups.labels(name, "hit")
+        self._miss_metric = cache_lookups.labels(name, "miss")
+
+    @abstractmethod
+    def __len__(self) -> int: ...
+
+    def _count(self, *, hit: bool) -> None:
+        with self._counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        (self._hit_metric if hit else self._miss_metric).inc()
+
+    def _entry_ttl(self, ttl: float | None) -> float | None:
+        """TTL of a new entry, None when it should not be stored."""
+        ttl = self.ttl if ttl is None else ttl
+        if self.maxsize <= 0 or ttl <= 0:
+            return None
+        return ttl
+
+    def _dumps(self, value: Any) -> str:
+        if self.model is not None:
+            return self.model.model_validate(value).model_dump_json()
+        return json.dumps(value)
+
+    def _loads(self, data: str | bytes) -> Any:
+        if self.model is not None:
+            return self.model.model_validate_json(data)
+        return json.loads(data)
+
+    def _failed(self, operation: str, error: Exception) -> None:
+        # An unavailable store must not fail the requests, they go without it
+        logger.warning(f"Cache {self.name} {operation} failed: {error}")
+
+    @abstractmethod
+    def get(self, key: Any) -> Any: ...
+
+    @abstractmethod
+    def set(
+        self, key: Any, value: Any, ttl: float | None = None, tags: Iterable[str] = ()
+    ) -> None: ...
+
+    def delete(self, key: Any) -> None:
+        self.delete_many([key])
+
+    @abstractmethod
+    def delete_many(self, keys: Iterable[Any]) -> None: ...
+
+    @abstractmethod
+    def invalidate_tags(self, *tags: str) -> None: ...
+
+    @abstractmethod
+    def clear(self) -> None: ...
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        if not self.blocking:
+            return func(*args)
+        return await anyio.to_thread.run_sync(func, *args)
+
+    async def aget(self, key: Any) -> Any:
+        return await self._run(self.get, key)
+
+    async def aset(
+        self, key: Any, value: Any, ttl: float | None = None, tags: Iterable[str] = ()
+    ) -> None:
+        await self._run(self.set, key, value, ttl, tags)
+
+    async def adelete(self, key: Any) -> None:
+        await self._run(self.delete, key)
+
+    async def ainvalidate_tags(self, *tags: str) -> None:
+        await self._run(self.invalidate_tags, *tags)
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self),
+            "maxsize": self.maxsize,
+        }
+
+
+class TTLCache(CacheBackend, Generic[K, V]):
+    """
+    Thread-safe LRU mapping whose entries expire after a time to live.
+
+    Values are kept as they are, `model` is ignored.
+    """
+
+    blocking = False
+
+    def __init__(
+        self,
+        *,
+        maxsize: int,
+        ttl: float,
+        name: str = "default",
+        model: type[BaseModel] | None = None,
+    ) -> None:
+        super().__init__(maxsize=maxsize, ttl=ttl, name=name, model=model)
+        self._data: OrderedDict[K, tuple[float, V, tuple[str, ...]]] = OrderedDict()
+        self._tags: dict[str, set[K]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _remove(self, key: K) -> None:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(key)
+        self._count(hit=entry is not None)
+        return None if entry is None else entry[1]
+
+    def set(
+        self, key: K, value: V, ttl: float | None = None, tags: Iterable[str] = ()
+    ) -> None:
+        entry_ttl = self._entry_ttl(ttl)
+        if entry_ttl is None:
+            return
+        tags = tuple(tags)
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (time.monotonic() + entry_ttl, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+
+    def delete_many(self, keys: Iterable[K]) -> None:
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+
+    def invalidate_tags(self, *tags: str) -> None:
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+
+
+class SharedMemoryCache(CacheBackend):
+    """
+    Cache shared by the workers of a host, kept in SQLite on a tmpfs.
+
+    Each process opens its own connections, WAL mode lets readers run alongside
+    the writer. When full, the entries closest to expiring are evicted first.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        *,
+        maxsize: int,
+        ttl: float,
+        model: type[BaseModel] | None = None,
+    ) -> None:
+        super().__init__(maxsize=maxsize, ttl=ttl, name=name, model=model)
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not cross a fork, e.g. with gunicorn --preload
+        if getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entry (name TEXT, key TEXT, "
+                "value BLOB, expires_at REAL, PRIMARY KEY (name, key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_tag (name TEXT, tag TEXT, "
+                "key TEXT, PRIMARY KEY (name, tag, key))"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        connection: sqlite3.Connection = self._local.conn
+        return connection
+
+    def __len__(self) -> int:
+        try:
+            row = (
+                self._connection()
+                .execute(
+                    "SELECT count(*) FROM cache_entry "
+                    "WHERE name = ? AND expires_at > ?",
+                    (self.name, time.time()),
+                )
+                .fetchone()
+            )
+        except sqlite3.Error as e:
+            self._failed("count", e)
+            return 0
+        return int(row[0])
+
+    def get(self, key: str) -> Any:
+        try:
+            row = (
+                self._connection()
+                .execute(
+                    "SELECT value FROM cache_entry "
+                    "WHERE name = ? AND key = ? AND expires_at > ?",
+                    (self.name, key, time.time()),
+                )
+                .fetchone()
+            )
+            value = None if row is None else self._loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            self._failed("get", e)
+            value = None
+        self._count(hit=value is not None)
+        return value
+
+    def set(
+        self, key: str, value: Any, ttl: float | None = None, tags: Iterable[str] = ()
+    ) -> None:
+        entry_ttl = self._entry_ttl(ttl)
+        if entry_ttl is None:
+            return
+        data = self._dumps(value)
+        now = time.time()
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entry VALUES (?, ?, ?, ?)",
+                    (self.name, key, data, now + entry_ttl),
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO cache_tag VALUES (?, ?, ?)",
+                    [(self.name, tag, key) for tag in tags],
+                )
+                (size,) = conn.execute(
+                    "SELECT count(*) FROM cache_entry WHERE name = ?", (self.name,)
+                ).fetchone()
+                if size > self.maxsize:
+                    self._evict(conn, now, size - self.maxsize)
+        except sqlite3.Error as e:
+            self._failed("set", e)
+
+    def _evict(self, conn: sqlite3.Connection, now: float, excess: int) -> None:
+        conn.execute(
+            "DELETE FROM cache_entry WHERE name = ? AND key IN ("
+            "SELECT key FROM cache_entry WHERE name = ? "
+            "ORDER BY expires_at > ?, expires_at LIMIT ?)",
+            (self.name, self.name, now, excess),
+        )
+        conn.execute(
+            "DELETE FROM cache_tag WHERE name = ? AND key NOT IN ("
+            "SELECT key FROM cache_entry WHERE name = ?)",
+            (self.name, self.name),
+        )
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        params = [(self.name, key) for key in keys]
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "DELETE FROM cache_entry WHERE name = ? AND key = ?", params
+                )
+                conn.executemany(
+                    "DELETE FROM cache_tag WHERE name = ? AND key = ?", params
+                )
+        except sqlite3.Error as e:
+            self._failed("delete", e)
+
+    def invalidate_tags(self, *tags: str) -> None:
+        params = [(self.name, self.name, tag) for tag in tags]
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "DELETE FROM cache_entry WHERE name = ? AND key IN ("
+                    "SELECT key FROM cache_tag WHERE name = ? AND tag = ?)",
+                    params,
+                )
+                conn.executemany(
+                    "DELETE FROM cache_tag WHERE name = ? AND key IN ("
+                    "SELECT key FROM cache_tag WHERE name = ? AND tag = ?)",
+                    params,
+                )
+        except sqlite3.Error as e:
+            self._failed("invalidation", e)
+
+    def clear(self) -> None:
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("DELETE FROM cache_entry WHERE name = ?", (self.name,))
+                conn.execute("DELETE FROM cache_tag WHERE name = ?", (self.name,))
+        except sqlite3.Error as e:
+            self._failed("clear", e)
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisClient:
+    """Minimal blocking client of the Redis protocol (RESP2)."""
+
+    def __init__(self, url: str, *, timeout: float = 2.0) -> None:
+        parsed = urlsplit(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._sock: socket.socket | None = None
+        self._reader: BinaryIO | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> BinaryIO:
+        if self._reader is not None:
+            return self._reader
+        self._sock = socket.create_connection(
+            (self.host, self.port), timeout=self.timeout
+        )
+        self._reader = self._sock.makefile("rb")
+        if self.password:
+            self._command("AUTH", self.password)
+        if self.db:
+            self._command("SELECT", self.db)
+        return self._reader
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = None
+        self._reader = None
+
+    def execute(self, *args: Any) -> Any:
+        with self._lock:
+            try:
+                return self._command(*args)
+            except OSError:
+                # The server may have closed an idle connection, retry once
+                self.close()
+                return self._command(*args)
+
+    def _command(self, *args: Any) -> Any:
+        reader = self._connect()
+        parts = [a if isinstance(a, bytes) else str(a).encode() for a in args]
+        payload = b"*%d\r\n" % len(parts) + b"".join(
+            b"$%d\r\n%s\r\n" % (len(part), part) for part in parts
+        )
+        assert self._sock is not None
+        self._sock.sendall(payload)
+        return self._read_reply(reader)
+
+    def _read_reply(self, reader: BinaryIO) -> Any:
+        line = reader.readline()
+        if not line:
+            self.close()
+            raise ConnectionError("Connection closed by the Redis server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            return reader.read(length + 2)[:-2]
+        if kind == b"*":
+            length = int(rest)
+            if length == -1:
+                return None
+            return [self._read_reply(reader) for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+
+class RedisCache(CacheBackend):
+    """
+    Cache shared by every worker of the deployment, kept in Redis.
+
+    maxsize is only reported, eviction is left to the server's maxmemory-policy.
+    """
+
+    def __init__(
+        self,
+        client: RedisClient,
+        name: str,
+        *,
+        maxsize: int,
+        ttl: float,
+        model: type[BaseModel] | None = None,
+    ) -> None:
+        super().__init__(maxsize=maxsize, ttl=ttl, name=name, model=model)
+        self.client = client
+        self.prefix = f"cache:{name}:"
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}entry:{key}"
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{self.prefix}tag:{tag}"
+
+    def _scan(self, pattern: str) -> list[bytes]:
+        keys: list[bytes] = []
+        cursor = b"0"
+        while True:
+            cursor, batch = self.client.execute(
+                "SCAN", cursor, "MATCH", pattern, "COUNT", 1000
+            )
+            keys.extend(batch)
+            if cursor == b"0":
+                return keys
+
+    def __len__(self) -> int:
+        try:
+            return len(self._scan(f"{self.prefix}entry:*"))
+        except (OSError, RedisError) as e:
+            self._failed("count", e)
+            return 0
+
+    def get(self, key: str) -> Any:
+        try:
+            data = self.client.execute("GET", self._key(key))
+            value = None if data is None else self._loads(data)
+        except (OSError, RedisError, ValueError) as e:
+            self._failed("get", e)
+            value = None
+        self._count(hit=value is not None)
+        return value
+
+    def set(
+        self, key: str, value: Any, ttl: float | None = None, tags: Iterable[str] = ()
+    ) -> None:
+        entry_ttl = self._entry_ttl(ttl)
+        if entry_ttl is None:
+            return
+        data = self._dumps(value)
+        ttl_ms = max(int(entry_ttl * 1000), 1)
+        try:
+            self.client.execute("SET", self._key(key), data, "PX", ttl_ms)
+            for tag in tags:
+                tag_key = self._tag_key(tag)
+                self.client.execute("SADD", tag_key, key)
+                # A tag outlives all of its entries
+                if self.client.execute("PTTL", tag_key) < ttl_ms:
+                    self.client.execute("PEXPIRE", tag_key, ttl_ms)
+        except (OSError, RedisError) as e:
+            self._failed("set", e)
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        redis_keys = [self._key(key) for key in keys]
+        if not redis_keys:
+            return
+        try:
+            self.client.execute("DEL", *redis_keys)
+        except (OSError, RedisError) as e:
+            self._failed("delete", e)
+
+    def invalidate_tags(self, *tags: str) -> None:
+        try:
+            for tag in tags:
+                tag_key = self._tag_key(tag)
+                keys = self.client.execute("SMEMBERS", tag_key)
+                self.client.execute(
+                    "DEL", tag_key, *(self._key(key.decode()) for key in keys)
+                )
+        except (OSError, RedisError) as e:
+            self._failed("invalidation", e)
+
+    def clear(self) -> None:
+        try:
+            keys = self._scan(f"{self.prefix}*")
+            for start in range(0, len(keys), 1000):
+                self.client.execute("DEL", *keys[start : start + 1000])
+        except (OSError, RedisError) as e:
+            self._failed("clear", e)
+
+
+def create_cache(
+    name: str, *, maxsize: int, ttl: float, model: type[BaseModel] | None = None
+) -> CacheBackend:
+    """
+    Cache of the configured CACHE_BACKEND, name separates it from the others.
+
+    The shared backends restore the values as instances of `model`, or as plain
+    JSON without one.
+    """
+    if settings.CACHE_BACKEND == "shared_memory":
+        return SharedMemoryCache(
+            settings.CACHE_SHARED_MEMORY_PATH,
+            name,
+            maxsize=maxsize,
+            ttl=ttl,
+            model=model,
+        )
+    if settings.CACHE_BACKEND == "redis":
+        assert settings.CACHE_REDIS_URL, "CACHE_REDIS_URL is required for Redis"
+        return RedisCache(
+            RedisClient(settings.CACHE_REDIS_URL),
+            name,
+            maxsize=maxsize,
+            ttl=ttl,
+            model=model,
+        )
+    return TTLCache(maxsize=maxsize, ttl=ttl, name=name, model=model)
+
+
+class InvalidationChannel:
+    """
+    Fans cache invalidations out to the other workers.
+
+    The base channel only serves a single process, so there is nothing to send.
+    """
+
+    async def start(
+        self, on_message: Callable[[str], None], on_reset: Callable[[], None]
+    ) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def publish(self, message: str) -> None:
+        pass
+
+
+class PostgresInvalidationChannel(InvalidationChannel):
+    """Broadcasts invalidations to every worker with LISTEN/NOTIFY."""
+
+    def __init__(self, conninfo: str, channel: str) -> None:
+        self.conninfo = conninfo
+        self.channel = channel
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._outbox: asyncio.Queue[str] = asyncio.Queue()
+        self._tasks: list[asyncio.Task[None]] = []
+
+    async def start(
+        self, on_message: Callable[[str], None], on_reset: Callable[[], None]
+    ) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._outbox = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._listen(on_message, on_reset)),
+            asyncio.create_task(self._send()),
+        ]
+
+    async def stop(self) -> None:
+        self._loop = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def publish(self, message: str) -> None:
+        if self._loop is None:
+            # Not running inside the app, e.g. from a script
+            with psycopg.connect(self.conninfo, autocommit=True) as conn:
+                conn.execute("SELECT pg_notify(%s, %s)", (self.channel, message))
+            return
+        self._loop.call_soon_threadsafe(self._outbox.put_nowait, message)
+
+    async def _listen(
+        self, on_message: Callable[[str], None], on_reset: Callable[[], None]
+    ) -> None:
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(
+                    self.conninfo, autocommit=True
+                ) as conn:
+                    await conn.execute(
+                        sql.SQL("LISTEN {}").format(sql.Identifier(self.channel))
+                    )
+                    # Anything published while we were not listening is lost
+                    on_reset()
+                    async for notify in conn.notifies():
+                        on_message(notify.payload)
+            except psycopg.Error as e:
+                logger.warning(f"Cache invalidation listener failed: {e}")
+                await asyncio.sleep(1)
+
+    async def _send(self) -> None:
+        conn: psycopg.AsyncConnection[Any] | None = None
+        try:
+            while True:
+                message = await self._outbox.get()
+                try:
+                    if conn is None or conn.closed:
+                        conn = await psycopg.AsyncConnection.connect(
+                            self.conninfo, autocommit=True
+                        )
+                    await conn.execute(
+                        "SELECT pg_notify(%s, %s)", (self.channel, message)
+                    )
+                except psycopg.Error as e:
+                    # Other workers fall back to the cache TTL for this entry
+                    logger.warning(f"Cache invalidation publish failed: {e}")
+                    conn = None
+        finally:
+            if conn is not None:
+                await conn.close()
+
+
+def postgres_conninfo() -> str:
+    """The database URI for psycopg, without the SQLAlchemy driver name."""
+    return str(settings.SQLALCHEMY_DATABASE_URI).replace(
+        "postgresql+psycopg", "postgresql", 1
+    )
+
+
+def _get_invalidation_channel() -> InvalidationChannel:
+    if settings.CACHE_INVALIDATION_CHANNEL == "postgres":
+        return PostgresInvalidationChannel(postgres_conninfo(), "user_cache")
+    return InvalidationChannel()
+
+
+# Column values of authenticated users, keyed by user id
+user_cache = create_cache(
+    "user",
+    maxsize=settings.USER_CACHE_SIZE,
+    ttl=settings.USER_CACHE_TTL_SECONDS,
+    model=CachedUser,
+)
+user_cache_channel = _get_invalidation_channel()
+# Validated payloads of access tokens, keyed by the hex token digest and tagged
+# with their user
+token_cache = create_cache(
+    "token", maxsize=settings.TOKEN_CACHE_SIZE, ttl=0, model=TokenPayload
+)
+
+
+# Users who just wrote, they read from the primary until replicas catch up.
+# Shared between workers only with a shared CACHE_BACKEND.
+recent_writers = create_cache(
+    "recent_writer", maxsize=100_000, ttl=settings.READ_YOUR_WRITES_SECONDS
+)
+
+
+def user_tag(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def invalidate_user(user_id: int | None) -> None:
+    if user_id is None:
+        return
+    user_cache.delete(str(user_id))
+    token_cache.invalidate_tags(user_tag(user_id))
+    user_cache_channel.publish(str(user_id))
+
+
+async def async_invalidate_user(user_id: int | None) -> None:
+    if user_id is None:
+        return
+    await user_cache.adelete(str(user_id))
+    await token_cache.ainvalidate_tags(user_tag(user_id))
+    user_cache_channel.publish(str(user_id))
+
+
+def _on_user_invalidated(payload: str) -> None:
+    user_cache.delete(payload)
+    token_cache.invalidate_tags(user_tag(int(payload)))
+
+
+async def start_user_cache_channel() -> None:
+    await user_cache_channel.start(
+        on_message=_on_user_invalidated, on_reset=user_cache.clear
+    )
@@ -31,8 +31,56 @@ class Settings(BaseSettings):
     SECRET_KEY: str = secrets.token_urlsafe(32)
     # 60 minutes * 24 hours * 8 days = 8 days
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8
+    # Access tokens carry the user's is_active and is_superuser claims, which the
+    # read endpoints trust instead of loading the user. They are short-lived and
+    # renewed with a refresh token, changes to a user reach the claims then.
+    AUTH_STATELESS: bool = False
+    STATELESS_ACCESS_TOKEN_EXPIRE_MINUTES: int = 5
+    REFRESH_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8
+    # Revoked tokens are checked in memory, revocations of expired tokens are
+    # dropped from memory and from the table this often
+    TOKEN_REVOCATION_PRUNE_SECONDS: int = 300
     DOMAIN: str = "localhost"
     ENVIRONMENT: Literal["local", "staging", "production"] = "local"
+    # bcrypt runs on its own bounded pool so a login burst can't starve other requests
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_QUEUE_SIZE: int = 32
+    # New passwords are hashed with this scheme and cost, hashes of the other
+    # scheme or of another cost are replaced at the next login. Measure the cost
+    # on the production hardware with app/calibrate_password_hash.py.
+    PASSWORD_HASH_SCHEME: Literal["bcrypt", "argon2"] = "bcrypt"
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    PASSWORD_ARGON2_TIME_COST: int = 3
+    PASSWORD_ARGON2_MEMORY_COST_KIB: int = 65536
+    PASSWORD_ARGON2_PARALLELISM: int = 4
+    # Attempts at login, password recovery and reset, per client IP and per
+    # account, refilled over the window. A successful login clears its account.
+    # Login attempts on an account are counted per client IP, or anyone could
+    # lock an account by failing on it. Password recovery emails are limited per
+    # account, whatever the IP.
+    # The counters live in the CACHE_BACKEND, set a limit to 0 to disable it.
+    RATE_LIMIT_IP_ATTEMPTS: int = 60
+    RATE_LIMIT_IP_WINDOW_SECONDS: float = 60
+    RATE_LIMIT_ACCOUNT_ATTEMPTS: int = 10
+    RATE_LIMIT_ACCOUNT_WINDOW_SECONDS: float = 600
+    # Failed logins on an account from every IP, caps guesses spread over many
+    # addresses. Reaching it blocks the owner too, keep it well above the above.
+    RATE_LIMIT_ACCOUNT_FAILURES: int = 100
+    RATE_LIMIT_ACCOUNT_FAILURES_WINDOW_SECONDS: float = 3600
+    # Authenticated users are cached, set the size to 0 to disable
+    USER_CACHE_SIZE: int = 10_000
+    USER_CACHE_TTL_SECONDS: int = 60
+    # Verified access tokens are kept until they expire, set to 0 to disable
+    TOKEN_CACHE_SIZE: int = 10_000
+    # "memory" caches per worker, "shared_memory" shares the caches between the
+    # workers of a host and "redis" between every worker of the deployment.
+    # While a shared backend is unavailable, every lookup is a miss.
+    CACHE_BACKEND: Literal["memory", "shared_memory", "redis"] = "memory"
+    CACHE_SHARED_MEMORY_PATH: str = "/dev/shm/app-cache.sqlite3"
+    CACHE_REDIS_URL: str | None = None
+    # Use "postgres" to invalidate the "memory" caches of all workers with
+    # LISTEN/NOTIFY, the shared backends don't need it
+    CACHE_INVALIDATION_CHANNEL: Literal["local", "postgres"] = "local"
 
     @computed_field  # type: ignore[misc]
     @property
@@ -53,6 +101,32 @@ class Settings(BaseSettings):
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
     POSTGRES_DB: str = ""
+    # Connection pool of each engine, per worker process
+    POSTGRES_POOL_SIZE: int = 5
+    POSTGRES_MAX_OVERFLOW: int = 10
+    POSTGRES_POOL_TIMEOUT: float = 30
+    POSTGRES_POOL_RECYCLE: int = -1
+    POSTGRES_POOL_PRE_PING: bool = False
+    # Log a warning when a request waits longer than this for a connection
+    POSTGRES_POOL_LOG_WAIT_MS: int = 100
+    # Read replicas of the GET endpoints, as SQLAlchemy URLs separated by commas
+    POSTGRES_REPLICA_URLS: Annotated[list[str] | str, BeforeValidator(parse_cors)] = []
+    POSTGRES_REPLICA_STRATEGY: Literal["round_robin", "least_connections"] = (
+        "round_robin"
+    )
+    # Replicas further behind are skipped, the lag is checked every few seconds
+    POSTGRES_REPLICA_MAX_LAG_SECONDS: float = 5
+    POSTGRES_REPLICA_CHECK_SECONDS: float = 1
+    # Users read from the primary for this long after they wrote. The writers
+    # are remembered in the CACHE_BACKEND, which must be shared with replicas.
+    READ_YOUR_WRITES_SECONDS: float = 10
+    # Count queries and time the database, password hashing and serialization of
+    # every request, reported in a Server-Timing header and the logs
+    SERVER_TIMING_ENABLED: bool = False
+    # Prometheus metrics at /metrics, scrapers must send this as a bearer token
+    # when set. Set PROMETHEUS_MULTIPROC_DIR when running several workers.
+    METRICS_ENABLED: bool = True
+    METRICS_TOKEN: str | None = None
 
     @computed_field  # type: ignore[misc]
     @property
@@ -83,6 +157,22 @@ class Settings(BaseSettings):
         return self
 
     EMAIL_RESET_TOKEN_EXPIRE_HOURS: int = 48
+    # Directory for compiled email template bytecode, shared across restarts
+    EMAIL_TEMPLATES_BYTECODE_CACHE_DIR: str | None = None
+    # Emails are queued in the outbox table and sent by a background task
+    EMAIL_OUTBOX_BATCH_SIZE: int = 50
+    EMAIL_OUTBOX_POLL_SECONDS: float = 1.0
+    EMAIL_OUTBOX_MAX_ATTEMPTS: int = 5
+    # Delay before the first retry, doubled after every failed attempt
+    EMAIL_OUTBOX_RETRY_SECONDS: int = 30
+    # Claimed messages whose sender died are picked up again after this long
+    EMAIL_OUTBOX_CLAIM_SECONDS: int = 300
+    # Users with more items than a batch are deleted in the background, one
+    # batch per transaction, with an optional pause between batches to spread
+    # the WAL and replication load
+    USER_DELETION_BATCH_SIZE: int = 5000
+    USER_DELETION_BATCH_PAUSE_SECONDS: float = 0.0
+    USER_DELETION_POLL_SECONDS: float = 5.0
 
     @computed_field  # type: ignore[misc]
     @property
@@ -95,6 +185,10 @@ class Settings(BaseSettings):
     FIRST_SUPERUSER: str
     FIRST_SUPERUSER_PASSWORD: str
     USERS_OPEN_REGISTRATION: bool = False
+    # Maximum number of rows in one bulk items request
+    ITEMS_BULK_MAX_SIZE: int = 10_000
+    # Totals of larger tables are estimated from planner statistics
+    EXACT_COUNT_MAX_ROWS: int = 100_000
 
     def _check_default_secret(self, var_name: str, value: str | None) -> None:
         if value == "changethis":
@@ -117,5 +211,19 @@ class Settings(BaseSettings):
 
         return self
 
+    @model_validator(mode="after")
+    def _enforce_shared_cache_with_replicas(self) -> Self:
+        if self.POSTGRES_REPLICA_URLS and self.CACHE_BACKEND == "memory":
+            message = (
+                "POSTGRES_REPLICA_URLS needs a shared CACHE_BACKEND, with the "
+                '"memory" backend a worker does not know about the writes served '
+                "by the others, so users may not read their own writes."
+            )
+            if self.ENVIRONMENT == "local":
+                warnings.warn(message, stacklevel=1)
+            else:
+                raise ValueError(message)
+        return self
+
 
 settings = Settings()  # type: ignore
@@ -1,10 +1,53 @@
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import Session, create_engine, select
 
 from app import crud
 from app.core.config import settings
+from app.core.pool import InstrumentedAsyncAdaptedQueuePool, InstrumentedQueuePool
+from app.core.replicas import ReplicaSet
+from app.core.timing import instrument_engine
 from app.models import User, UserCreate
 
-engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+pool_options = {
+    "pool_size": settings.POSTGRES_POOL_SIZE,
+    "max_overflow": settings.POSTGRES_MAX_OVERFLOW,
+    "pool_timeout": settings.POSTGRES_POOL_TIMEOUT,
+    "pool_recycle": settings.POSTGRES_POOL_RECYCLE,
+    "pool_pre_ping": settings.POSTGRES_POOL_PRE_PING,
+}
+
+engine = create_engine(
+    str(settings.SQLALCHEMY_DATABASE_URI),
+    poolclass=InstrumentedQueuePool,
+    **pool_options,
+)
+# Used by the API routes, the sync engine above is kept for scripts and tests
+async_engine = create_async_engine(
+    str(settings.SQLALCHEMY_DATABASE_URI),
+    poolclass=InstrumentedAsyncAdaptedQueuePool,
+    **pool_options,
+)
+# Transactions on the replicas are READ ONLY, writes fail instead of diverging
+replica_engines = [
+    create_async_engine(
+        url,
+        poolclass=InstrumentedAsyncAdaptedQueuePool,
+        execution_options={"postgresql_readonly": True},
+        **pool_options,
+    )
+    for url in settings.POSTGRES_REPLICA_URLS
+]
+replicas = ReplicaSet(
+    replica_engines,
+    async_engine,
+    strategy=settings.POSTGRES_REPLICA_STRATEGY,
+    max_lag_seconds=settings.POSTGRES_REPLICA_MAX_LAG_SECONDS,
+    check_interval_seconds=settings.POSTGRES_REPLICA_CHECK_SECONDS,
+)
+if settings.SERVER_TIMING_ENABLED:
+    instrument_engine(engine)
+    for timed_engine in [async_engine, *replica_engines]:
+        instrument_engine(timed_engine.sync_engine)
 
 
 # make sure all SQLModel models are imported (app.models) before initializing DB
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import col, delete, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.models import Item, ItemCount, User, UserDeletion
+
+logger = logging.getLogger(__name__)
+
+
+class UserDeleter:
+    """
+    Deletes the items of the users in the deletion table a batch at a time,
+    then the users.
+
+    Every batch is its own short transaction, so locks are held briefly and the
+    WAL grows steadily. The progress is committed with each batch, a restarted
+    deleter resumes where it stopped. Every worker can run a deleter, deletions
+    are claimed with FOR UPDATE SKIP LOCKED.
+    """
+
+    def __init__(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self, engine: AsyncEngine) -> None:
+        if self._task is not None:
+            # Already started by another app in this process, e.g. in the tests
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(engine))
+
+    async def stop(self) -> None:
+        if (
+            self._task is None
+            or self._task.get_loop() is not asyncio.get_running_loop()
+        ):
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def wake(self) -> None:
+        """Check for deletions now instead of at the next poll."""
+        if self._task is not None:
+            # Requests of another app in the process may run on another loop
+            self._task.get_loop().call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self, engine: AsyncEngine) -> None:
+        while True:
+            try:
+                async with AsyncSession(engine, expire_on_commit=False) as session:
+                    processed = await self.process_batch(session)
+            except Exception:
+                logger.exception("User deletion batch failed")
+                processed = False
+            if processed:
+                await asyncio.sleep(settings.USER_DELETION_BATCH_PAUSE_SECONDS)
+                continue
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), settings.USER_DELETION_POLL_SECONDS
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def process_batch(self, session: AsyncSession) -> bool:
+        """Delete one batch of items of a pending deletion, False when none is."""
+        statement = (
+            select(UserDeletion)
+            .where(UserDeletion.status == "pending")
+            .order_by(col(UserDeletion.created_at))
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        deletion = (await session.exec(statement)).first()
+        if deletion is None:
+            return False
+        batch_size = settings.USER_DELETION_BATCH_SIZE
+        # Served by the (owner_id, id) index, rows already deleted are skipped
+        batch = (
+            select(Item.id)
+            .where(Item.owner_id == deletion.user_id)
+            .order_by(col(Item.id))
+            .limit(batch_size)
+        )
+        result = await session.exec(
+            delete(Item).where(col(Item.id).in_(batch.scalar_subquery()))  # type: ignore
+        )
+        deleted = result.rowcount
+        deletion.items_deleted += deleted
+        if deleted < batch_size:
+            # The item count goes with the user
+            await session.exec(delete(User).where(col(User.id) == deletion.user_id))  # type: ignore
+            deletion.status = "done"
+            deletion.finished_at = datetime.utcnow()
+        else:
+            await session.exec(
+                update(ItemCount)  # type: ignore
+                .where(col(ItemCount.owner_id) == deletion.user_id)
+                .values(count=ItemCount.count - deleted)
+            )
+        session.add(deletion)
+        await session.commit()
+        return True
+
+
+user_deleter = UserDeleter()
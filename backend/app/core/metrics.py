@@ -0,0 +1,102 @@
+import os
+import time
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# With PROMETHEUS_MULTIPROC_DIR set, every worker writes its samples to files
+# in that directory and a scrape of any worker adds up all of them
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Latency of the HTTP requests by route template.",
+    ["method", "route", "status"],
+)
+http_requests_in_progress = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests being served.",
+    multiprocess_mode="livesum",
+)
+db_pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a database connection from the pool.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5, 30),
+)
+db_pool_checked_out = Gauge(
+    "db_pool_connections_checked_out",
+    "Database connections in use.",
+    multiprocess_mode="livesum",
+)
+db_pool_timeouts = Counter(
+    "db_pool_timeouts",
+    "Requests that timed out waiting for a database connection.",
+)
+password_hash_pending = Gauge(
+    "password_hash_queue_depth",
+    "Password hashes running or waiting for a hashing thread.",
+    multiprocess_mode="livesum",
+)
+email_send_duration = Histogram(
+    "email_send_duration_seconds",
+    "Latency of sending one email over SMTP.",
+    ["result"],
+)
+cache_lookups = Counter(
+    "cache_lookups",
+    "Cache lookups by result, the hit ratio is hit over all lookups.",
+    ["cache", "result"],
+)
+
+
+def render_metrics() -> bytes:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)  # type: ignore[no-untyped-call]
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+class MetricsMiddleware:
+    """Records the latency of each request under its route template."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_progress.dec()
+            route = scope.get("route")
+            if route is not None:
+                label = route.path
+            elif status_code == 404:
+                # Unknown paths share one label so scanners can't add series
+                label = "unmatched"
+            else:
+                # Plain Starlette routes like the docs, a fixed set of paths
+                label = scope["path"]
+            http_request_duration.labels(scope["method"], label, status_code).observe(
+                time.perf_counter() - start
+            )
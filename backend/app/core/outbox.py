@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import smtplib
+import time
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import formataddr
+
+from anyio import to_thread
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.core.metrics import email_send_duration
+from app.models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def build_email_message(
+    *, email_to: str, subject: str, html_content: str
+) -> EmailMessage:
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = formataddr(
+        (settings.EMAILS_FROM_NAME or "", settings.EMAILS_FROM_EMAIL or "")
+    )
+    message["To"] = email_to
+    message.set_content(html_content, subtype="html")
+    return message
+
+
+class SMTPConnection:
+    """A single SMTP connection, reopened when the server drops it."""
+
+    def __init__(self) -> None:
+        self._client: smtplib.SMTP | None = None
+
+    def _connect(self) -> smtplib.SMTP:
+        if self._client is not None:
+            return self._client
+        assert settings.SMTP_HOST, "no provided configuration for email variables"
+        client: smtplib.SMTP
+        if settings.SMTP_SSL:
+            client = smtplib.SMTP_SSL(settings.SMTP_HOST, settings.SMTP_PORT)
+        else:
+            client = smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT)
+            if settings.SMTP_TLS:
+                client.starttls()
+        if settings.SMTP_USER:
+            client.login(settings.SMTP_USER, settings.SMTP_PASSWORD or "")
+        self._client = client
+        return client
+
+    def send(self, message: EmailMessage) -> None:
+        try:
+            self._connect().send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # Servers close idle connections, retry once on a fresh one
+            self.close()
+            self._connect().send_message(message)
+
+    def close(self) -> None:
+        if self._client is None:
+            return
+        try:
+            self._client.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._client = None
+
+
+class EmailOutboxSender:
+    """
+    Sends the emails queued in the outbox table over one persistent connection.
+
+    Every worker can run a sender. Due rows are claimed in a short transaction,
+    with FOR UPDATE SKIP LOCKED, by moving their next attempt past the claim
+    timeout. The emails are sent outside of it and each result is committed on
+    its own, so a sender that dies resends at most the message it was sending,
+    once its claim times out.
+    """
+
+    def __init__(self) -> None:
+        self.smtp = SMTPConnection()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self, engine: AsyncEngine) -> None:
+        if self._task is not None:
+            # Already started by another app in this process, e.g. in the tests
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(engine))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            if self._task.get_loop() is not asyncio.get_running_loop():
+                return
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await to_thread.run_sync(self.smtp.close)
+
+    def wake(self) -> None:
+        """Check the outbox now instead of at the next poll."""
+        if self._task is not None:
+            # Called from threadpool routes and other apps' loops too
+            self._task.get_loop().call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self, engine: AsyncEngine) -> None:
+        while True:
+            try:
+                async with AsyncSession(engine, expire_on_commit=False) as session:
+                    sent = await self.process_batch(session)
+            except Exception:
+                logger.exception("Email outbox batch failed")
+                sent = 0
+            if sent < settings.EMAIL_OUTBOX_BATCH_SIZE:
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), settings.EMAIL_OUTBOX_POLL_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def process_batch(self, session: AsyncSession) -> int:
+        """Send the due messages of one batch, returns how many were processed."""
+        messages = await self._claim(session)
+        for outbox_message in messages:
+            await self._send(outbox_message)
+            session.add(outbox_message)
+            await session.commit()
+        return len(messages)
+
+    async def _claim(self, session: AsyncSession) -> Sequence[EmailOutbox]:
+        now = datetime.utcnow()
+        statement = (
+            select(EmailOutbox)
+            .where(EmailOutbox.status == "pending")
+            .where(EmailOutbox.next_attempt_at <= now)
+            .order_by(col(EmailOutbox.id))
+            .limit(settings.EMAIL_OUTBOX_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        messages = (await session.exec(statement)).all()
+        claimed_until = now + timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_SECONDS)
+        for outbox_message in messages:
+            # Counted now, so a message that kills its sender is not retried forever
+            outbox_message.attempts += 1
+            outbox_message.next_attempt_at = claimed_until
+            session.add(outbox_message)
+        await session.commit()
+        return messages
+
+    async def _send(self, outbox_message: EmailOutbox) -> None:
+        message = build_email_message(
+            email_to=outbox_message.email_to,
+            subject=outbox_message.subject,
+            html_content=outbox_message.html_content,
+        )
+        start = time.perf_counter()
+        try:
+            await to_thread.run_sync(self.smtp.send, message)
+        except (smtplib.SMTPException, OSError) as e:
+            email_send_duration.labels("failed").observe(time.perf_counter() - start)
+            await to_thread.run_sync(self.smtp.close)
+            outbox_message.last_error = str(e)
+            if outbox_message.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                outbox_message.status = "failed"
+                logger.error(f"Giving up on email {outbox_message.id}: {e}")
+            else:
+                delay = settings.EMAIL_OUTBOX_RETRY_SECONDS * 2 ** (
+                    outbox_message.attempts - 1
+                )
+                outbox_message.next_attempt_at = datetime.utcnow() + timedelta(
+                    seconds=delay
+                )
+                logger.warning(f"Email {outbox_message.id} failed, retrying: {e}")
+            return
+        email_send_duration.labels("sent").observe(time.perf_counter() - start)
+        outbox_message.status = "sent"
+        outbox_message.sent_at = datetime.utcnow()
+
+
+email_outbox_sender = EmailOutboxSender()
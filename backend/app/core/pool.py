@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import (
+    AsyncAdaptedQueuePool,
+    ConnectionPoolEntry,
+    PoolProxiedConnection,
+    QueuePool,
+)
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.metrics import (
+    db_pool_checked_out,
+    db_pool_checkout_wait,
+    db_pool_timeouts,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """Counters of connection checkouts, shared by every pool of the process."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.routes: dict[str, dict[str, Any]] = {}
+
+    def record_checkout(self, wait_seconds: float, *, overflow: bool) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.overflow_checkouts += overflow
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+        db_pool_checkout_wait.observe(wait_seconds)
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+        db_pool_timeouts.inc()
+
+    def record_route(self, path: str, hold_seconds: float) -> None:
+        with self._lock:
+            route = self.routes.setdefault(
+                path,
+                {"requests": 0, "hold_seconds_total": 0.0, "hold_seconds_max": 0.0},
+            )
+            route["requests"] += 1
+            route["hold_seconds_total"] += hold_seconds
+            route["hold_seconds_max"] = max(route["hold_seconds_max"], hold_seconds)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "overflow_checkouts": self.overflow_checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "routes": {path: dict(route) for path, route in self.routes.items()},
+            }
+
+
+pool_stats = PoolStats()
+
+# Seconds connections were held during the current request, if any
+_request_hold_seconds: ContextVar[list[float] | None] = ContextVar(
+    "request_hold_seconds", default=None
+)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection."""
+
+    def connect(self) -> PoolProxiedConnection:
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            pool_stats.record_timeout()
+            logger.error(
+                f"Timed out waiting for a database connection: {self.status()}"
+            )
+            raise
+        wait_seconds = time.perf_counter() - start
+        pool_stats.record_checkout(
+            wait_seconds, overflow=self.checkedout() > self.size()
+        )
+        if wait_seconds * 1000 > settings.POSTGRES_POOL_LOG_WAIT_MS:
+            logger.warning(
+                f"Waited {wait_seconds * 1000:.0f} ms for a database connection: "
+                f"{self.status()}"
+            )
+        return connection
+
+
+class InstrumentedAsyncAdaptedQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    pass
+
+
+@event.listens_for(InstrumentedQueuePool, "checkout")
+def _on_checkout(
+    _dbapi_connection: Any,
+    connection_record: ConnectionPoolEntry,
+    _connection_proxy: PoolProxiedConnection,
+) -> None:
+    connection_record.info["checked_out_at"] = time.perf_counter()
+    db_pool_checked_out.inc()
+
+
+@event.listens_for(InstrumentedQueuePool, "checkin")
+def _on_checkin(_dbapi_connection: Any, connection_record: ConnectionPoolEntry) -> None:
+    checked_out_at = connection_record.info.pop("checked_out_at", None)
+    if checked_out_at is not None:
+        db_pool_checked_out.dec()
+    hold_seconds = _request_hold_seconds.get()
+    if checked_out_at is not None and hold_seconds is not None:
+        hold_seconds.append(time.perf_counter() - checked_out_at)
+
+
+class ConnectionHoldMiddleware:
+    """Attributes the time database connections were held to each route."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        hold_seconds: list[float] = []
+        token = _request_hold_seconds.set(hold_seconds)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_hold_seconds.reset(token)
+            route = scope.get("route")
+            if route is not None and hold_seconds:
+                pool_stats.record_route(
+                    f"{scope['method']} {route.path}", sum(hold_seconds)
+                )
@@ -0,0 +1,113 @@
+import time
+
+from app.core.cache import CacheBackend, create_cache
+from app.core.config import settings
+
+
+class RateLimitExceededError(Exception):
+    """Raised when a rate limit is exhausted, retry_after is in seconds."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.0f} seconds")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Token bucket per key, allows `limit` requests per window in bursts.
+
+    Buckets are kept in a cache backend, shared between the workers when the
+    backend is. Updates are not atomic across workers, concurrent requests may
+    slip a few extra attempts through. While the backend is unavailable every
+    bucket reads as full.
+    """
+
+    def __init__(
+        self, cache: CacheBackend, name: str, *, limit: int, window_seconds: float
+    ) -> None:
+        self.cache = cache
+        self.name = name
+        self.limit = limit
+        self.window_seconds = window_seconds
+
+    def _key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    async def _tokens(self, key: str, now: float) -> float:
+        bucket = await self.cache.aget(self._key(key))
+        if bucket is None:
+            return self.limit
+        tokens, updated_at = bucket
+        refill = (now - updated_at) * self.limit / self.window_seconds
+        return float(min(self.limit, tokens + refill))
+
+    async def retry_after(self, key: str) -> float:
+        """Seconds until the key may make a request, 0 when it may now."""
+        if self.limit <= 0:
+            return 0
+        tokens = await self._tokens(key, time.time())
+        if tokens >= 1:
+            return 0
+        return (1 - tokens) * self.window_seconds / self.limit
+
+    async def take(self, key: str) -> None:
+        if self.limit <= 0:
+            return
+        now = time.time()
+        tokens = await self._tokens(key, now)
+        await self.cache.aset(
+            self._key(key), (tokens - 1, now), ttl=self.window_seconds
+        )
+
+    async def reset(self, key: str) -> None:
+        await self.cache.adelete(self._key(key))
+
+
+async def check_rate_limits(
+    *limits: tuple[RateLimiter, str], take: bool = True
+) -> None:
+    """
+    Takes a token from the bucket of every (limiter, key) pair, or only checks
+    them when `take` is False.
+
+    Raises RateLimitExceededError and takes nothing when one of them is empty.
+    """
+    retry_after = max([await limiter.retry_after(key) for limiter, key in limits])
+    if retry_after > 0:
+        raise RateLimitExceededError(retry_after)
+    if not take:
+        return
+    for limiter, key in limits:
+        await limiter.take(key)
+
+
+rate_limit_cache = create_cache(
+    "rate_limit",
+    maxsize=100_000,
+    ttl=max(
+        settings.RATE_LIMIT_IP_WINDOW_SECONDS,
+        settings.RATE_LIMIT_ACCOUNT_WINDOW_SECONDS,
+        settings.RATE_LIMIT_ACCOUNT_FAILURES_WINDOW_SECONDS,
+    ),
+)
+# Login, password recovery and reset attempts of each client IP
+ip_rate_limiter = RateLimiter(
+    rate_limit_cache,
+    "ip",
+    limit=settings.RATE_LIMIT_IP_ATTEMPTS,
+    window_seconds=settings.RATE_LIMIT_IP_WINDOW_SECONDS,
+)
+# Attempts on each account, keyed by the action and the email
+account_rate_limiter = RateLimiter(
+    rate_limit_cache,
+    "account",
+    limit=settings.RATE_LIMIT_ACCOUNT_ATTEMPTS,
+    window_seconds=settings.RATE_LIMIT_ACCOUNT_WINDOW_SECONDS,
+)
+# Failed logins on each account from every IP, keyed by the email
+account_failure_rate_limiter = RateLimiter(
+    rate_limit_cache,
+    "account_failures",
+    limit=settings.RATE_LIMIT_ACCOUNT_FAILURES,
+    window_seconds=settings.RATE_LIMIT_ACCOUNT_FAILURES_WINDOW_SECONDS,
+)
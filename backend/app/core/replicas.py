@@ -0,0 +1,141 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections.abc import Callable, Sequence
+from typing import Any, Literal
+
+from sqlalchemy import Engine, exc, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+# Seconds the replica is behind the primary. It is 0 when the replica has
+# replayed everything it received, so an idle primary doesn't look like lag.
+# A primary used as a replica, e.g. in development, reports 0 too.
+LAG_QUERY = text(
+    "SELECT CASE"
+    " WHEN NOT pg_is_in_recovery() THEN 0"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())"
+    " END"
+)
+
+
+class ReplicaSession(Session):
+    """
+    Session of the reads of a request on a replica.
+
+    When the replica fails, the statement runs again on the primary, and so do
+    the following ones. Only reads run here, so running one again is safe.
+    """
+
+    replica_set: "ReplicaSet | None" = None
+
+    def _fail_over(self, method: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        try:
+            return method(*args, **kwargs)
+        except (exc.OperationalError, exc.InterfaceError) as e:
+            replica_set = self.replica_set
+            primary = None if replica_set is None else replica_set.primary.sync_engine
+            if replica_set is None or self.bind is primary:
+                raise
+            logger.warning(f"Replica failed, reading from the primary: {e}")
+            assert isinstance(self.bind, Engine)
+            replica_set.mark_unavailable(self.bind)
+            self.rollback()
+            self.bind = primary
+            return method(*args, **kwargs)
+
+    def exec(self, *args: Any, **kwargs: Any) -> Any:
+        return self._fail_over(super().exec, *args, **kwargs)
+
+    def execute(self, *args: Any, **kwargs: Any) -> Any:
+        return self._fail_over(super().execute, *args, **kwargs)
+
+
+class ReplicaSet:
+    """
+    Picks the read replica of a query, falling back to the primary.
+
+    Replicas that lag more than max_lag_seconds, or can't be reached, are
+    skipped. The lag of each replica is measured at most once per
+    check_interval_seconds.
+    """
+
+    def __init__(
+        self,
+        replicas: Sequence[AsyncEngine],
+        primary: AsyncEngine,
+        *,
+        strategy: Literal["round_robin", "least_connections"],
+        max_lag_seconds: float,
+        check_interval_seconds: float,
+    ) -> None:
+        self.replicas = list(replicas)
+        self.primary = primary
+        self.strategy = strategy
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval_seconds = check_interval_seconds
+        self._next = itertools.count()
+        # Engine index to the time of the last check and whether it was healthy
+        self._health: dict[int, tuple[float, bool]] = {}
+        self._checks: dict[int, asyncio.Task[bool]] = {}
+
+    def _ordered(self) -> list[int]:
+        indexes = list(range(len(self.replicas)))
+        if self.strategy == "least_connections":
+            return sorted(indexes, key=lambda i: self.replicas[i].pool.checkedout())  # type: ignore[attr-defined]
+        start = next(self._next) % len(indexes)
+        return indexes[start:] + indexes[:start]
+
+    async def _check(self, index: int) -> bool:
+        try:
+            async with self.replicas[index].connect() as connection:
+                lag = (await connection.execute(LAG_QUERY)).scalar()
+        except (exc.DBAPIError, OSError) as e:
+            logger.warning(f"Replica {index} is unavailable: {e}")
+            healthy = False
+        else:
+            healthy = lag is not None and lag <= self.max_lag_seconds
+            if not healthy:
+                logger.warning(f"Replica {index} is lagging by {lag} seconds")
+        self._health[index] = (time.monotonic(), healthy)
+        return healthy
+
+    async def _is_healthy(self, index: int) -> bool:
+        checked_at, healthy = self._health.get(index, (float("-inf"), False))
+        if time.monotonic() - checked_at < self.check_interval_seconds:
+            return healthy
+        # Concurrent requests share a single check of the replica
+        task = self._checks.get(index)
+        if task is None or task.done():
+            task = self._checks[index] = asyncio.ensure_future(self._check(index))
+        return await asyncio.shield(task)
+
+    async def choose(self) -> AsyncEngine:
+        for index in self._ordered() if self.replicas else []:
+            if await self._is_healthy(index):
+                return self.replicas[index]
+        return self.primary
+
+    def mark_unavailable(self, engine: Engine) -> None:
+        """Skip the replica until its next check, e.g. after a query failed."""
+        for index, replica in enumerate(self.replicas):
+            if replica.sync_engine is engine:
+                self._health[index] = (time.monotonic(), False)
+
+    def session(self, engine: AsyncEngine) -> AsyncSession:
+        """Session of reads on the engine, moved to the primary if it fails."""
+        session = AsyncSession(
+            engine, expire_on_commit=False, sync_session_class=ReplicaSession
+        )
+        assert isinstance(session.sync_session, ReplicaSession)
+        session.sync_session.replica_set = self
+        return session
+
+    async def dispose(self) -> None:
+        for engine in self.replicas:
+            await engine.dispose()
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import time
+from collections.abc import Coroutine
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import col, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.cache import (
+    InvalidationChannel,
+    PostgresInvalidationChannel,
+    postgres_conninfo,
+)
+from app.core.config import settings
+from app.models import TokenPayload, TokenRevocation
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(value: datetime) -> float:
+    # Datetimes are stored as naive UTC
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def token_revocation(token_data: TokenPayload) -> TokenRevocation:
+    """Revocation of one token, of every token of its user if it has no id."""
+    if token_data.jti is None:
+        return user_tokens_revocation(token_data.sub)
+    if token_data.exp is None:
+        expires_at = datetime.utcnow() + _longest_token_lifetime()
+    else:
+        expires_at = datetime.utcfromtimestamp(token_data.exp)
+    return TokenRevocation(jti=token_data.jti, expires_at=expires_at)
+
+
+def user_tokens_revocation(
+    user_id: int | None, keep: TokenPayload | None = None
+) -> TokenRevocation:
+    """
+    Revocation of the tokens the user holds now, except the session of the `keep`
+    token, e.g. its refresh token, or the token alone when it has no session.
+    """
+    return TokenRevocation(
+        jti=None if keep is None else keep.sid or keep.jti,
+        user_id=user_id,
+        expires_at=datetime.utcnow() + _longest_token_lifetime(),
+    )
+
+
+def _longest_token_lifetime() -> timedelta:
+    return timedelta(
+        minutes=max(
+            settings.ACCESS_TOKEN_EXPIRE_MINUTES,
+            settings.STATELESS_ACCESS_TOKEN_EXPIRE_MINUTES,
+            settings.REFRESH_TOKEN_EXPIRE_MINUTES,
+        )
+    )
+
+
+class TokenDenylist:
+    """
+    Revoked tokens, checked in memory on every request.
+
+    Each worker loads the unexpired revocations from the table when it starts
+    and whenever it reconnects to the channel, the revocations made by the
+    other workers reach it over the channel. A token is checked with a dict
+    lookup, no query.
+    """
+
+    def __init__(self, channel: InvalidationChannel) -> None:
+        self.channel = channel
+        # Expiry timestamps of the revoked token ids
+        self._jtis: dict[str, float] = {}
+        # Users whose earlier tokens are revoked, with (revoked_at, expiry, kept
+        # jti or sid)
+        self._users: dict[int, tuple[float, float, str | None]] = {}
+        self._engine: AsyncEngine | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    def __len__(self) -> int:
+        return len(self._jtis) + len(self._users)
+
+    def is_revoked(self, token_data: TokenPayload) -> bool:
+        if token_data.jti is not None and token_data.jti in self._jtis:
+            return True
+        if not self._users or token_data.sub not in self._users:
+            return False
+        revoked_at, _expires_at, kept_jti = self._users[token_data.sub]
+        if kept_jti is not None and kept_jti in (token_data.jti, token_data.sid):
+            return False
+        # Tokens without an issue time predate the revocation
+        return token_data.iat is None or token_data.iat < revoked_at
+
+    def add(self, revocation: TokenRevocation) -> None:
+        """Applies a revocation to this worker only."""
+        self._add(*self._entry(revocation))
+
+    def revoke(self, revocation: TokenRevocation) -> None:
+        """Applies a revocation stored in the table on every worker."""
+        entry = self._entry(revocation)
+        self._add(*entry)
+        self.channel.publish(json.dumps(entry))
+
+    @staticmethod
+    def _entry(
+        revocation: TokenRevocation,
+    ) -> tuple[str | None, int | None, float, float]:
+        return (
+            revocation.jti,
+            revocation.user_id,
+            _timestamp(revocation.revoked_at),
+            _timestamp(revocation.expires_at),
+        )
+
+    def _add(
+        self, jti: str | None, user_id: int | None, revoked_at: float, expires_at: float
+    ) -> None:
+        if user_id is None:
+            if jti is not None:
+                self._jtis[jti] = expires_at
+            return
+        previous = self._users.get(user_id)
+        if previous is None or previous[0] < revoked_at:
+            self._users[user_id] = (revoked_at, expires_at, jti)
+
+    def prune(self, now: float | None = None) -> None:
+        """Forgets the revocations of tokens expired by now."""
+        now = time.time() if now is None else now
+        for jti in [jti for jti, expires_at in self._jtis.items() if expires_at <= now]:
+            self._jtis.pop(jti, None)
+        for user_id in [
+            user_id for user_id, entry in self._users.items() if entry[1] <= now
+        ]:
+            self._users.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._jtis.clear()
+        self._users.clear()
+
+    async def load(self, session: AsyncSession) -> None:
+        statement = select(TokenRevocation).where(
+            TokenRevocation.expires_at > datetime.utcnow()
+        )
+        for revocation in (await session.exec(statement)).all():
+            self.add(revocation)
+
+    async def delete_expired(self, session: AsyncSession) -> None:
+        statement = delete(TokenRevocation).where(
+            col(TokenRevocation.expires_at) <= datetime.utcnow()
+        )
+        await session.exec(statement)  # type: ignore
+        await session.commit()
+
+    async def start(self, engine: AsyncEngine) -> None:
+        if self._loop is not None:
+            # Already started by another app in this process, e.g. in the tests
+            return
+        self._loop = asyncio.get_running_loop()
+        self._engine = engine
+        async with AsyncSession(engine) as session:
+            await self.load(session)
+        await self.channel.start(on_message=self._on_message, on_reset=self._on_reset)
+        self._spawn(self._run_pruning())
+
+    async def stop(self) -> None:
+        if self._loop is not asyncio.get_running_loop():
+            return
+        self._loop = None
+        await self.channel.stop()
+        tasks, self._tasks = list(self._tasks), set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, coroutine: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _on_message(self, payload: str) -> None:
+        self._add(*json.loads(payload))
+
+    def _on_reset(self) -> None:
+        # Revocations published while we were not listening are in the table
+        self._spawn(self._reload())
+
+    async def _reload(self) -> None:
+        assert self._engine is not None
+        try:
+            async with AsyncSession(self._engine) as session:
+                await self.load(session)
+        except Exception:
+            logger.exception("Loading token revocations failed")
+
+    async def _run_pruning(self) -> None:
+        assert self._engine is not None
+        while True:
+            await asyncio.sleep(settings.TOKEN_REVOCATION_PRUNE_SECONDS)
+            self.prune()
+            try:
+                async with AsyncSession(self._engine) as session:
+                    await self.delete_expired(session)
+            except Exception:
+                logger.exception("Deleting expired token revocations failed")
+
+
+# Always broadcast with LISTEN/NOTIFY, unlike cache invalidations a missed
+# revocation would leave a token usable until it expires
+token_denylist = TokenDenylist(
+    PostgresInvalidationChannel(postgres_conninfo(), "token_revocation")
+)
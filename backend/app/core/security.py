@@ -1,27 +1,150 @@
+import asyncio
+import secrets
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any
+from typing import Any, TypeVar
 
 import jwt
 from passlib.context import CryptContext
 
 from app.core.config import settings
+from app.core.metrics import password_hash_pending
+from app.core.timing import current_timings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def create_password_context(
+    *,
+    scheme: str,
+    bcrypt_rounds: int,
+    argon2_time_cost: int,
+    argon2_memory_cost_kib: int,
+    argon2_parallelism: int,
+) -> CryptContext:
+    """
+    Hashes with `scheme` and verifies both schemes.
+
+    Hashes of the other scheme or of another cost need an update, the minimum
+    and maximum rounds pin the cost so it can be lowered as well as raised.
+    """
+    return CryptContext(
+        schemes=["bcrypt", "argon2"],
+        default=scheme,
+        deprecated="auto",
+        bcrypt__rounds=bcrypt_rounds,
+        bcrypt__min_rounds=bcrypt_rounds,
+        bcrypt__max_rounds=bcrypt_rounds,
+        argon2__rounds=argon2_time_cost,
+        argon2__min_rounds=argon2_time_cost,
+        argon2__max_rounds=argon2_time_cost,
+        argon2__memory_cost=argon2_memory_cost_kib,
+        argon2__parallelism=argon2_parallelism,
+    )
+
+
+pwd_context = create_password_context(
+    scheme=settings.PASSWORD_HASH_SCHEME,
+    bcrypt_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    argon2_time_cost=settings.PASSWORD_ARGON2_TIME_COST,
+    argon2_memory_cost_kib=settings.PASSWORD_ARGON2_MEMORY_COST_KIB,
+    argon2_parallelism=settings.PASSWORD_ARGON2_PARALLELISM,
+)
+
+# bcrypt and argon2 release the GIL, so threads are enough to hash in parallel
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+_hash_pending = 0
+
+T = TypeVar("T")
 
 
 ALGORITHM = "HS256"
 
 
-def create_access_token(subject: str | Any, expires_delta: timedelta) -> str:
+def create_access_token(
+    subject: str | Any,
+    expires_delta: timedelta,
+    claims: dict[str, Any] | None = None,
+) -> str:
     expire = datetime.utcnow() + expires_delta
-    to_encode = {"exp": expire, "sub": str(subject)}
+    to_encode = {
+        **(claims or {}),
+        "exp": expire,
+        "sub": str(subject),
+        # The id and the precise issue time let the token be revoked
+        "jti": secrets.token_urlsafe(16),
+        "iat": time.time(),
+    }
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def create_refresh_token(
+    subject: str | Any,
+    expires_delta: timedelta,
+    claims: dict[str, Any] | None = None,
+) -> str:
+    return create_access_token(
+        subject, expires_delta, claims={**(claims or {}), "type": "refresh"}
+    )
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> tuple[bool, str | None]:
+    """Verifies the password, with a new hash when the stored one is outdated."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+class PasswordHashingBusyError(Exception):
+    """Raised when the password hashing pool and its queue are full."""
+
+
+def password_hash_queue_depth() -> int:
+    return _hash_pending
+
+
+async def _run_in_hash_executor(func: Callable[..., T], *args: Any) -> T:
+    global _hash_pending
+    # Only touched from the event loop thread, so no lock is needed
+    limit = settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE
+    if _hash_pending >= limit:
+        raise PasswordHashingBusyError()
+    _hash_pending += 1
+    password_hash_pending.inc()
+    timings = current_timings()
+    start = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_pending -= 1
+        password_hash_pending.dec()
+        if timings is not None:
+            timings.password_hash_seconds += time.perf_counter() - start
+
+
+async def async_verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run_in_hash_executor(verify_password, plain_password, hashed_password)
+
+
+async def async_verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> tuple[bool, str | None]:
+    return await _run_in_hash_executor(
+        verify_and_update_password, plain_password, hashed_password
+    )
+
+
+async def async_get_password_hash(password: str) -> str:
+    return await _run_in_hash_executor(get_password_hash, password)
@@ -0,0 +1,155 @@
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any
+
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import Engine, event
+from sqlalchemy.engine import ExceptionContext
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimings:
+    """Where the time of one request went."""
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.password_hash_seconds = 0.0
+        self.serialization_seconds = 0.0
+
+    def server_timing(self, total_seconds: float) -> str:
+        return ", ".join(
+            [
+                f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries"',
+                f"hash;dur={self.password_hash_seconds * 1000:.1f}",
+                f"serialize;dur={self.serialization_seconds * 1000:.1f}",
+                f"total;dur={total_seconds * 1000:.1f}",
+            ]
+        )
+
+
+# Timings of the current request, None when not measured
+_request_timings: ContextVar[RequestTimings | None] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def current_timings() -> RequestTimings | None:
+    return _request_timings.get()
+
+
+def _before_cursor_execute(
+    conn: Any,
+    _cursor: Any,
+    _statement: Any,
+    _parameters: Any,
+    _context: Any,
+    _many: Any,
+) -> None:
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+def _record_query(conn: Any) -> None:
+    started_at = conn.info["query_started_at"].pop()
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.queries += 1
+        timings.db_seconds += time.perf_counter() - started_at
+
+
+def _after_cursor_execute(
+    conn: Any,
+    _cursor: Any,
+    _statement: Any,
+    _parameters: Any,
+    _context: Any,
+    _many: Any,
+) -> None:
+    _record_query(conn)
+
+
+def _handle_error(context: ExceptionContext) -> None:
+    # A failed query gets no after_cursor_execute, its start would stay on the
+    # pooled connection and be taken for the next query's
+    conn = context.connection
+    if conn is not None and conn.info.get("query_started_at"):
+        _record_query(conn)
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Count the queries of the engine and their time in the request timings."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def uninstrument_engine(engine: Engine) -> None:
+    event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+    event.remove(engine, "after_cursor_execute", _after_cursor_execute)
+    event.remove(engine, "handle_error", _handle_error)
+
+
+class TimedORJSONResponse(ORJSONResponse):
+    """ORJSONResponse that adds the time spent encoding to the request timings."""
+
+    def render(self, content: Any) -> bytes:
+        timings = _request_timings.get()
+        if timings is None:
+            return super().render(content)
+        start = time.perf_counter()
+        try:
+            return super().render(content)
+        finally:
+            timings.serialization_seconds += time.perf_counter() - start
+
+
+class ServerTimingMiddleware:
+    """Reports the timings of each request in a Server-Timing header and the logs."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = RequestTimings()
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    timings.server_timing(time.perf_counter() - start),
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            total_seconds = time.perf_counter() - start
+            route = scope.get("route")
+            logger.info(
+                f"{scope['method']} {scope['path']} {status_code} "
+                f"{total_seconds * 1000:.1f} ms",
+                extra={
+                    "method": scope["method"],
+                    "route": route.path if route is not None else None,
+                    "status_code": status_code,
+                    "duration_ms": total_seconds * 1000,
+                    "db_queries": timings.queries,
+                    "db_ms": timings.db_seconds * 1000,
+                    "password_hash_ms": timings.password_hash_seconds * 1000,
+                    "serialization_ms": timings.serialization_seconds * 1000,
+                },
+            )
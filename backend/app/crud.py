@@ -1,9 +1,33 @@
+from datetime import datetime
 from typing import Any
 
-from sqlmodel import Session, select
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, SQLModel, col, delete, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.core.security import get_password_hash, verify_password
-from app.models import Item, ItemCreate, User, UserCreate, UserUpdate
+from app.core.cache import async_invalidate_user, invalidate_user
+from app.core.config import settings
+from app.core.deletion import user_deleter
+from app.core.outbox import email_outbox_sender
+from app.core.revocation import token_denylist, user_tokens_revocation
+from app.core.security import (
+    async_get_password_hash,
+    async_verify_and_update_password,
+    get_password_hash,
+    verify_and_update_password,
+)
+from app.models import (
+    EmailOutbox,
+    Item,
+    ItemCount,
+    ItemCreate,
+    TokenRevocation,
+    User,
+    UserCreate,
+    UserDeletion,
+    UserUpdate,
+)
 
 
 def create_user(*, session: Session, user_create: UserCreate) -> User:
@@ -19,19 +43,26 @@ def create_user(*, session: Session, user_create: UserCreate) -> User:
 def update_user(*, session: Session, db_user: User, user_in: UserUpdate) -> Any:
     user_data = user_in.model_dump(exclude_unset=True)
     extra_data = {}
+    revocation = None
     if "password" in user_data:
         password = user_data["password"]
         hashed_password = get_password_hash(password)
         extra_data["hashed_password"] = hashed_password
+        # Sessions opened with the old password end with it
+        revocation = user_tokens_revocation(db_user.id)
+        session.add(revocation)
     db_user.sqlmodel_update(user_data, update=extra_data)
     session.add(db_user)
     session.commit()
     session.refresh(db_user)
+    invalidate_user(db_user.id)
+    if revocation:
+        token_denylist.revoke(revocation)
     return db_user
 
 
 def get_user_by_email(*, session: Session, email: str) -> User | None:
-    statement = select(User).where(User.email == email)
+    statement = select(User).where(User.email == email, col(User.deleted_at).is_(None))
     session_user = session.exec(statement).first()
     return session_user
 
@@ -40,14 +71,224 @@ def authenticate(*, session: Session, email: str, password: str) -> User | None:
     db_user = get_user_by_email(session=session, email=email)
     if not db_user:
         return None
-    if not verify_password(password, db_user.hashed_password):
+    verified, new_hash = verify_and_update_password(password, db_user.hashed_password)
+    if not verified:
         return None
+    if new_hash:
+        db_user.hashed_password = new_hash
+        session.add(db_user)
+        session.commit()
+        invalidate_user(db_user.id)
     return db_user
 
 
+def _item_count_statement(counts: dict[int, int]) -> Any:
+    # Sorted so concurrent transactions lock the counter rows in the same order
+    statement = insert(ItemCount).values(
+        [
+            {"owner_id": owner_id, "count": counts[owner_id]}
+            for owner_id in sorted(counts)
+        ]
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[ItemCount.owner_id],  # type: ignore[list-item]
+        set_={"count": ItemCount.count + statement.excluded.count},
+    )
+
+
+def add_item_counts(*, session: Session, counts: dict[int, int]) -> None:
+    """
+    Add the given deltas to the item counts of their owners.
+
+    Runs in the transaction of the caller, which must commit it with the items.
+    """
+    if counts:
+        session.exec(_item_count_statement(counts))
+
+
 def create_item(*, session: Session, item_in: ItemCreate, owner_id: int) -> Item:
     db_item = Item.model_validate(item_in, update={"owner_id": owner_id})
     session.add(db_item)
+    add_item_counts(session=session, counts={owner_id: 1})
     session.commit()
     session.refresh(db_item)
     return db_item
+
+
+async def async_create_user(
+    *, session: AsyncSession, user_create: UserCreate, email: EmailOutbox | None = None
+) -> User:
+    """Creates the user, and queues the `email` in the same transaction."""
+    hashed_password = await async_get_password_hash(user_create.password)
+    db_obj = User.model_validate(
+        user_create, update={"hashed_password": hashed_password}
+    )
+    session.add(db_obj)
+    if email is not None:
+        session.add(email)
+    await session.commit()
+    if email is not None:
+        email_outbox_sender.wake()
+    await session.refresh(db_obj)
+    return db_obj
+
+
+async def async_update_user(
+    *, session: AsyncSession, db_user: User, user_in: UserUpdate
+) -> Any:
+    user_data = user_in.model_dump(exclude_unset=True)
+    extra_data = {}
+    revocation = None
+    if "password" in user_data:
+        password = user_data["password"]
+        hashed_password = await async_get_password_hash(password)
+        extra_data["hashed_password"] = hashed_password
+        # Sessions opened with the old password end with it
+        revocation = user_tokens_revocation(db_user.id)
+        session.add(revocation)
+    db_user.sqlmodel_update(user_data, update=extra_data)
+    session.add(db_user)
+    await session.commit()
+    await session.refresh(db_user)
+    await async_invalidate_user(db_user.id)
+    if revocation:
+        token_denylist.revoke(revocation)
+    return db_user
+
+
+async def async_delete_user(*, session: AsyncSession, db_user: User) -> bool:
+    """
+    Deletes the user with its items, returns True when it is gone.
+
+    A user with more items than a batch is deactivated and marked deleted
+    instead, and the background deleter removes its items and then the user.
+    """
+    assert db_user.id is not None
+    user_id = db_user.id
+    items_total = await async_get_item_count(session=session, owner_id=user_id)
+    revocation = user_tokens_revocation(user_id)
+    session.add(revocation)
+    deleted = items_total <= settings.USER_DELETION_BATCH_SIZE
+    if deleted:
+        statement = delete(Item).where(col(Item.owner_id) == user_id)
+        await session.exec(statement)  # type: ignore
+        await session.delete(db_user)
+    else:
+        db_user.is_active = False
+        db_user.deleted_at = datetime.utcnow()
+        session.add(db_user)
+        session.add(UserDeletion(user_id=user_id, items_total=items_total))
+    await session.commit()
+    await async_invalidate_user(user_id)
+    token_denylist.revoke(revocation)
+    if not deleted:
+        user_deleter.wake()
+    return deleted
+
+
+async def async_get_user_by_email(*, session: AsyncSession, email: str) -> User | None:
+    statement = select(User).where(User.email == email, col(User.deleted_at).is_(None))
+    session_user = (await session.exec(statement)).first()
+    return session_user
+
+
+async def async_authenticate(
+    *, session: AsyncSession, email: str, password: str
+) -> User | None:
+    db_user = await async_get_user_by_email(session=session, email=email)
+    if not db_user:
+        return None
+    verified, new_hash = await async_verify_and_update_password(
+        password, db_user.hashed_password
+    )
+    if not verified:
+        return None
+    # Stored with an outdated scheme or cost, the plain password is only known now
+    if new_hash:
+        db_user.hashed_password = new_hash
+        session.add(db_user)
+        await session.commit()
+        await async_invalidate_user(db_user.id)
+    return db_user
+
+
+async def async_revoke_tokens(
+    *, session: AsyncSession, revocations: list[TokenRevocation]
+) -> None:
+    session.add_all(revocations)
+    await session.commit()
+    for revocation in revocations:
+        token_denylist.revoke(revocation)
+
+
+async def async_create_item(
+    *, session: AsyncSession, item_in: ItemCreate, owner_id: int
+) -> Item:
+    db_item = Item.model_validate(item_in, update={"owner_id": owner_id})
+    session.add(db_item)
+    await async_add_item_counts(session=session, counts={owner_id: 1})
+    await session.commit()
+    await session.refresh(db_item)
+    return db_item
+
+
+async def async_add_item_counts(
+    *, session: AsyncSession, counts: dict[int, int]
+) -> None:
+    if counts:
+        await session.exec(_item_count_statement(counts))
+
+
+async def async_get_item_count(*, session: AsyncSession, owner_id: int) -> int:
+    statement = select(ItemCount.count).where(ItemCount.owner_id == owner_id)
+    count = (await session.exec(statement)).first()
+    return count or 0
+
+
+async def async_count_rows(
+    *, session: AsyncSession, model: type[SQLModel], where: Any = None
+) -> tuple[int, bool]:
+    """
+    Count the rows of a table, returns the count and whether it is an estimate.
+
+    Tables larger than EXACT_COUNT_MAX_ROWS are estimated from pg_class.reltuples
+    instead of scanning them, the estimate ignores `where`.
+    """
+    table_name = model.__tablename__
+    estimate_statement = text(
+        "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)"
+    )
+    result = await session.execute(estimate_statement, {"name": f'"{table_name}"'})
+    estimate = result.scalar_one_or_none()
+    # reltuples is -1 until the table is vacuumed or analyzed
+    if estimate is not None and estimate > settings.EXACT_COUNT_MAX_ROWS:
+        return estimate, True
+    count_statement = select(func.count()).select_from(model)
+    if where is not None:
+        count_statement = count_statement.where(where)
+    return (await session.exec(count_statement)).one(), False
+
+
+def public_columns(model: type[SQLModel], public_model: type[SQLModel]) -> list[Any]:
+    """
+    Columns of model exposed by public_model, for reads that skip the ORM.
+
+    Rows selected with these map directly onto the public schema.
+    """
+    return [getattr(model, name) for name in public_model.model_fields]
+
+
+def outbox_email(*, email_to: str, subject: str, html_content: str) -> EmailOutbox:
+    """An email to queue along with other writes, e.g. in async_create_user."""
+    assert settings.emails_enabled, "no provided configuration for email variables"
+    return EmailOutbox(email_to=email_to, subject=subject, html_content=html_content)
+
+
+async def async_enqueue_email(
+    *, session: AsyncSession, email_to: str, subject: str, html_content: str
+) -> EmailOutbox:
+    db_obj = outbox_email(email_to=email_to, subject=subject, html_content=html_content)
+    session.add(db_obj)
+    await session.commit()
+    email_outbox_sender.wake()
+    return db_obj
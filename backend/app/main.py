@@ -1,10 +1,28 @@
+import math
+import secrets
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+
 import sentry_sdk
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.routing import APIRoute
+from prometheus_client import CONTENT_TYPE_LATEST
 from starlette.middleware.cors import CORSMiddleware
 
 from app.api.main import api_router
+from app.core.cache import start_user_cache_channel, user_cache_channel
 from app.core.config import settings
+from app.core.db import async_engine, replicas
+from app.core.deletion import user_deleter
+from app.core.metrics import MetricsMiddleware, render_metrics
+from app.core.outbox import email_outbox_sender
+from app.core.pool import ConnectionHoldMiddleware
+from app.core.ratelimit import RateLimitExceededError
+from app.core.revocation import token_denylist
+from app.core.security import PasswordHashingBusyError
+from app.core.timing import ServerTimingMiddleware, TimedORJSONResponse
+from app.utils import warm_email_templates
 
 
 def custom_generate_unique_id(route: APIRoute) -> str:
@@ -14,10 +32,30 @@ def custom_generate_unique_id(route: APIRoute) -> str:
 if settings.SENTRY_DSN and settings.ENVIRONMENT != "local":
     sentry_sdk.init(dsn=str(settings.SENTRY_DSN), enable_tracing=True)
 
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncGenerator[None, None]:
+    await start_user_cache_channel()
+    await token_denylist.start(async_engine)
+    await user_deleter.start(async_engine)
+    if settings.emails_enabled:
+        warm_email_templates()
+        await email_outbox_sender.start(async_engine)
+    yield
+    await email_outbox_sender.stop()
+    await user_deleter.stop()
+    await token_denylist.stop()
+    await user_cache_channel.stop()
+    await async_engine.dispose()
+    await replicas.dispose()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
+    default_response_class=TimedORJSONResponse,
+    lifespan=lifespan,
 )
 
 # Set all CORS enabled origins
@@ -32,4 +70,47 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_headers=["*"],
     )
 
+app.add_middleware(ConnectionHoldMiddleware)
+if settings.SERVER_TIMING_ENABLED:
+    app.add_middleware(ServerTimingMiddleware)
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(PasswordHashingBusyError)
+async def password_hashing_busy_handler(
+    _request: Request, _exc: PasswordHashingBusyError
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please try again later"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(RateLimitExceededError)
+async def rate_limit_exceeded_handler(
+    _request: Request, exc: RateLimitExceededError
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many attempts, please try again later"},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
+
+
+if settings.METRICS_ENABLED:
+
+    @app.get("/metrics", tags=["metrics"], include_in_schema=False)
+    def metrics(request: Request) -> Response:
+        """
+        Metrics of all workers in the Prometheus text format.
+        """
+        if settings.METRICS_TOKEN and not secrets.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"
+        ):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+        return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
@@ -1,4 +1,9 @@
-from sqlmodel import Field, Relationship, SQLModel
+from datetime import datetime
+from typing import Literal
+
+from sqlalchemy import Column, Computed, ForeignKey, Integer, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlmodel import Field, Index, Relationship, SQLModel
 
 
 # Shared properties
@@ -42,19 +47,47 @@ class UpdatePassword(SQLModel):
 
 # Database model, database table inferred from class name
 class User(UserBase, table=True):
+    # Emails are unique among the users that are not being deleted, so the email
+    # of a user deleted in the background can sign up again at once
+    __table_args__ = (
+        Index(
+            "ix_user_email",
+            "email",
+            unique=True,
+            postgresql_where=text("deleted_at IS NULL"),
+        ),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
+    email: str
     hashed_password: str
+    # Bumped by every ORM update, the version behind the ETag of the user
+    updated_at: datetime = Field(
+        default_factory=datetime.utcnow,
+        sa_column_kwargs={"onupdate": datetime.utcnow},
+    )
+    # Set when a background deletion starts, the API treats the user as deleted
+    deleted_at: datetime | None = None
     items: list["Item"] = Relationship(back_populates="owner")
 
 
 # Properties to return via API, id is always required
 class UserPublic(UserBase):
     id: int
+    updated_at: datetime
+
+
+# Column values of a user kept in the user cache
+class CachedUser(UserPublic):
+    hashed_password: str
+    deleted_at: datetime | None = None
 
 
 class UsersPublic(SQLModel):
     data: list[UserPublic]
-    count: int
+    count: int | None
+    count_is_estimate: bool = False
+    next_cursor: str | None = None
 
 
 # Shared properties
@@ -73,25 +106,182 @@ class ItemUpdate(ItemBase):
     title: str | None = None  # type: ignore
 
 
+# The simple configuration neither stems nor drops stop words, so prefix
+# queries match what the user is typing in any language
+ITEM_SEARCH_VECTOR_EXPRESSION = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B')"
+)
+
+
 # Database model, database table inferred from class name
 class Item(ItemBase, table=True):
+    __table_args__ = (
+        # Serves keyset pagination of an owner's items ordered by id, and the
+        # ETag of a page with an index-only scan
+        Index(
+            "ix_item_owner_id_id",
+            "owner_id",
+            "id",
+            postgresql_include=["updated_at"],
+        ),
+        # Serves the ETag of a single item with an index-only scan
+        Index(
+            "ix_item_id_version", "id", postgresql_include=["owner_id", "updated_at"]
+        ),
+        # Serves the full-text search
+        Index("ix_item_search_vector", "search_vector", postgresql_using="gin"),
+        # Serves the title search of queries too short for full-text, needs the
+        # pg_trgm extension
+        Index(
+            "ix_item_title_trgm",
+            text("lower(title) gin_trgm_ops"),
+            postgresql_using="gin",
+        ),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     title: str
     owner_id: int | None = Field(default=None, foreign_key="user.id", nullable=False)
+    # Bumped by every ORM update, the version behind the ETag of the item
+    updated_at: datetime = Field(
+        default_factory=datetime.utcnow,
+        sa_column_kwargs={"onupdate": datetime.utcnow},
+    )
+    # Generated by the database, never set it
+    search_vector: str | None = Field(
+        default=None,
+        exclude=True,
+        sa_column=Column(
+            TSVECTOR,
+            Computed(ITEM_SEARCH_VECTOR_EXPRESSION, persisted=True),
+        ),
+    )
     owner: User | None = Relationship(back_populates="items")
 
 
+# Number of items of each owner, kept up to date by the item write paths
+class ItemCount(SQLModel, table=True):
+    owner_id: int = Field(
+        sa_column=Column(
+            Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
+        )
+    )
+    count: int = 0
+
+
 # Properties to return via API, id is always required
 class ItemPublic(ItemBase):
     id: int
     owner_id: int
+    updated_at: datetime
 
 
 class ItemsPublic(SQLModel):
     data: list[ItemPublic]
+    count: int | None
+    count_is_estimate: bool = False
+    next_cursor: str | None = None
+
+
+# Properties to receive on bulk item update, the id selects the item
+class ItemBulkUpdate(ItemUpdate):
+    id: int
+
+
+# Outcome of one row of a bulk request, in request order
+class ItemBulkResult(SQLModel):
+    id: int | None = None
+    status_code: int
+    detail: str | None = None
+    item: ItemPublic | None = None
+
+
+class ItemsBulkResult(SQLModel):
+    data: list[ItemBulkResult]
     count: int
 
 
+class CacheStats(SQLModel):
+    backend: str
+    hits: int
+    misses: int
+    hit_rate: float
+    size: int
+    maxsize: int
+
+
+class RoutePoolStats(SQLModel):
+    requests: int
+    hold_seconds_total: float
+    hold_seconds_max: float
+
+
+class DatabasePoolStats(SQLModel):
+    pool_size: int
+    max_overflow: int
+    checked_out: int
+    overflow: int
+    checkouts: int
+    overflow_checkouts: int
+    timeouts: int
+    wait_seconds_total: float
+    wait_seconds_max: float
+    routes: dict[str, RoutePoolStats]
+
+
+# Emails waiting to be sent by the background sender
+class EmailOutbox(SQLModel, table=True):
+    # Serves the sender's poll for due messages
+    __table_args__ = (
+        Index(
+            "ix_emailoutbox_pending",
+            "next_attempt_at",
+            postgresql_where=text("status = 'pending'"),
+        ),
+    )
+
+    id: int | None = Field(default=None, primary_key=True)
+    email_to: str
+    subject: str
+    html_content: str
+    status: str = "pending"
+    attempts: int = 0
+    last_error: str | None = None
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: datetime | None = None
+
+
+# Deletion of a user with more items than fit in a batch. The background deleter
+# removes the items a batch at a time and the user with the last one.
+class UserDeletion(SQLModel, table=True):
+    # Serves the deleter's poll for pending deletions
+    __table_args__ = (
+        Index(
+            "ix_userdeletion_pending",
+            "created_at",
+            postgresql_where=text("status = 'pending'"),
+        ),
+    )
+
+    user_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    status: str = "pending"
+    items_total: int
+    items_deleted: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: datetime | None = None
+
+
+class UserDeletionPublic(SQLModel):
+    user_id: int
+    status: str
+    items_total: int
+    items_deleted: int
+    created_at: datetime
+    finished_at: datetime | None
+
+
 # Generic message
 class Message(SQLModel):
     message: str
@@ -101,11 +291,44 @@ class Message(SQLModel):
 class Token(SQLModel):
     access_token: str
     token_type: str = "bearer"
+    # Only issued with AUTH_STATELESS
+    refresh_token: str | None = None
+
+
+class RefreshToken(SQLModel):
+    refresh_token: str
 
 
 # Contents of JWT token
 class TokenPayload(SQLModel):
     sub: int | None = None
+    jti: str | None = None
+    # Shared by the tokens of one login, refreshes carry it over
+    sid: str | None = None
+    iat: float | None = None
+    exp: float | None = None
+    type: Literal["access", "refresh"] = "access"
+    # Claims of the stateless access tokens
+    is_active: bool | None = None
+    is_superuser: bool | None = None
+
+
+# Revokes the token with the jti. With a user_id it revokes every token of the
+# user issued before revoked_at instead, except the tokens whose jti or session
+# id (sid) is the jti. Kept until the revoked tokens expire.
+class TokenRevocation(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    jti: str | None = None
+    user_id: int | None = None
+    revoked_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime = Field(index=True)
+
+
+# The requesting user as far as authorization needs it
+class UserClaims(SQLModel):
+    id: int
+    is_active: bool
+    is_superuser: bool
 
 
 class NewPassword(SQLModel):
@@ -1,8 +1,17 @@
+import csv
+import io
+import json
+from unittest.mock import patch
+
 from fastapi.testclient import TestClient
+from sqlalchemy import text
 from sqlmodel import Session
 
 from app.core.config import settings
+from app.tests.conftest import QueryBudget
 from app.tests.utils.item import create_random_item
+from app.tests.utils.user import authentication_token_from_email
+from app.tests.utils.utils import random_email, random_lower_string
 
 
 def test_create_item(
@@ -38,6 +47,56 @@ def test_read_item(
     assert content["owner_id"] == item.owner_id
 
 
+def test_read_item_etag(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    item = create_random_item(db)
+    url = f"{settings.API_V1_STR}/items/{item.id}"
+    response = client.get(url, headers=superuser_token_headers)
+    etag = response.headers["ETag"]
+
+    response = client.get(
+        url, headers={**superuser_token_headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    response = client.put(
+        url, headers=superuser_token_headers, json={"title": "Updated title"}
+    )
+    assert response.status_code == 200
+    response = client.get(
+        url, headers={**superuser_token_headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["title"] == "Updated title"
+
+
+def test_read_items_etag(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    create_random_item(db)
+    url = f"{settings.API_V1_STR}/items/"
+    response = client.get(url, headers=superuser_token_headers)
+    etag = response.headers["ETag"]
+
+    response = client.get(
+        url, headers={**superuser_token_headers, "If-None-Match": f"W/{etag}"}
+    )
+    assert response.status_code == 304
+
+    item = create_random_item(db)
+    response = client.get(
+        url,
+        headers={**superuser_token_headers, "If-None-Match": etag},
+        params={"limit": 1000},
+    )
+    assert response.status_code == 200
+    assert item.id in [i["id"] for i in response.json()["data"]]
+
+
 def test_read_item_not_found(
     client: TestClient, superuser_token_headers: dict[str, str]
 ) -> None:
@@ -77,6 +136,45 @@ def test_read_items(
     assert len(content["data"]) >= 2
 
 
+def test_read_items_cursor(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    create_random_item(db)
+    create_random_item(db)
+    create_random_item(db)
+    response = client.get(
+        f"{settings.API_V1_STR}/items/",
+        headers=superuser_token_headers,
+        params={"limit": 2},
+    )
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page["data"]) == 2
+    assert first_page["next_cursor"]
+    response = client.get(
+        f"{settings.API_V1_STR}/items/",
+        headers=superuser_token_headers,
+        params={"limit": 2, "cursor": first_page["next_cursor"]},
+    )
+    assert response.status_code == 200
+    second_page = response.json()
+    assert second_page["data"]
+    assert second_page["data"][0]["id"] > first_page["data"][-1]["id"]
+
+
+def test_read_items_invalid_cursor(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/items/",
+        headers=superuser_token_headers,
+        params={"cursor": "not-a-cursor"},
+    )
+    assert response.status_code == 400
+    content = response.json()
+    assert content["detail"] == "Invalid cursor"
+
+
 def test_update_item(
     client: TestClient, superuser_token_headers: dict[str, str], db: Session
 ) -> None:
@@ -160,3 +258,318 @@ def test_delete_item_not_enough_permissions(
     assert response.status_code == 400
     content = response.json()
     assert content["detail"] == "Not enough permissions"
+
+
+def test_create_items_bulk(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    data = [{"title": f"Bulk {i}", "description": "Imported"} for i in range(3)]
+    response = client.post(
+        f"{settings.API_V1_STR}/items/bulk",
+        headers=normal_user_token_headers,
+        json=data,
+    )
+    assert response.status_code == 200
+    content = response.json()
+    assert content["count"] == 3
+    assert [row["status_code"] for row in content["data"]] == [200, 200, 200]
+    assert [row["item"]["title"] for row in content["data"]] == [
+        "Bulk 0",
+        "Bulk 1",
+        "Bulk 2",
+    ]
+    assert all(row["id"] == row["item"]["id"] for row in content["data"])
+
+
+def test_create_items_bulk_empty(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/items/bulk",
+        headers=normal_user_token_headers,
+        json=[],
+    )
+    assert response.status_code == 422
+
+
+def test_update_items_bulk(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/items/bulk",
+        headers=normal_user_token_headers,
+        json=[{"title": "Mine"}],
+    )
+    own_id = response.json()["data"][0]["id"]
+    other_item = create_random_item(db)
+    response = client.patch(
+        f"{settings.API_V1_STR}/items/bulk",
+        headers=normal_user_token_headers,
+        json=[
+            {"id": own_id, "title": "Updated"},
+            {"id": other_item.id, "title": "Updated"},
+            {"id": 999999999, "title": "Updated"},
+        ],
+    )
+    assert response.status_code == 200
+    content = response.json()
+    assert content["count"] == 1
+    own, other, missing = content["data"]
+    assert own["status_code"] == 200
+    assert own["item"]["title"] == "Updated"
+    assert other["status_code"] == 400
+    assert other["detail"] == "Not enough permissions"
+    assert missing["status_code"] == 404
+    assert missing["detail"] == "Item not found"
+    db.refresh(other_item)
+    assert other_item.title != "Updated"
+
+
+def test_delete_items_bulk(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/items/bulk",
+        headers=normal_user_token_headers,
+        json=[{"title": "Delete me"}, {"title": "Delete me too"}],
+    )
+    own_ids = [row["id"] for row in response.json()["data"]]
+    other_item = create_random_item(db)
+    response = client.request(
+        "DELETE",
+        f"{settings.API_V1_STR}/items/bulk",
+        headers=normal_user_token_headers,
+        json=[*own_ids, other_item.id],
+    )
+    assert response.status_code == 200
+    content = response.json()
+    assert content["count"] == 2
+    assert [row["status_code"] for row in content["data"]] == [200, 200, 400]
+    for id in own_ids:
+        response = client.get(
+            f"{settings.API_V1_STR}/items/{id}", headers=normal_user_token_headers
+        )
+        assert response.status_code == 404
+
+
+def test_export_items_ndjson(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/items/bulk",
+        headers=normal_user_token_headers,
+        json=[{"title": "Export 1"}, {"title": "Export 2"}],
+    )
+    first_id, second_id = [row["id"] for row in response.json()["data"]]
+    other_item = create_random_item(db)
+    response = client.get(
+        f"{settings.API_V1_STR}/items/export",
+        headers=normal_user_token_headers,
+        params={"since_id": first_id - 1},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    ids = [row["id"] for row in rows]
+    assert ids[:2] == [first_id, second_id]
+    assert other_item.id not in ids
+    assert rows[0]["title"] == "Export 1"
+
+    response = client.get(
+        f"{settings.API_V1_STR}/items/export",
+        headers=normal_user_token_headers,
+        params={"since_id": first_id},
+    )
+    ids = [json.loads(line)["id"] for line in response.text.splitlines()]
+    assert ids[0] == second_id
+
+
+def test_export_items_csv(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    item = create_random_item(db)
+    response = client.get(
+        f"{settings.API_V1_STR}/items/export",
+        headers=superuser_token_headers,
+        params={"format": "csv", "since_id": item.id - 1},  # type: ignore[operator]
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["id", "title", "description", "owner_id"]
+    assert rows[1] == [str(item.id), item.title, item.description, str(item.owner_id)]
+
+
+def test_read_items_count(client: TestClient, db: Session) -> None:
+    headers = authentication_token_from_email(
+        client=client, email=random_email(), db=db
+    )
+    client.post(
+        f"{settings.API_V1_STR}/items/bulk",
+        headers=headers,
+        json=[{"title": "One"}, {"title": "Two"}, {"title": "Three"}],
+    )
+    response = client.get(f"{settings.API_V1_STR}/items/", headers=headers)
+    content = response.json()
+    assert content["count"] == 3
+    assert content["count_is_estimate"] is False
+
+    item_id = content["data"][0]["id"]
+    client.delete(f"{settings.API_V1_STR}/items/{item_id}", headers=headers)
+    response = client.get(f"{settings.API_V1_STR}/items/", headers=headers)
+    assert response.json()["count"] == 2
+
+    response = client.get(
+        f"{settings.API_V1_STR}/items/",
+        headers=headers,
+        params={"include_count": False},
+    )
+    content = response.json()
+    assert content["count"] is None
+    assert len(content["data"]) == 2
+
+
+def test_read_items_count_estimate(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    create_random_item(db)
+    db.execute(text("ANALYZE item"))
+    with patch("app.core.config.settings.EXACT_COUNT_MAX_ROWS", 0):
+        response = client.get(
+            f"{settings.API_V1_STR}/items/", headers=superuser_token_headers
+        )
+    content = response.json()
+    assert content["count_is_estimate"] is True
+    assert content["count"] > 0
+
+
+def test_search_items(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    headers = authentication_token_from_email(
+        client=client, email=random_email(), db=db
+    )
+    word = random_lower_string()
+    client.post(
+        f"{settings.API_V1_STR}/items/bulk",
+        headers=headers,
+        json=[
+            {"title": "Other", "description": f"Mentions {word} once"},
+            {"title": f"{word} in the title"},
+            {"title": "Unrelated"},
+        ],
+    )
+    client.post(
+        f"{settings.API_V1_STR}/items/",
+        headers=superuser_token_headers,
+        json={"title": f"Superuser {word}"},
+    )
+
+    url = f"{settings.API_V1_STR}/items/search"
+    response = client.get(url, headers=headers, params={"q": word})
+    assert response.status_code == 200
+    titles = [item["title"] for item in response.json()["data"]]
+    # Title matches rank first, other owners' items are not visible
+    assert titles == [f"{word} in the title", "Other"]
+
+    # The last word matches as a prefix
+    response = client.get(url, headers=headers, params={"q": f"in {word[:10]}"})
+    assert [item["title"] for item in response.json()["data"]] == [
+        f"{word} in the title"
+    ]
+
+    response = client.get(url, headers=superuser_token_headers, params={"q": word})
+    assert len(response.json()["data"]) == 3
+
+
+def test_search_items_pagination(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    word = random_lower_string()
+    client.post(
+        f"{settings.API_V1_STR}/items/bulk",
+        headers=normal_user_token_headers,
+        json=[{"title": word} for _ in range(3)],
+    )
+    url = f"{settings.API_V1_STR}/items/search"
+    ids: list[int] = []
+    params: dict[str, str | int] = {"q": word, "limit": 2}
+    while True:
+        content = client.get(url, headers=normal_user_token_headers, params=params)
+        ids.extend(item["id"] for item in content.json()["data"])
+        if content.json()["next_cursor"] is None:
+            break
+        params["cursor"] = content.json()["next_cursor"]
+    assert len(ids) == len(set(ids)) == 3
+
+    response = client.get(
+        url, headers=normal_user_token_headers, params={"q": word, "cursor": "bad"}
+    )
+    assert response.status_code == 400
+
+
+def test_search_items_short_query(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    client.post(
+        f"{settings.API_V1_STR}/items/bulk",
+        headers=superuser_token_headers,
+        json=[
+            {"title": "Zq_ short query"},
+            {"title": "Mid word azqa"},
+            {"title": "Other", "description": "Mentions zq once"},
+        ],
+    )
+    url = f"{settings.API_V1_STR}/items/search"
+    response = client.get(
+        url, headers=superuser_token_headers, params={"q": "zq", "limit": 1000}
+    )
+    assert response.status_code == 200
+    data = response.json()["data"]
+    titles = [item["title"] for item in data]
+    # Anywhere in the title, in id order
+    assert {"Zq_ short query", "Mid word azqa"} <= set(titles)
+    assert all("zq" in title.lower() for title in titles)
+    assert [item["id"] for item in data] == sorted(item["id"] for item in data)
+
+    params: dict[str, str | int] = {"q": "zq", "limit": 1}
+    response = client.get(url, headers=superuser_token_headers, params=params)
+    params["cursor"] = response.json()["next_cursor"]
+    response = client.get(url, headers=superuser_token_headers, params=params)
+    assert response.json()["data"] == data[1:2]
+
+    response = client.get(url, headers=superuser_token_headers, params={"q": "z%"})
+    # LIKE wildcards in the query are matched literally
+    assert response.json()["data"] == []
+
+
+def test_items_query_budget(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    query_budget: QueryBudget,
+) -> None:
+    headers = normal_user_token_headers
+    # Caches the current user, the budgets below leave out its lookup
+    client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    with query_budget(2):
+        r = client.get(f"{settings.API_V1_STR}/items/", headers=headers)
+    assert r.status_code == 200
+    # Writes refresh() the item for its generated search_vector column
+    with query_budget(3):
+        r = client.post(
+            f"{settings.API_V1_STR}/items/", headers=headers, json={"title": "Foo"}
+        )
+    assert r.status_code == 200
+    id = r.json()["id"]
+    with query_budget(1):
+        r = client.get(f"{settings.API_V1_STR}/items/{id}", headers=headers)
+    assert r.status_code == 200
+    with query_budget(3):
+        r = client.put(
+            f"{settings.API_V1_STR}/items/{id}", headers=headers, json={"title": "Bar"}
+        )
+    assert r.status_code == 200
+    assert r.json()["title"] == "Bar"
+    with query_budget(3):
+        r = client.delete(f"{settings.API_V1_STR}/items/{id}", headers=headers)
+    assert r.status_code == 200
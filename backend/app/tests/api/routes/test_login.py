@@ -1,11 +1,25 @@
 from unittest.mock import patch
 
+import anyio
 from fastapi.testclient import TestClient
 from sqlmodel import Session, select
 
+from app import crud
+from app.core.cache import token_cache, user_cache
 from app.core.config import settings
+from app.core.ratelimit import (
+    account_failure_rate_limiter,
+    account_rate_limiter,
+    ip_rate_limiter,
+)
 from app.core.security import verify_password
-from app.models import User
+from app.models import EmailOutbox, User, UserCreate, UserUpdate
+from app.tests.conftest import QueryBudget
+from app.tests.utils.user import (
+    authentication_token_from_email,
+    user_authentication_headers,
+)
+from app.tests.utils.utils import random_email, random_lower_string
 from app.utils import generate_password_reset_token
 
 
@@ -30,6 +44,102 @@ def test_get_access_token_incorrect_password(client: TestClient) -> None:
     assert r.status_code == 400
 
 
+def test_get_access_token_hashing_busy(client: TestClient) -> None:
+    login_data = {
+        "username": settings.FIRST_SUPERUSER,
+        "password": settings.FIRST_SUPERUSER_PASSWORD,
+    }
+    with (
+        patch("app.core.config.settings.PASSWORD_HASH_WORKERS", 0),
+        patch("app.core.config.settings.PASSWORD_HASH_QUEUE_SIZE", 0),
+    ):
+        r = client.post(f"{settings.API_V1_STR}/login/access-token", data=login_data)
+    assert r.status_code == 503
+    assert r.headers["Retry-After"]
+
+
+def test_get_access_token_account_rate_limit(client: TestClient) -> None:
+    url = f"{settings.API_V1_STR}/login/access-token"
+    wrong = {"username": settings.FIRST_SUPERUSER, "password": "incorrect"}
+    right = {
+        "username": settings.FIRST_SUPERUSER,
+        "password": settings.FIRST_SUPERUSER_PASSWORD,
+    }
+    with (
+        patch.object(account_rate_limiter, "limit", 2),
+        patch("app.core.security.verify_and_update_password") as verify_password,
+    ):
+        verify_password.return_value = (False, None)
+        assert client.post(url, data=wrong).status_code == 400
+        assert client.post(url, data=wrong).status_code == 400
+        r = client.post(url, data=right)
+        assert r.status_code == 429
+        assert int(r.headers["Retry-After"]) > 0
+        # Rejected before the password was checked
+        assert verify_password.call_count == 2
+        # Other accounts are not affected
+        other = {"username": "other@example.com", "password": "incorrect"}
+        assert client.post(url, data=other).status_code == 400
+        # Nor is the account from another IP, failures can't lock its owner out
+        with patch("app.api.routes.login.client_ip", return_value="192.0.2.1"):
+            verify_password.return_value = (True, None)
+            assert client.post(url, data=right).status_code == 200
+
+    # TestClient requests have no client address
+    anyio.run(account_rate_limiter.reset, f"login:{settings.FIRST_SUPERUSER}:unknown")
+    with patch.object(account_rate_limiter, "limit", 2):
+        assert client.post(url, data=wrong).status_code == 400
+        # A successful login clears the failures of the account
+        assert client.post(url, data=right).status_code == 200
+        assert client.post(url, data=wrong).status_code == 400
+        assert client.post(url, data=wrong).status_code == 400
+
+
+def test_get_access_token_account_failure_cap(client: TestClient) -> None:
+    url = f"{settings.API_V1_STR}/login/access-token"
+    wrong = {"username": settings.FIRST_SUPERUSER, "password": "incorrect"}
+    right = {
+        "username": settings.FIRST_SUPERUSER,
+        "password": settings.FIRST_SUPERUSER_PASSWORD,
+    }
+    with (
+        patch.object(account_failure_rate_limiter, "limit", 3),
+        patch("app.core.security.verify_and_update_password") as verify_password,
+    ):
+        verify_password.return_value = (False, None)
+        for i in range(3):
+            with patch("app.api.routes.login.client_ip", return_value=f"192.0.2.{i}"):
+                assert client.post(url, data=wrong).status_code == 400
+        # Failures from every IP count against the account
+        with patch("app.api.routes.login.client_ip", return_value="192.0.2.10"):
+            r = client.post(url, data=right)
+        assert r.status_code == 429
+        assert int(r.headers["Retry-After"]) > 0
+        assert verify_password.call_count == 3
+
+
+def test_get_access_token_ip_rate_limit(client: TestClient) -> None:
+    with patch.object(ip_rate_limiter, "limit", 2):
+        for _ in range(2):
+            r = client.post(
+                f"{settings.API_V1_STR}/login/access-token",
+                data={"username": random_email(), "password": "incorrect"},
+            )
+            assert r.status_code == 400
+        r = client.post(
+            f"{settings.API_V1_STR}/login/access-token",
+            data={"username": random_email(), "password": "incorrect"},
+        )
+        assert r.status_code == 429
+        r = client.post(f"{settings.API_V1_STR}/password-recovery/{random_email()}")
+        assert r.status_code == 429
+        r = client.post(
+            f"{settings.API_V1_STR}/reset-password/",
+            json={"new_password": "changethis", "token": "invalid"},
+        )
+        assert r.status_code == 429
+
+
 def test_use_access_token(
     client: TestClient, superuser_token_headers: dict[str, str]
 ) -> None:
@@ -42,8 +152,191 @@ def test_use_access_token(
     assert "email" in result
 
 
+def test_use_access_token_cached(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    client.post(
+        f"{settings.API_V1_STR}/login/test-token", headers=superuser_token_headers
+    )
+    hits = token_cache.hits
+    r = client.post(
+        f"{settings.API_V1_STR}/login/test-token", headers=superuser_token_headers
+    )
+    assert r.status_code == 200
+    assert token_cache.hits == hits + 1
+
+
+def test_use_invalid_access_token(client: TestClient) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/login/test-token",
+        headers={"Authorization": "Bearer invalid"},
+    )
+    assert r.status_code == 403
+
+
+def _stateless_login(client: TestClient) -> dict[str, str]:
+    login_data = {
+        "username": settings.FIRST_SUPERUSER,
+        "password": settings.FIRST_SUPERUSER_PASSWORD,
+    }
+    r = client.post(f"{settings.API_V1_STR}/login/access-token", data=login_data)
+    assert r.status_code == 200
+    tokens: dict[str, str] = r.json()
+    return tokens
+
+
+def test_stateless_access_token(client: TestClient, query_budget: QueryBudget) -> None:
+    with patch("app.core.config.settings.AUTH_STATELESS", True):
+        tokens = _stateless_login(client)
+        assert tokens["refresh_token"]
+        headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+        r = client.post(
+            f"{settings.API_V1_STR}/items/", headers=headers, json={"title": "Foo"}
+        )
+        assert r.status_code == 200
+        id = r.json()["id"]
+        user_cache.clear()
+        # The user comes from the claims, only the item is queried
+        with query_budget(1):
+            r = client.get(f"{settings.API_V1_STR}/items/{id}", headers=headers)
+        assert r.status_code == 200
+        # Superuser endpoints are authorized by the claims too
+        r = client.get(f"{settings.API_V1_STR}/users/", headers=headers)
+        assert r.status_code == 200
+
+
+def test_stateless_demoted_superuser(client: TestClient, db: Session) -> None:
+    email = random_email()
+    user_in = UserCreate(email=email, password=random_lower_string(), is_superuser=True)
+    user = crud.create_user(session=db, user_create=user_in)
+    with patch("app.core.config.settings.AUTH_STATELESS", True):
+        headers = authentication_token_from_email(client=client, email=email, db=db)
+        crud.update_user(
+            session=db, db_user=user, user_in=UserUpdate(is_superuser=False)
+        )
+        # Admin writes load the user, only reads trust the stale claims
+        r = client.patch(
+            f"{settings.API_V1_STR}/users/{user.id}",
+            headers=headers,
+            json={"is_superuser": True},
+        )
+        assert r.status_code == 403
+        r = client.get(f"{settings.API_V1_STR}/users/", headers=headers)
+        assert r.status_code == 200
+
+
+def test_stateless_refresh_token(client: TestClient) -> None:
+    url = f"{settings.API_V1_STR}/login/refresh-token"
+    with patch("app.core.config.settings.AUTH_STATELESS", True):
+        tokens = _stateless_login(client)
+        r = client.post(url, json={"refresh_token": tokens["refresh_token"]})
+        assert r.status_code == 200
+        refreshed = r.json()
+        assert refreshed["access_token"]
+        assert refreshed["refresh_token"]
+        r = client.get(
+            f"{settings.API_V1_STR}/users/me",
+            headers={"Authorization": f"Bearer {refreshed['access_token']}"},
+        )
+        assert r.status_code == 200
+
+        # Each token is only good for its own use
+        r = client.post(url, json={"refresh_token": tokens["access_token"]})
+        assert r.status_code == 403
+        r = client.get(
+            f"{settings.API_V1_STR}/items/",
+            headers={"Authorization": f"Bearer {tokens['refresh_token']}"},
+        )
+        assert r.status_code == 403
+
+    r = client.post(url, json={"refresh_token": tokens["refresh_token"]})
+    assert r.status_code == 404
+
+
+def test_stateless_password_change_keeps_session(
+    client: TestClient, db: Session
+) -> None:
+    email = random_email()
+    password = random_lower_string()
+    authentication_token_from_email(
+        client=client, email=email, db=db, password=password
+    )
+    login_data = {"username": email, "password": password}
+    url = f"{settings.API_V1_STR}/login/refresh-token"
+    with patch("app.core.config.settings.AUTH_STATELESS", True):
+        tokens = client.post(
+            f"{settings.API_V1_STR}/login/access-token", data=login_data
+        ).json()
+        other = client.post(
+            f"{settings.API_V1_STR}/login/access-token", data=login_data
+        ).json()
+        r = client.patch(
+            f"{settings.API_V1_STR}/users/me/password",
+            headers={"Authorization": f"Bearer {tokens['access_token']}"},
+            json={"current_password": password, "new_password": random_lower_string()},
+        )
+        assert r.status_code == 200
+        # The session that changed the password can still refresh, not the others
+        r = client.post(url, json={"refresh_token": tokens["refresh_token"]})
+        assert r.status_code == 200
+        r = client.post(url, json={"refresh_token": other["refresh_token"]})
+        assert r.status_code == 403
+
+
+def test_logout(client: TestClient, db: Session) -> None:
+    email = random_email()
+    password = random_lower_string()
+    headers = authentication_token_from_email(
+        client=client, email=email, db=db, password=password
+    )
+    other_session = user_authentication_headers(
+        client=client, email=email, password=password
+    )
+    r = client.post(f"{settings.API_V1_STR}/logout", headers=headers)
+    assert r.status_code == 200
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 403
+    # Only the session that logged out ends
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=other_session)
+    assert r.status_code == 200
+
+
+def test_logout_refresh_token(client: TestClient) -> None:
+    with patch("app.core.config.settings.AUTH_STATELESS", True):
+        tokens = _stateless_login(client)
+        r = client.post(
+            f"{settings.API_V1_STR}/logout",
+            headers={"Authorization": f"Bearer {tokens['access_token']}"},
+            json={"refresh_token": tokens["refresh_token"]},
+        )
+        assert r.status_code == 200
+        r = client.post(
+            f"{settings.API_V1_STR}/login/refresh-token",
+            json={"refresh_token": tokens["refresh_token"]},
+        )
+        assert r.status_code == 403
+
+
+def test_reset_password_revokes_tokens(client: TestClient, db: Session) -> None:
+    email = random_email()
+    headers = authentication_token_from_email(client=client, email=email, db=db)
+    token = generate_password_reset_token(email=email)
+    r = client.post(
+        f"{settings.API_V1_STR}/reset-password/",
+        json={"new_password": "changethis", "token": token},
+    )
+    assert r.status_code == 200
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 403
+    headers = user_authentication_headers(
+        client=client, email=email, password="changethis"
+    )
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 200
+
+
 def test_recovery_password(
-    client: TestClient, normal_user_token_headers: dict[str, str]
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
 ) -> None:
     with (
         patch("app.core.config.settings.SMTP_HOST", "smtp.example.com"),
@@ -56,6 +349,9 @@ def test_recovery_password(
         )
         assert r.status_code == 200
         assert r.json() == {"message": "Password recovery email sent"}
+        queued = db.exec(select(EmailOutbox).where(EmailOutbox.email_to == email)).all()
+        assert queued
+        assert queued[-1].status == "pending"
 
 
 def test_recovery_password_user_not_exits(
@@ -1,3 +1,5 @@
+import time
+from datetime import datetime
 from unittest.mock import patch
 
 from fastapi.testclient import TestClient
@@ -6,7 +8,13 @@ from sqlmodel import Session, select
 from app import crud
 from app.core.config import settings
 from app.core.security import verify_password
-from app.models import User, UserCreate
+from app.models import EmailOutbox, ItemCreate, User, UserCreate
+from app.tests.conftest import QueryBudget
+from app.tests.utils.user import (
+    authentication_token_from_email,
+    create_random_user,
+    user_authentication_headers,
+)
 from app.tests.utils.utils import random_email, random_lower_string
 
 
@@ -32,11 +40,32 @@ def test_get_users_normal_user_me(
     assert current_user["email"] == settings.EMAIL_TEST_USER
 
 
+def test_get_users_me_etag(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    url = f"{settings.API_V1_STR}/users/me"
+    r = client.get(url, headers=normal_user_token_headers)
+    etag = r.headers["ETag"]
+
+    r = client.get(url, headers={**normal_user_token_headers, "If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+
+    r = client.patch(
+        url,
+        headers=normal_user_token_headers,
+        json={"full_name": random_lower_string()},
+    )
+    assert r.status_code == 200
+    r = client.get(url, headers={**normal_user_token_headers, "If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.headers["ETag"] != etag
+
+
 def test_create_user_new_email(
     client: TestClient, superuser_token_headers: dict[str, str], db: Session
 ) -> None:
     with (
-        patch("app.utils.send_email", return_value=None),
         patch("app.core.config.settings.SMTP_HOST", "smtp.example.com"),
         patch("app.core.config.settings.SMTP_USER", "admin@example.com"),
     ):
@@ -53,6 +82,10 @@ def test_create_user_new_email(
         user = crud.get_user_by_email(session=db, email=username)
         assert user
         assert user.email == created_user["email"]
+        # The welcome email is queued for the outbox sender
+        statement = select(EmailOutbox).where(EmailOutbox.email_to == username)
+        outbox_message = db.exec(statement).one()
+        assert outbox_message.subject.endswith(f"New account for user {username}")
 
 
 def test_get_existing_user(
@@ -167,6 +200,32 @@ def test_retrieve_users(
         assert "email" in item
 
 
+def test_retrieve_users_cursor(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    for _ in range(3):
+        user_in = UserCreate(email=random_email(), password=random_lower_string())
+        crud.create_user(session=db, user_create=user_in)
+
+    r = client.get(
+        f"{settings.API_V1_STR}/users/",
+        headers=superuser_token_headers,
+        params={"limit": 2},
+    )
+    first_page = r.json()
+    assert len(first_page["data"]) == 2
+    assert first_page["next_cursor"]
+
+    r = client.get(
+        f"{settings.API_V1_STR}/users/",
+        headers=superuser_token_headers,
+        params={"limit": 2, "cursor": first_page["next_cursor"]},
+    )
+    second_page = r.json()
+    assert second_page["data"]
+    assert second_page["data"][0]["id"] > first_page["data"][-1]["id"]
+
+
 def test_update_user_me(
     client: TestClient, normal_user_token_headers: dict[str, str], db: Session
 ) -> None:
@@ -229,6 +288,29 @@ def test_update_password_me(
     assert verify_password(settings.FIRST_SUPERUSER_PASSWORD, user_db.hashed_password)
 
 
+def test_update_password_me_ends_other_sessions(
+    client: TestClient, db: Session
+) -> None:
+    email = random_email()
+    password = random_lower_string()
+    headers = authentication_token_from_email(
+        client=client, email=email, db=db, password=password
+    )
+    other_session = user_authentication_headers(
+        client=client, email=email, password=password
+    )
+    r = client.patch(
+        f"{settings.API_V1_STR}/users/me/password",
+        headers=headers,
+        json={"current_password": password, "new_password": random_lower_string()},
+    )
+    assert r.status_code == 200
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 200
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=other_session)
+    assert r.status_code == 403
+
+
 def test_update_password_me_incorrect_password(
     client: TestClient, superuser_token_headers: dict[str, str]
 ) -> None:
@@ -366,6 +448,33 @@ def test_update_user(
     assert user_db.full_name == "Updated_full_name"
 
 
+def test_update_user_invalidates_cached_user(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    username = random_email()
+    password = random_lower_string()
+    user_in = UserCreate(email=username, password=password)
+    user = crud.create_user(session=db, user_create=user_in)
+    headers = user_authentication_headers(
+        client=client, email=username, password=password
+    )
+
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 200
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 200
+
+    r = client.patch(
+        f"{settings.API_V1_STR}/users/{user.id}",
+        headers=superuser_token_headers,
+        json={"is_active": False},
+    )
+    assert r.status_code == 200
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Inactive user"
+
+
 def test_update_user_not_exists(
     client: TestClient, superuser_token_headers: dict[str, str]
 ) -> None:
@@ -464,6 +573,68 @@ def test_delete_user_super_user(
     assert result is None
 
 
+def test_delete_user_with_many_items(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    user_id = create_random_user(db).id
+    assert user_id is not None
+    for i in range(3):
+        crud.create_item(
+            session=db, item_in=ItemCreate(title=f"Item {i}"), owner_id=user_id
+        )
+    with patch("app.core.config.settings.USER_DELETION_BATCH_SIZE", 2):
+        r = client.delete(
+            f"{settings.API_V1_STR}/users/{user_id}", headers=superuser_token_headers
+        )
+        assert r.status_code == 202
+        assert r.json()["message"] == "User deletion started"
+        # The background deleter takes it from here
+        for _ in range(50):
+            r = client.get(
+                f"{settings.API_V1_STR}/users/{user_id}/deletion",
+                headers=superuser_token_headers,
+            )
+            assert r.status_code == 200
+            if r.json()["status"] == "done":
+                break
+            time.sleep(0.1)
+    deletion = r.json()
+    assert deletion["status"] == "done"
+    assert deletion["items_total"] == deletion["items_deleted"] == 3
+    db.expire_all()
+    assert db.get(User, user_id) is None
+
+
+def test_user_pending_deletion(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    user = create_random_user(db)
+    user_id, email = user.id, user.email
+    # As left by a deletion still running in the background
+    user.is_active = False
+    user.deleted_at = datetime.utcnow()
+    db.add(user)
+    db.commit()
+    url = f"{settings.API_V1_STR}/users/{user_id}"
+
+    r = client.get(url, headers=superuser_token_headers)
+    assert r.status_code == 404
+    r = client.get(f"{settings.API_V1_STR}/users/", headers=superuser_token_headers)
+    assert user_id not in [user["id"] for user in r.json()["data"]]
+    r = client.patch(url, headers=superuser_token_headers, json={"full_name": "New"})
+    assert r.status_code == 409
+    r = client.delete(url, headers=superuser_token_headers)
+    assert r.status_code == 409
+    # The email is free again
+    r = client.post(
+        f"{settings.API_V1_STR}/users/",
+        headers=superuser_token_headers,
+        json={"email": email, "password": random_lower_string()},
+    )
+    assert r.status_code == 200
+    assert r.json()["id"] != user_id
+
+
 def test_delete_user_not_found(
     client: TestClient, superuser_token_headers: dict[str, str]
 ) -> None:
@@ -504,3 +675,33 @@ def test_delete_user_without_privileges(
     )
     assert r.status_code == 403
     assert r.json()["detail"] == "The user doesn't have enough privileges"
+
+
+def test_users_query_budget(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    query_budget: QueryBudget,
+) -> None:
+    headers = superuser_token_headers
+    with query_budget(1):
+        r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 200
+    # The current user is cached now
+    with query_budget(0):
+        r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 200
+    with query_budget(3):
+        r = client.get(f"{settings.API_V1_STR}/users/", headers=headers)
+    assert r.status_code == 200
+    with query_budget(1):
+        r = client.get(
+            f"{settings.API_V1_STR}/users/?include_count=false", headers=headers
+        )
+    assert r.status_code == 200
+    with query_budget(3):
+        r = client.post(
+            f"{settings.API_V1_STR}/users/",
+            headers=headers,
+            json={"email": random_email(), "password": random_lower_string()},
+        )
+    assert r.status_code == 200
@@ -0,0 +1,40 @@
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+
+
+def test_cache_stats(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/cache-stats/", headers=superuser_token_headers
+    )
+    assert r.status_code == 200
+    content = r.json()
+    assert content["users"]["hits"] + content["users"]["misses"] > 0
+    assert "tokens" in content
+
+
+def test_db_pool_stats(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    client.get(f"{settings.API_V1_STR}/items/", headers=superuser_token_headers)
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/db-pool-stats/", headers=superuser_token_headers
+    )
+    assert r.status_code == 200
+    content = r.json()
+    assert content["pool_size"] == settings.POSTGRES_POOL_SIZE
+    assert content["checkouts"] > 0
+    route = content["routes"][f"GET {settings.API_V1_STR}/items/"]
+    assert route["requests"] > 0
+    assert route["hold_seconds_total"] > 0
+
+
+def test_db_pool_stats_normal_user(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/db-pool-stats/", headers=normal_user_token_headers
+    )
+    assert r.status_code == 403
@@ -1,13 +1,18 @@
-from collections.abc import Generator
+from collections.abc import AsyncGenerator, Callable, Generator, Iterator
+from contextlib import AbstractContextManager, contextmanager
+from typing import Any
 
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 from sqlmodel import Session, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core.config import settings
-from app.core.db import engine, init_db
+from app.core.db import async_engine, engine, init_db
+from app.core.ratelimit import rate_limit_cache
 from app.main import app
-from app.models import Item, User
+from app.models import EmailOutbox, Item, User
 from app.tests.utils.user import authentication_token_from_email
 from app.tests.utils.utils import get_superuser_token_headers
 
@@ -21,9 +26,32 @@ def db() -> Generator[Session, None, None]:
         session.execute(statement)
         statement = delete(User)
         session.execute(statement)
+        statement = delete(EmailOutbox)
+        session.execute(statement)
         session.commit()
 
 
+@pytest.fixture(autouse=True)
+def clear_rate_limits() -> Generator[None, None, None]:
+    # Every test logs in from the same client address
+    rate_limit_cache.clear()
+    yield
+    rate_limit_cache.clear()
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture
+async def async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+    # Pooled connections are bound to this test's event loop
+    await async_engine.dispose()
+
+
 @pytest.fixture(scope="module")
 def client() -> Generator[TestClient, None, None]:
     with TestClient(app) as c:
@@ -40,3 +68,40 @@ def normal_user_token_headers(client: TestClient, db: Session) -> dict[str, str]
     return authentication_token_from_email(
         client=client, email=settings.EMAIL_TEST_USER, db=db
     )
+
+
+QueryBudget = Callable[[int], AbstractContextManager[list[str]]]
+
+
+@pytest.fixture
+def query_budget() -> Generator[QueryBudget, None, None]:
+    """
+    Fails the test when the requests made in the block issue more SQL statements
+    than the budget, e.g. `with query_budget(3): client.get(...)`.
+    """
+    statements: list[str] | None = None
+
+    def record(_conn: Any, _cursor: Any, statement: str, *_args: Any) -> None:
+        if statements is not None:
+            statements.append(statement)
+
+    @contextmanager
+    def budget(max_queries: int) -> Iterator[list[str]]:
+        nonlocal statements
+        statements = []
+        try:
+            yield statements
+        finally:
+            counted, statements = statements, None
+        if len(counted) > max_queries:
+            pytest.fail(
+                f"{len(counted)} queries over a budget of {max_queries}:\n"
+                + "\n".join(counted)
+            )
+
+    engines = [engine, async_engine.sync_engine]
+    for target in engines:
+        event.listen(target, "before_cursor_execute", record)
+    yield budget
+    for target in engines:
+        event.remove(target, "before_cursor_execute", record)
@@ -0,0 +1,192 @@
+import asyncio
+import time
+from collections.abc import Generator
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from app.core.cache import (
+    CacheBackend,
+    PostgresInvalidationChannel,
+    RedisCache,
+    RedisClient,
+    SharedMemoryCache,
+    TTLCache,
+)
+from app.core.config import settings
+from app.models import TokenPayload
+from app.tests.utils.redis import fake_redis_server
+
+
+def test_ttl_cache_get_set() -> None:
+    cache: TTLCache[int, str] = TTLCache(maxsize=10, ttl=60)
+    assert cache.get(1) is None
+    cache.set(1, "one")
+    assert cache.get(1) == "one"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_evicts_least_recently_used() -> None:
+    cache: TTLCache[int, str] = TTLCache(maxsize=2, ttl=60)
+    cache.set(1, "one")
+    cache.set(2, "two")
+    cache.get(1)
+    cache.set(3, "three")
+    assert cache.get(2) is None
+    assert cache.get(1) == "one"
+    assert cache.get(3) == "three"
+
+
+def test_ttl_cache_expires_entries() -> None:
+    cache: TTLCache[int, str] = TTLCache(maxsize=10, ttl=60)
+    with patch("app.core.cache.time.monotonic", return_value=1000.0):
+        cache.set(1, "one")
+    with patch("app.core.cache.time.monotonic", return_value=1061.0):
+        assert cache.get(1) is None
+    assert len(cache) == 0
+
+
+@pytest.fixture(params=["memory", "shared_memory", "redis"])
+def cache_backend(
+    request: pytest.FixtureRequest, tmp_path: Path
+) -> Generator[CacheBackend, None, None]:
+    if request.param == "shared_memory":
+        yield SharedMemoryCache(
+            str(tmp_path / "cache.sqlite3"), "test", maxsize=3, ttl=60
+        )
+    elif request.param == "redis":
+        with fake_redis_server() as server:
+            client = RedisClient(server.url)
+            yield RedisCache(client, "test", maxsize=3, ttl=60)
+            client.close()
+    else:
+        yield TTLCache(maxsize=3, ttl=60)
+
+
+def test_cache_backend_get_set_delete(cache_backend: CacheBackend) -> None:
+    assert cache_backend.get("1") is None
+    cache_backend.set("1", {"id": 1, "email": "user@example.com"})
+    cache_backend.set("2", "two")
+    assert cache_backend.get("1") == {"id": 1, "email": "user@example.com"}
+    cache_backend.delete("1")
+    assert cache_backend.get("1") is None
+    assert cache_backend.get("2") == "two"
+    cache_backend.delete_many(["2", "missing"])
+    assert cache_backend.get("2") is None
+    stats = cache_backend.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 3)
+    assert stats["hit_rate"] == 0.4
+
+
+def test_cache_backend_ttl(cache_backend: CacheBackend) -> None:
+    cache_backend.set("short", "value", ttl=0.05)
+    cache_backend.set("disabled", "value", ttl=0)
+    assert cache_backend.get("short") == "value"
+    assert cache_backend.get("disabled") is None
+    time.sleep(0.1)
+    assert cache_backend.get("short") is None
+
+
+def test_cache_backend_tags(cache_backend: CacheBackend) -> None:
+    cache_backend.set("1", "one", tags=["user:1"])
+    cache_backend.set("2", "two", tags=["user:1", "user:2"])
+    cache_backend.set("3", "three", tags=["user:2"])
+    cache_backend.invalidate_tags("user:1")
+    assert cache_backend.get("1") is None
+    assert cache_backend.get("2") is None
+    assert cache_backend.get("3") == "three"
+    cache_backend.clear()
+    assert cache_backend.get("3") is None
+    assert len(cache_backend) == 0
+
+
+def test_cache_backend_maxsize(cache_backend: CacheBackend) -> None:
+    if isinstance(cache_backend, RedisCache):
+        pytest.skip("Redis evicts with its maxmemory-policy")
+    for key in range(5):
+        cache_backend.set(str(key), key)
+    assert len(cache_backend) == 3
+    assert cache_backend.get("4") == 4
+
+
+def test_cache_backend_model(cache_backend: CacheBackend) -> None:
+    cache_backend.model = TokenPayload
+    token_data = TokenPayload(sub=1, jti="abc", exp=time.time() + 60)
+    cache_backend.set("1", token_data)
+    assert cache_backend.get("1") == token_data
+
+
+@pytest.mark.anyio
+async def test_cache_backend_async(cache_backend: CacheBackend) -> None:
+    await cache_backend.aset("1", "one", tags=["user:1"])
+    assert await cache_backend.aget("1") == "one"
+    await cache_backend.ainvalidate_tags("user:1")
+    assert await cache_backend.aget("1") is None
+    await cache_backend.aset("2", "two")
+    await cache_backend.adelete("2")
+    assert await cache_backend.aget("2") is None
+
+
+def test_shared_caches_unavailable(tmp_path: Path) -> None:
+    with fake_redis_server() as server:
+        url = server.url
+    caches: list[CacheBackend] = [
+        SharedMemoryCache(
+            str(tmp_path / "missing" / "cache.sqlite3"), "test", maxsize=3, ttl=60
+        ),
+        RedisCache(RedisClient(url, timeout=0.1), "test", maxsize=3, ttl=60),
+    ]
+    for cache in caches:
+        # Requests go on without the cache
+        cache.set("1", "one", tags=["user:1"])
+        assert cache.get("1") is None
+        cache.delete("1")
+        cache.invalidate_tags("user:1")
+        cache.clear()
+        assert cache.stats()["misses"] == 1
+        assert len(cache) == 0
+
+
+def test_shared_cache_values_are_json(tmp_path: Path) -> None:
+    cache = SharedMemoryCache(
+        str(tmp_path / "cache.sqlite3"), "test", maxsize=3, ttl=60
+    )
+    cache.set("1", [1.5, 1000.0])
+    row = cache._connection().execute("SELECT value FROM cache_entry").fetchone()
+    assert row[0] == "[1.5, 1000.0]"
+    # Anything else, e.g. pickles of an older version, is a miss
+    cache._connection().execute(
+        "UPDATE cache_entry SET value = ?", (b"\x80\x04K\x01.",)
+    )
+    assert cache.get("1") is None
+
+
+def test_shared_memory_cache_is_shared(tmp_path: Path) -> None:
+    path = str(tmp_path / "cache.sqlite3")
+    writer = SharedMemoryCache(path, "test", maxsize=10, ttl=60)
+    reader = SharedMemoryCache(path, "test", maxsize=10, ttl=60)
+    other = SharedMemoryCache(path, "other", maxsize=10, ttl=60)
+    writer.set("1", "one")
+    assert reader.get("1") == "one"
+    assert other.get("1") is None
+    reader.delete("1")
+    assert writer.get("1") is None
+
+
+@pytest.mark.anyio
+async def test_postgres_invalidation_channel() -> None:
+    conninfo = str(settings.SQLALCHEMY_DATABASE_URI).replace(
+        "postgresql+psycopg", "postgresql", 1
+    )
+    channel = PostgresInvalidationChannel(conninfo, "test_cache")
+    received: asyncio.Queue[str] = asyncio.Queue()
+    ready = asyncio.Event()
+    await channel.start(on_message=received.put_nowait, on_reset=ready.set)
+    try:
+        await asyncio.wait_for(ready.wait(), timeout=5)
+        channel.publish("42")
+        assert await asyncio.wait_for(received.get(), timeout=5) == "42"
+    finally:
+        await channel.stop()
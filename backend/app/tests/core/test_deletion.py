@@ -0,0 +1,66 @@
+from unittest.mock import patch
+
+import pytest
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.core.deletion import UserDeleter
+from app.models import Item, ItemCount, ItemCreate, User, UserDeletion
+from app.tests.utils.user import create_random_user
+
+
+@pytest.mark.anyio
+async def test_user_items_are_deleted_in_batches(
+    db: Session, async_db: AsyncSession
+) -> None:
+    user = create_random_user(db)
+    assert user.id is not None
+    for i in range(5):
+        crud.create_item(
+            session=db, item_in=ItemCreate(title=f"Item {i}"), owner_id=user.id
+        )
+    db_user = await async_db.get(User, user.id)
+    assert db_user
+
+    with patch("app.core.config.settings.USER_DELETION_BATCH_SIZE", 2):
+        assert not await crud.async_delete_user(session=async_db, db_user=db_user)
+        assert not db_user.is_active
+        assert db_user.deleted_at
+        deletion = await async_db.get(UserDeletion, user.id)
+        assert deletion
+        assert deletion.items_total == 5
+
+        deleter = UserDeleter()
+        progress = []
+        while await deleter.process_batch(async_db):
+            await async_db.refresh(deletion)
+            progress.append(deletion.items_deleted)
+            if deletion.status == "pending":
+                count = await crud.async_get_item_count(
+                    session=async_db, owner_id=user.id
+                )
+                assert count == 5 - deletion.items_deleted
+
+    assert progress == [2, 4, 5]
+    assert deletion.status == "done"
+    assert deletion.finished_at
+    async_db.expunge_all()
+    assert await async_db.get(User, user.id) is None
+    assert await async_db.get(ItemCount, user.id) is None
+    assert not (await async_db.exec(select(Item).where(Item.owner_id == user.id))).all()
+
+
+@pytest.mark.anyio
+async def test_user_with_few_items_is_deleted_at_once(
+    db: Session, async_db: AsyncSession
+) -> None:
+    user = create_random_user(db)
+    assert user.id is not None
+    crud.create_item(session=db, item_in=ItemCreate(title="Item"), owner_id=user.id)
+    db_user = await async_db.get(User, user.id)
+    assert db_user
+    assert await crud.async_delete_user(session=async_db, db_user=db_user)
+    assert await async_db.get(UserDeletion, user.id) is None
+    async_db.expunge_all()
+    assert await async_db.get(User, user.id) is None
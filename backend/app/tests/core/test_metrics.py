@@ -0,0 +1,54 @@
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from prometheus_client.parser import text_string_to_metric_families
+
+from app.core.config import settings
+
+
+def _samples(client: TestClient) -> dict[tuple[str, frozenset[tuple[str, str]]], float]:
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    return {
+        (sample.name, frozenset(sample.labels.items())): sample.value
+        for family in text_string_to_metric_families(r.text)
+        for sample in family.samples
+    }
+
+
+def test_metrics(client: TestClient, superuser_token_headers: dict[str, str]) -> None:
+    route = f"{settings.API_V1_STR}/users/me"
+    labels = frozenset({"method": "GET", "route": route, "status": "200"}.items())
+    key = ("http_request_duration_seconds_count", labels)
+    before = _samples(client).get(key, 0)
+    r = client.get(route, headers=superuser_token_headers)
+    assert r.status_code == 200
+    samples = _samples(client)
+    assert samples[key] == before + 1
+    assert ("http_requests_in_progress", frozenset()) in samples
+    assert ("db_pool_connections_checked_out", frozenset()) in samples
+    assert ("password_hash_queue_depth", frozenset()) in samples
+    assert any(name == "cache_lookups_total" for name, _ in samples)
+
+
+def test_metrics_unmatched_route(client: TestClient) -> None:
+    client.get("/does-not-exist")
+    client.get("/does-not-exist-either")
+    samples = _samples(client)
+    assert not any(
+        dict(labels).get("route", "").startswith("/does-not-exist")
+        for _, labels in samples
+    )
+    labels = frozenset({"method": "GET", "route": "unmatched", "status": "404"}.items())
+    assert samples[("http_request_duration_seconds_count", labels)] >= 2
+
+
+def test_metrics_token(client: TestClient) -> None:
+    with patch.object(settings, "METRICS_TOKEN", "secret"):
+        r = client.get("/metrics")
+        assert r.status_code == 401
+        r = client.get("/metrics", headers={"Authorization": "Bearer wrong"})
+        assert r.status_code == 401
+        r = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+        assert r.status_code == 200
@@ -0,0 +1,243 @@
+import asyncio
+import smtplib
+from collections.abc import Callable
+from datetime import datetime
+from email.message import EmailMessage
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from anyio import to_thread
+from sqlalchemy import exc
+from sqlmodel import Session, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.core.db import async_engine, engine
+from app.core.outbox import EmailOutboxSender
+from app.models import EmailOutbox, UserCreate
+from app.tests.utils.utils import random_email, random_lower_string
+
+
+class FakeSMTP:
+    """Stands in for smtplib.SMTP, optionally failing every send."""
+
+    instances: list["FakeSMTP"] = []
+    fail = False
+    on_send: Callable[[EmailMessage], None] | None = None
+
+    def __init__(self, host: str, port: int) -> None:
+        self.sent: list[EmailMessage] = []
+        FakeSMTP.instances.append(self)
+
+    def starttls(self) -> None:
+        pass
+
+    def login(self, user: str, password: str) -> None:
+        pass
+
+    def send_message(self, message: EmailMessage) -> None:
+        if FakeSMTP.fail:
+            raise smtplib.SMTPRecipientsRefused({})
+        if FakeSMTP.on_send is not None:
+            FakeSMTP.on_send(message)
+        self.sent.append(message)
+
+    def quit(self) -> None:
+        pass
+
+
+@pytest.fixture
+def fake_smtp() -> Any:
+    FakeSMTP.instances = []
+    FakeSMTP.fail = False
+    FakeSMTP.on_send = None
+    with (
+        patch("app.core.outbox.smtplib.SMTP", FakeSMTP),
+        patch("app.core.config.settings.SMTP_HOST", "smtp.example.com"),
+        patch("app.core.config.settings.SMTP_SSL", False),
+    ):
+        yield FakeSMTP
+
+
+async def _enqueue(async_db: AsyncSession, count: int) -> list[EmailOutbox]:
+    messages = [
+        EmailOutbox(email_to=random_email(), subject="Hi", html_content="<p>Hi</p>")
+        for _ in range(count)
+    ]
+    async_db.add_all(messages)
+    await async_db.commit()
+    return messages
+
+
+async def _pending_ids(async_db: AsyncSession) -> list[int | None]:
+    # Leave rows queued by other tests alone
+    statement = select(EmailOutbox.id).where(EmailOutbox.status == "pending")
+    return list((await async_db.exec(statement)).all())
+
+
+async def _mark_pending_sent(async_db: AsyncSession) -> None:
+    for message_id in await _pending_ids(async_db):
+        outbox_message = await async_db.get(EmailOutbox, message_id)
+        assert outbox_message
+        outbox_message.status = "sent"
+        async_db.add(outbox_message)
+    await async_db.commit()
+
+
+@pytest.mark.anyio
+async def test_process_batch_reuses_connection(
+    async_db: AsyncSession, fake_smtp: type[FakeSMTP]
+) -> None:
+    await _mark_pending_sent(async_db)
+    messages = await _enqueue(async_db, 3)
+
+    sender = EmailOutboxSender()
+    assert await sender.process_batch(async_db) == 3
+    await sender.stop()
+
+    assert len(fake_smtp.instances) == 1
+    assert [m["To"] for m in fake_smtp.instances[0].sent] == [
+        m.email_to for m in messages
+    ]
+    for message in messages:
+        await async_db.refresh(message)
+        assert message.status == "sent"
+        assert message.attempts == 1
+        assert message.sent_at is not None
+
+
+@pytest.mark.anyio
+async def test_process_batch_commits_each_message(
+    async_db: AsyncSession, fake_smtp: type[FakeSMTP]
+) -> None:
+    await _mark_pending_sent(async_db)
+    messages = await _enqueue(async_db, 3)
+    ids = [message.id for message in messages]
+
+    def send(message: EmailMessage) -> None:
+        # Sent after the claim is committed, no row is locked meanwhile
+        with Session(engine) as session:
+            statement = (
+                select(EmailOutbox)
+                .where(col(EmailOutbox.id).in_(ids))
+                .with_for_update(nowait=True)
+            )
+            for row in session.exec(statement).all():
+                assert row.status == "sent" or row.next_attempt_at > datetime.utcnow()
+        if message["To"] == messages[1].email_to:
+            raise RuntimeError("The sender died")
+
+    fake_smtp.on_send = send
+    sender = EmailOutboxSender()
+    with pytest.raises(RuntimeError):
+        await sender.process_batch(async_db)
+    await sender.stop()
+
+    for message in messages:
+        await async_db.refresh(message)
+    # The message sent before the crash is not sent again
+    assert messages[0].status == "sent"
+    # The others wait for their claim to time out
+    for message in messages[1:]:
+        assert message.status == "pending"
+        assert message.attempts == 1
+        assert message.next_attempt_at > datetime.utcnow()
+
+
+@pytest.mark.anyio
+async def test_process_batch_retries_with_backoff(
+    async_db: AsyncSession, fake_smtp: type[FakeSMTP]
+) -> None:
+    (message,) = await _enqueue(async_db, 1)
+    fake_smtp.fail = True
+    sender = EmailOutboxSender()
+
+    await sender.process_batch(async_db)
+    await async_db.refresh(message)
+    assert message.status == "pending"
+    assert message.attempts == 1
+    assert message.last_error
+    first_retry = message.next_attempt_at
+    assert first_retry > message.created_at
+
+    # Not due yet, so the next batch leaves it alone
+    await sender.process_batch(async_db)
+    await async_db.refresh(message)
+    assert message.attempts == 1
+
+    with patch("app.core.config.settings.EMAIL_OUTBOX_MAX_ATTEMPTS", 2):
+        message.next_attempt_at = message.created_at
+        async_db.add(message)
+        await async_db.commit()
+        await sender.process_batch(async_db)
+    await async_db.refresh(message)
+    assert message.status == "failed"
+    assert message.attempts == 2
+    await sender.stop()
+
+
+@pytest.mark.anyio
+async def test_enqueue_email(async_db: AsyncSession) -> None:
+    email = random_email()
+    with (
+        patch("app.core.config.settings.SMTP_HOST", "smtp.example.com"),
+        patch("app.core.config.settings.EMAILS_FROM_EMAIL", "info@example.com"),
+    ):
+        queued = await crud.async_enqueue_email(
+            session=async_db, email_to=email, subject="Test", html_content="<p>ok</p>"
+        )
+    statement = select(EmailOutbox).where(col(EmailOutbox.id) == queued.id)
+    stored = (await async_db.exec(statement)).one()
+    assert stored.status == "pending"
+    assert stored.email_to == email
+    assert stored.attempts == 0
+
+
+@pytest.mark.anyio
+async def test_sender_starts_once_and_wakes_from_threads() -> None:
+    sender = EmailOutboxSender()
+    woken = asyncio.Event()
+
+    async def run(_engine: object) -> None:
+        await sender._wakeup.wait()
+        woken.set()
+
+    with patch.object(sender, "_run", run):
+        await sender.start(async_engine)
+        task = sender._task
+        await sender.start(async_engine)
+        assert sender._task is task
+        # Threadpool routes wake the sender too
+        await to_thread.run_sync(sender.wake)
+        await asyncio.wait_for(woken.wait(), 1)
+    await sender.stop()
+
+
+@pytest.mark.anyio
+async def test_create_user_queues_email_in_the_same_transaction(
+    async_db: AsyncSession,
+) -> None:
+    email = random_email()
+    user_in = UserCreate(email=email, password=random_lower_string())
+    with (
+        patch("app.core.config.settings.SMTP_HOST", "smtp.example.com"),
+        patch("app.core.config.settings.EMAILS_FROM_EMAIL", "info@example.com"),
+    ):
+        await crud.async_create_user(
+            session=async_db,
+            user_create=user_in,
+            email=crud.outbox_email(email_to=email, subject="1", html_content="<p/>"),
+        )
+        # The duplicate user is rolled back along with its email
+        with pytest.raises(exc.IntegrityError):
+            await crud.async_create_user(
+                session=async_db,
+                user_create=user_in,
+                email=crud.outbox_email(
+                    email_to=email, subject="2", html_content="<p/>"
+                ),
+            )
+        await async_db.rollback()
+    statement = select(EmailOutbox.subject).where(EmailOutbox.email_to == email)
+    assert (await async_db.exec(statement)).all() == ["1"]
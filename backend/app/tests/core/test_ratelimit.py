@@ -0,0 +1,58 @@
+from unittest.mock import patch
+
+import pytest
+
+from app.core.cache import TTLCache
+from app.core.ratelimit import RateLimiter, RateLimitExceededError, check_rate_limits
+
+
+def _limiter(limit: int) -> RateLimiter:
+    return RateLimiter(
+        TTLCache(maxsize=10, ttl=60), "test", limit=limit, window_seconds=60
+    )
+
+
+@pytest.mark.anyio
+async def test_rate_limiter_refills_over_the_window() -> None:
+    limiter = _limiter(3)
+    with patch("app.core.ratelimit.time.time", return_value=1000.0) as now:
+        for _ in range(3):
+            await check_rate_limits((limiter, "a"))
+        with pytest.raises(RateLimitExceededError) as exc_info:
+            await check_rate_limits((limiter, "a"))
+        assert exc_info.value.retry_after == pytest.approx(20)
+        # One token comes back every 20 seconds
+        now.return_value = 1020.0
+        await check_rate_limits((limiter, "a"))
+        with pytest.raises(RateLimitExceededError):
+            await check_rate_limits((limiter, "a"))
+
+
+@pytest.mark.anyio
+async def test_check_rate_limits_takes_nothing_when_limited() -> None:
+    ip, account = _limiter(5), _limiter(1)
+    await check_rate_limits((ip, "ip"), (account, "a"))
+    with pytest.raises(RateLimitExceededError):
+        await check_rate_limits((ip, "ip"), (account, "a"))
+    # The rejected attempt did not use up a token of the IP
+    for _ in range(4):
+        await check_rate_limits((ip, "ip"))
+    with pytest.raises(RateLimitExceededError):
+        await check_rate_limits((ip, "ip"))
+
+
+@pytest.mark.anyio
+async def test_check_rate_limits_without_taking() -> None:
+    limiter = _limiter(1)
+    for _ in range(3):
+        await check_rate_limits((limiter, "a"), take=False)
+    await limiter.take("a")
+    with pytest.raises(RateLimitExceededError):
+        await check_rate_limits((limiter, "a"), take=False)
+
+
+@pytest.mark.anyio
+async def test_rate_limiter_disabled() -> None:
+    limiter = _limiter(0)
+    for _ in range(10):
+        await check_rate_limits((limiter, "a"))
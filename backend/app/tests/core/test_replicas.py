@@ -0,0 +1,163 @@
+from collections.abc import AsyncGenerator
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlmodel import select
+
+from app.core.cache import recent_writers
+from app.core.config import settings
+from app.core.db import async_engine
+from app.core.replicas import ReplicaSet
+from app.tests.utils.utils import random_lower_string
+
+# The primary plays the replicas, it reports no lag
+REPLICA_URL = str(settings.SQLALCHEMY_DATABASE_URI)
+
+
+@pytest.fixture
+async def replica_engines() -> AsyncGenerator[list[AsyncEngine], None]:
+    engines = [
+        create_async_engine(
+            REPLICA_URL, execution_options={"postgresql_readonly": True}
+        )
+        for _ in range(2)
+    ]
+    yield engines
+    for engine in engines:
+        await engine.dispose()
+    await async_engine.dispose()
+
+
+def _replica_set(engines: list[AsyncEngine], **kwargs: object) -> ReplicaSet:
+    options: dict[str, object] = {
+        "strategy": "round_robin",
+        "max_lag_seconds": 5,
+        "check_interval_seconds": 60,
+        **kwargs,
+    }
+    return ReplicaSet(engines, async_engine, **options)  # type: ignore[arg-type]
+
+
+@pytest.mark.anyio
+async def test_replica_transactions_are_read_only(
+    replica_engines: list[AsyncEngine],
+) -> None:
+    async with replica_engines[0].connect() as connection:
+        assert (await connection.execute(text("SELECT 1"))).scalar() == 1
+        with pytest.raises(exc.DBAPIError, match="read-only transaction"):
+            await connection.execute(text("CREATE TEMPORARY TABLE t (id int)"))
+
+
+@pytest.mark.anyio
+async def test_replica_set_round_robin(replica_engines: list[AsyncEngine]) -> None:
+    replica_set = _replica_set(replica_engines)
+    chosen = [await replica_set.choose() for _ in range(4)]
+    assert chosen == replica_engines * 2
+
+
+@pytest.mark.anyio
+async def test_replica_set_least_connections(
+    replica_engines: list[AsyncEngine],
+) -> None:
+    replica_set = _replica_set(replica_engines, strategy="least_connections")
+    async with replica_engines[0].connect():
+        assert await replica_set.choose() is replica_engines[1]
+    async with replica_engines[1].connect():
+        assert await replica_set.choose() is replica_engines[0]
+
+
+@pytest.mark.anyio
+async def test_replica_set_skips_lagging_replicas(
+    replica_engines: list[AsyncEngine],
+) -> None:
+    replica_set = _replica_set(replica_engines, max_lag_seconds=-1)
+    assert await replica_set.choose() is async_engine
+
+
+@pytest.mark.anyio
+async def test_replica_set_skips_unavailable_replicas(
+    replica_engines: list[AsyncEngine],
+) -> None:
+    unavailable = create_async_engine(
+        REPLICA_URL.replace(f":{settings.POSTGRES_PORT}/", ":1/")
+    )
+    replica_set = _replica_set([unavailable, replica_engines[0]])
+    assert await replica_set.choose() is replica_engines[0]
+    assert await replica_set.choose() is replica_engines[0]
+    await unavailable.dispose()
+
+
+@pytest.mark.anyio
+async def test_replica_session_falls_back_to_primary(
+    replica_engines: list[AsyncEngine],
+) -> None:
+    unavailable = create_async_engine(
+        REPLICA_URL.replace(f":{settings.POSTGRES_PORT}/", ":1/")
+    )
+    replica_set = _replica_set([unavailable, replica_engines[0]])
+    async with replica_set.session(unavailable) as session:
+        assert (await session.exec(select(1))).one() == 1
+        assert (await session.execute(text("SELECT 2"))).scalar() == 2
+        assert session.sync_session.bind is async_engine.sync_engine
+    # Skipped until the next check
+    assert await replica_set.choose() is replica_engines[0]
+    assert await replica_set.choose() is replica_engines[0]
+    await unavailable.dispose()
+
+
+def test_read_your_writes(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    replica_set = _replica_set([async_engine])
+    recent_writers.clear()
+    with patch.object(replica_set, "choose", AsyncMock(return_value=async_engine)):
+        with patch("app.api.deps.replicas", replica_set):
+            r = client.get(
+                f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers
+            )
+            assert r.status_code == 200
+            assert replica_set.choose.await_count == 1  # type: ignore[attr-defined]
+
+            r = client.patch(
+                f"{settings.API_V1_STR}/users/me",
+                headers=normal_user_token_headers,
+                json={"full_name": random_lower_string()},
+            )
+            assert r.status_code == 200
+            r = client.get(
+                f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers
+            )
+            assert r.status_code == 200
+            assert replica_set.choose.await_count == 1  # type: ignore[attr-defined]
+    recent_writers.clear()
+
+
+def test_reads_without_replicas_hold_one_connection(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    pool_size = 3
+    primary = create_async_engine(
+        str(settings.SQLALCHEMY_DATABASE_URI),
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=2,
+    )
+    url = f"{settings.API_V1_STR}/items/"
+    # The user is loaded on every request, holding a connection for the session
+    with (
+        patch("app.api.deps.async_engine", primary),
+        patch("app.api.deps.user_cache.aget", AsyncMock(return_value=None)),
+        ThreadPoolExecutor(pool_size) as executor,
+    ):
+        responses = list(
+            executor.map(
+                lambda _: client.get(url, headers=normal_user_token_headers),
+                range(pool_size * 4),
+            )
+        )
+    assert [r.status_code for r in responses] == [200] * pool_size * 4
+    client.portal.call(primary.dispose)  # type: ignore[union-attr]
@@ -0,0 +1,80 @@
+import time
+from datetime import datetime, timedelta
+
+from app.core.cache import InvalidationChannel
+from app.core.revocation import TokenDenylist, user_tokens_revocation
+from app.models import TokenPayload, TokenRevocation
+
+
+class RecordingChannel(InvalidationChannel):
+    def __init__(self) -> None:
+        self.messages: list[str] = []
+
+    def publish(self, message: str) -> None:
+        self.messages.append(message)
+
+
+def test_revoked_token() -> None:
+    denylist = TokenDenylist(InvalidationChannel())
+    token = TokenPayload(sub=1, jti="a", iat=time.time())
+    assert not denylist.is_revoked(token)
+    denylist.add(
+        TokenRevocation(jti="a", expires_at=datetime.utcnow() + timedelta(minutes=5))
+    )
+    assert denylist.is_revoked(token)
+    assert not denylist.is_revoked(TokenPayload(sub=1, jti="b", iat=time.time()))
+
+
+def test_revoked_user_tokens() -> None:
+    denylist = TokenDenylist(InvalidationChannel())
+    before = TokenPayload(sub=1, jti="a", iat=time.time() - 60)
+    kept = TokenPayload(sub=1, jti="b", iat=time.time() - 60)
+    denylist.add(
+        TokenRevocation(
+            jti="b", user_id=1, expires_at=datetime.utcnow() + timedelta(minutes=5)
+        )
+    )
+    assert denylist.is_revoked(before)
+    assert not denylist.is_revoked(kept)
+    # Tokens issued after the revocation, or to other users, are not affected
+    assert not denylist.is_revoked(TokenPayload(sub=1, jti="c", iat=time.time() + 1))
+    assert not denylist.is_revoked(TokenPayload(sub=2, jti="d", iat=time.time() - 60))
+    # Tokens without an issue time predate the revocation
+    assert denylist.is_revoked(TokenPayload(sub=1))
+
+
+def test_revoked_user_tokens_keep_session() -> None:
+    denylist = TokenDenylist(InvalidationChannel())
+    access = TokenPayload(sub=1, jti="a", sid="s", iat=time.time() - 60)
+    refresh = TokenPayload(
+        sub=1, jti="b", sid="s", iat=time.time() - 60, type="refresh"
+    )
+    other = TokenPayload(sub=1, jti="c", sid="t", iat=time.time() - 60)
+    denylist.add(user_tokens_revocation(1, keep=access))
+    assert not denylist.is_revoked(access)
+    assert not denylist.is_revoked(refresh)
+    assert denylist.is_revoked(other)
+
+
+def test_revocations_are_pruned_at_expiry() -> None:
+    denylist = TokenDenylist(InvalidationChannel())
+    expires_at = datetime.utcnow() + timedelta(minutes=5)
+    denylist.add(TokenRevocation(jti="a", expires_at=expires_at))
+    denylist.add(TokenRevocation(user_id=1, expires_at=expires_at))
+    denylist.prune()
+    assert len(denylist) == 2
+    denylist.prune(now=time.time() + 6 * 60)
+    assert len(denylist) == 0
+
+
+def test_revocations_reach_other_workers() -> None:
+    channel = RecordingChannel()
+    denylist, other_worker = TokenDenylist(channel), TokenDenylist(channel)
+    revocation = TokenRevocation(
+        jti="a", expires_at=datetime.utcnow() + timedelta(minutes=5)
+    )
+    denylist.revoke(revocation)
+    assert denylist.is_revoked(TokenPayload(sub=1, jti="a"))
+    (message,) = channel.messages
+    other_worker._on_message(message)
+    assert other_worker.is_revoked(TokenPayload(sub=1, jti="a"))
@@ -0,0 +1,98 @@
+import logging
+from collections.abc import Generator, Mapping
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, exc, text
+
+from app.core.config import settings
+from app.core.db import async_engine
+from app.core.timing import (
+    RequestTimings,
+    ServerTimingMiddleware,
+    _request_timings,
+    instrument_engine,
+    uninstrument_engine,
+)
+from app.main import app
+
+
+@pytest.fixture(scope="module")
+def timed_client() -> Generator[TestClient, None, None]:
+    instrument_engine(async_engine.sync_engine)
+    with TestClient(ServerTimingMiddleware(app)) as c:
+        yield c
+    uninstrument_engine(async_engine.sync_engine)
+
+
+def _server_timing(headers: Mapping[str, str]) -> dict[str, str]:
+    metrics = {}
+    for metric in headers["server-timing"].split(", "):
+        name, *params = metric.split(";")
+        metrics[name] = ";".join(params)
+    return metrics
+
+
+def test_server_timing_of_login(timed_client: TestClient) -> None:
+    r = timed_client.post(
+        f"{settings.API_V1_STR}/login/access-token",
+        data={
+            "username": settings.FIRST_SUPERUSER,
+            "password": settings.FIRST_SUPERUSER_PASSWORD,
+        },
+    )
+    assert r.status_code == 200
+    metrics = _server_timing(r.headers)
+    assert set(metrics) == {"db", "hash", "serialize", "total"}
+    assert 'desc="0 queries"' not in metrics["db"]
+    assert metrics["hash"] != "dur=0.0"
+
+
+def test_server_timing_of_read_items(
+    timed_client: TestClient,
+    superuser_token_headers: dict[str, str],
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    with caplog.at_level(logging.INFO, logger="app.core.timing"):
+        r = timed_client.get(
+            f"{settings.API_V1_STR}/items/", headers=superuser_token_headers
+        )
+    assert r.status_code == 200
+    metrics = _server_timing(r.headers)
+    assert metrics["hash"] == "dur=0.0"
+    (record,) = caplog.records
+    fields = record.__dict__
+    assert fields["route"] == f"{settings.API_V1_STR}/items/"
+    assert fields["status_code"] == 200
+    assert fields["db_queries"] >= 1
+    assert fields["db_ms"] > 0
+    assert fields["serialization_ms"] > 0
+
+
+def test_server_timing_is_off_by_default(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=superuser_token_headers)
+    assert r.status_code == 200
+    assert "server-timing" not in r.headers
+
+
+def test_failed_queries_are_timed() -> None:
+    engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+    instrument_engine(engine)
+    timings = RequestTimings()
+    token = _request_timings.set(timings)
+    try:
+        with engine.connect() as connection:
+            with pytest.raises(exc.ProgrammingError):
+                connection.execute(text("SELECT * FROM missing_table"))
+            # Its start time is not left behind for the next query to take
+            assert connection.info["query_started_at"] == []
+            connection.rollback()
+            connection.execute(text("SELECT 1"))
+            assert connection.info["query_started_at"] == []
+    finally:
+        _request_timings.reset(token)
+        uninstrument_engine(engine)
+        engine.dispose()
+    assert timings.queries == 2
@@ -1,8 +1,13 @@
+from unittest.mock import patch
+
+import pytest
 from fastapi.encoders import jsonable_encoder
+from passlib.context import CryptContext
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app import crud
-from app.core.security import verify_password
+from app.core.security import create_password_context, verify_password
 from app.models import User, UserCreate, UserUpdate
 from app.tests.utils.utils import random_email, random_lower_string
 
@@ -26,6 +31,58 @@ def test_authenticate_user(db: Session) -> None:
     assert user.email == authenticated_user.email
 
 
+def _password_context(scheme: str, bcrypt_rounds: int = 4) -> CryptContext:
+    return create_password_context(
+        scheme=scheme,
+        bcrypt_rounds=bcrypt_rounds,
+        argon2_time_cost=2,
+        argon2_memory_cost_kib=1024,
+        argon2_parallelism=1,
+    )
+
+
+def test_authenticate_user_rehashes_outdated_cost(db: Session) -> None:
+    email = random_email()
+    password = random_lower_string()
+    user_in = UserCreate(email=email, password=password)
+    with patch("app.core.security.pwd_context", _password_context("bcrypt", 4)):
+        user = crud.create_user(session=db, user_create=user_in)
+    assert user.hashed_password.startswith("$2b$04$")
+    with patch("app.core.security.pwd_context", _password_context("bcrypt", 5)):
+        assert crud.authenticate(session=db, email=email, password=password)
+        db.refresh(user)
+        assert user.hashed_password.startswith("$2b$05$")
+        assert verify_password(password, user.hashed_password)
+        # Up to date now, so the next login leaves it alone
+        hashed_password = user.hashed_password
+        assert crud.authenticate(session=db, email=email, password=password)
+        db.refresh(user)
+        assert user.hashed_password == hashed_password
+
+
+@pytest.mark.anyio
+async def test_async_authenticate_user_moves_to_argon2(
+    async_db: AsyncSession,
+) -> None:
+    email = random_email()
+    password = random_lower_string()
+    user_in = UserCreate(email=email, password=password)
+    with patch("app.core.security.pwd_context", _password_context("bcrypt")):
+        user = await crud.async_create_user(session=async_db, user_create=user_in)
+    with patch("app.core.security.pwd_context", _password_context("argon2")):
+        assert not await crud.async_authenticate(
+            session=async_db, email=email, password=random_lower_string()
+        )
+        await async_db.refresh(user)
+        assert user.hashed_password.startswith("$2b$")
+        assert await crud.async_authenticate(
+            session=async_db, email=email, password=password
+        )
+        await async_db.refresh(user)
+        assert user.hashed_password.startswith("$argon2id$")
+        assert verify_password(password, user.hashed_password)
+
+
 def test_not_authenticate_user(db: Session) -> None:
     email = random_email()
     password = random_lower_string()
@@ -33,6 +90,22 @@ def test_not_authenticate_user(db: Session) -> None:
     assert user is None
 
 
+@pytest.mark.anyio
+async def test_async_authenticate_user(async_db: AsyncSession) -> None:
+    email = random_email()
+    password = random_lower_string()
+    user_in = UserCreate(email=email, password=password)
+    user = await crud.async_create_user(session=async_db, user_create=user_in)
+    authenticated_user = await crud.async_authenticate(
+        session=async_db, email=email, password=password
+    )
+    assert authenticated_user
+    assert user.email == authenticated_user.email
+    assert not await crud.async_authenticate(
+        session=async_db, email=email, password=random_lower_string()
+    )
+
+
 def test_check_if_user_is_active(db: Session) -> None:
     email = random_email()
     password = random_lower_string()
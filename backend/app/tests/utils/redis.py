@@ -0,0 +1,116 @@
+import fnmatch
+import socketserver
+import threading
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from typing import Any
+
+
+class _FakeRedisHandler(socketserver.StreamRequestHandler):
+    server: "FakeRedisServer"
+
+    def handle(self) -> None:
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = [
+                self.rfile.read(int(self.rfile.readline()[1:]) + 2)[:-2]
+                for _ in range(int(line[1:]))
+            ]
+            with self.server.lock:
+                reply = self.server.run(args[0].decode().upper(), args[1:])
+            self.wfile.write(_encode(reply))
+
+
+def _encode(reply: Any) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Exception):
+        return b"-ERR %s\r\n" % str(reply).encode()
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    if isinstance(reply, str):
+        return b"+%s\r\n" % reply.encode()
+    return b"*%d\r\n" % len(reply) + b"".join(_encode(item) for item in reply)
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    """In-process server for the subset of Redis commands used by RedisCache."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), _FakeRedisHandler)
+        self.lock = threading.Lock()
+        self.data: dict[bytes, Any] = {}
+        self.expires: dict[bytes, float] = {}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"redis://{host!s}:{port}/0"
+
+    def _live(self, key: bytes) -> Any:
+        if key in self.expires and self.expires[key] <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def run(self, command: str, args: list[bytes]) -> Any:
+        if command == "PING":
+            return "PONG"
+        if command == "SELECT":
+            return "OK"
+        if command == "GET":
+            return self._live(args[0])
+        if command == "SET":
+            self.data[args[0]] = args[1]
+            self.expires.pop(args[0], None)
+            if len(args) == 4 and args[2].upper() == b"PX":
+                self.expires[args[0]] = time.monotonic() + int(args[3]) / 1000
+            return "OK"
+        if command == "DEL":
+            deleted = [key for key in args if self._live(key) is not None]
+            for key in args:
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return len(deleted)
+        if command == "SADD":
+            members = self._live(args[0]) or set()
+            self.data[args[0]] = members | set(args[1:])
+            return len(self.data[args[0]]) - len(members)
+        if command == "SMEMBERS":
+            return sorted(self._live(args[0]) or ())
+        if command == "PTTL":
+            if self._live(args[0]) is None:
+                return -2
+            if args[0] not in self.expires:
+                return -1
+            return int((self.expires[args[0]] - time.monotonic()) * 1000)
+        if command == "PEXPIRE":
+            if self._live(args[0]) is None:
+                return 0
+            self.expires[args[0]] = time.monotonic() + int(args[1]) / 1000
+            return 1
+        if command == "SCAN":
+            pattern = args[args.index(b"MATCH") + 1].decode()
+            keys = [k for k in list(self.data) if self._live(k) is not None]
+            return [b"0", [k for k in keys if fnmatch.fnmatchcase(k.decode(), pattern)]]
+        return ValueError(f"unknown command '{command}'")
+
+
+@contextmanager
+def fake_redis_server() -> Generator[FakeRedisServer, None, None]:
+    server = FakeRedisServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
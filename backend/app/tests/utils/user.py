@@ -28,14 +28,15 @@ def create_random_user(db: Session) -> User:
 
 
 def authentication_token_from_email(
-    *, client: TestClient, email: str, db: Session
+    *, client: TestClient, email: str, db: Session, password: str | None = None
 ) -> dict[str, str]:
     """
     Return a valid token for the user with given email.
 
-    If the user doesn't exist it is created first.
+    If the user doesn't exist it is created first. Its password is set to
+    `password`, a random one by default.
     """
-    password = random_lower_string()
+    password = password or random_lower_string()
     user = crud.get_user_by_email(session=db, email=email)
     if not user:
         user_in_create = UserCreate(email=email, password=password)
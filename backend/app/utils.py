@@ -1,12 +1,14 @@
-import logging
+import base64
+import binascii
+import hashlib
+import json
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Any
 
-import emails  # type: ignore
 import jwt
-from jinja2 import Template
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from jwt.exceptions import InvalidTokenError
 
 from app.core.config import settings
@@ -18,37 +20,37 @@ class EmailData:
     subject: str
 
 
-def render_email_template(*, template_name: str, context: dict[str, Any]) -> str:
-    template_str = (
-        Path(__file__).parent / "email-templates" / "build" / template_name
-    ).read_text()
-    html_content = Template(template_str).render(context)
-    return html_content
+def _get_email_template_env() -> Environment:
+    bytecode_cache = None
+    if settings.EMAIL_TEMPLATES_BYTECODE_CACHE_DIR:
+        Path(settings.EMAIL_TEMPLATES_BYTECODE_CACHE_DIR).mkdir(
+            parents=True, exist_ok=True
+        )
+        bytecode_cache = FileSystemBytecodeCache(
+            settings.EMAIL_TEMPLATES_BYTECODE_CACHE_DIR
+        )
+    # The build directory only changes on deploy, so skip the mtime checks
+    return Environment(
+        loader=FileSystemLoader(Path(__file__).parent / "email-templates" / "build"),
+        bytecode_cache=bytecode_cache,
+        auto_reload=False,
+        cache_size=-1,
+    )
 
 
-def send_email(
-    *,
-    email_to: str,
-    subject: str = "",
-    html_content: str = "",
-) -> None:
-    assert settings.emails_enabled, "no provided configuration for email variables"
-    message = emails.Message(
-        subject=subject,
-        html=html_content,
-        mail_from=(settings.EMAILS_FROM_NAME, settings.EMAILS_FROM_EMAIL),
-    )
-    smtp_options = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
-    if settings.SMTP_TLS:
-        smtp_options["tls"] = True
-    elif settings.SMTP_SSL:
-        smtp_options["ssl"] = True
-    if settings.SMTP_USER:
-        smtp_options["user"] = settings.SMTP_USER
-    if settings.SMTP_PASSWORD:
-        smtp_options["password"] = settings.SMTP_PASSWORD
-    response = message.send(to=email_to, smtp=smtp_options)
-    logging.info(f"send email result: {response}")
+email_template_env = _get_email_template_env()
+
+
+def warm_email_templates() -> None:
+    """Compile every email template so the first emails only pay for rendering."""
+    for template_name in email_template_env.list_templates(extensions=["html"]):
+        email_template_env.get_template(template_name)
+
+
+def render_email_template(*, template_name: str, context: dict[str, Any]) -> str:
+    template = email_template_env.get_template(template_name)
+    html_content = template.render(context)
+    return html_content
 
 
 def generate_test_email(email_to: str) -> EmailData:
@@ -115,3 +117,45 @@ def verify_password_reset_token(token: str) -> str | None:
         return str(decoded_token["sub"])
     except InvalidTokenError:
         return None
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int | None:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def encode_search_cursor(rank: float, last_id: int) -> str:
+    payload = json.dumps([rank, last_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor: str) -> tuple[float, int] | None:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, last_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(rank), int(last_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        return None
+
+
+def make_etag(*versions: Any) -> str:
+    """Strong ETag of a response built from data at the given versions."""
+    digest = hashlib.blake2b(repr(versions).encode(), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, W/ prefixes are ignored
+    tags = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in tags
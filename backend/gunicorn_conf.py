@@ -0,0 +1,12 @@
+# Loaded instead of the base image's /gunicorn_conf.py, keeps its settings
+import runpy
+from typing import Any
+
+from prometheus_client import multiprocess
+
+globals().update(runpy.run_path("/gunicorn_conf.py"))
+
+
+def child_exit(_server: Any, worker: Any) -> None:
+    # Drop the live gauges of the worker, its counters stay in the totals
+    multiprocess.mark_process_dead(worker.pid)  # type: ignore[no-untyped-call]
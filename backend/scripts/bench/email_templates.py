@@ -0,0 +1,58 @@
+"""
+Renders per second of the email templates.
+
+Compares reading and compiling the template on every call, as the email
+helpers used to, with rendering from the shared template environment. Run
+from the backend directory:
+
+    PYTHONPATH=. python scripts/bench/email_templates.py
+"""
+
+import argparse
+import timeit
+from functools import partial
+from pathlib import Path
+from typing import Any
+
+from jinja2 import Template
+
+from app.utils import render_email_template, warm_email_templates
+
+TEMPLATES_DIR = Path(__file__).parents[2] / "app" / "email-templates" / "build"
+
+CONTEXT = {
+    "project_name": "Benchmark",
+    "username": "user@example.com",
+    "password": "changethis",
+    "email": "user@example.com",
+    "valid_hours": 48,
+    "link": "http://localhost/reset-password?token=token",
+}
+
+
+def render_uncached(*, template_name: str, context: dict[str, Any]) -> str:
+    template_str = (TEMPLATES_DIR / template_name).read_text()
+    return Template(template_str).render(context)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=2_000)
+    args = parser.parse_args()
+
+    warm_email_templates()
+    for template_path in sorted(TEMPLATES_DIR.glob("*.html")):
+        for name, func in [
+            ("compile per call", render_uncached),
+            ("cached environment", render_email_template),
+        ]:
+            render = partial(func, template_name=template_path.name, context=CONTEXT)
+            seconds = min(timeit.repeat(render, number=args.number, repeat=3))
+            print(
+                f"{template_path.name:<20} {name:<20} "
+                f"{args.number / seconds:10.0f} renders/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""
+Load test of the API with realistic request mixes.
+
+Starts the app with uvicorn against the database configured in the
+environment, creates benchmark users, then drives each mix with concurrent
+httpx clients. Reports throughput and p50/p95/p99 latency per route, writes
+the results as JSON and compares them with a baseline. Run from the backend
+directory against a migrated database with the initial data:
+
+    PYTHONPATH=. python scripts/bench/load.py --duration 30 --concurrency 20
+    PYTHONPATH=. python scripts/bench/load.py --save-baseline
+    PYTHONPATH=. python scripts/bench/load.py --baseline scripts/bench/results/baseline.json
+
+Exits with status 1 when a route's p95 latency or throughput regressed more
+than --max-regression compared with the baseline.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+from app.core.config import settings
+
+RESULTS_DIR = Path(__file__).parent / "results"
+BENCH_PASSWORD = "bench-password"
+API = settings.API_V1_STR
+
+
+@dataclass
+class RouteStats:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+    def summary(self, seconds: float) -> dict[str, Any]:
+        latencies = sorted(self.latencies)
+        if len(latencies) > 1:
+            p50, p95, p99 = (
+                statistics.quantiles(latencies, n=100, method="inclusive")[i - 1]
+                for i in (50, 95, 99)
+            )
+        else:
+            p50 = p95 = p99 = latencies[0] if latencies else 0.0
+        return {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "throughput": len(latencies) / seconds,
+            "p50_ms": p50 * 1000,
+            "p95_ms": p95 * 1000,
+            "p99_ms": p99 * 1000,
+        }
+
+
+class Session:
+    """One simulated client, records every request under its route template."""
+
+    def __init__(self, client: httpx.AsyncClient, stats: dict[str, RouteStats]):
+        self.client = client
+        self.stats = stats
+        self.headers: dict[str, str] = {}
+        self.item_ids: list[int] = []
+
+    async def request(
+        self, route: str, method: str, url: str, **kwargs: Any
+    ) -> httpx.Response | None:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(
+                method, url, headers=self.headers, **kwargs
+            )
+        except httpx.HTTPError:
+            self.stats[route].errors += 1
+            return None
+        self.stats[route].latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.stats[route].errors += 1
+            return None
+        return response
+
+    async def login(self, email: str) -> None:
+        response = await self.request(
+            "POST /login/access-token",
+            "POST",
+            f"{API}/login/access-token",
+            data={"username": email, "password": BENCH_PASSWORD},
+        )
+        if response is not None:
+            self.headers = {
+                "Authorization": f"Bearer {response.json()['access_token']}"
+            }
+
+    async def read_me(self) -> None:
+        await self.request("GET /users/me", "GET", f"{API}/users/me")
+
+    async def paginate_items(self) -> None:
+        params: dict[str, Any] = {"limit": 20}
+        for _ in range(3):
+            response = await self.request(
+                "GET /items/", "GET", f"{API}/items/", params=params
+            )
+            if response is None:
+                return
+            content = response.json()
+            self.item_ids = [item["id"] for item in content["data"]] or self.item_ids
+            if content["next_cursor"] is None:
+                return
+            params = {
+                "limit": 20,
+                "cursor": content["next_cursor"],
+                "include_count": False,
+            }
+
+    async def item_crud(self) -> None:
+        response = await self.request(
+            "POST /items/",
+            "POST",
+            f"{API}/items/",
+            json={"title": "Benchmark", "description": "Created by the load test"},
+        )
+        if response is None:
+            return
+        id = response.json()["id"]
+        await self.request("GET /items/{id}", "GET", f"{API}/items/{id}")
+        await self.request(
+            "PUT /items/{id}", "PUT", f"{API}/items/{id}", json={"title": "Updated"}
+        )
+        await self.request("DELETE /items/{id}", "DELETE", f"{API}/items/{id}")
+
+    async def read_item(self) -> None:
+        if self.item_ids:
+            id = random.choice(self.item_ids)
+            await self.request("GET /items/{id}", "GET", f"{API}/items/{id}")
+
+
+Operation = Callable[[Session, str], Awaitable[None]]
+
+# Weighted operations of each mix, the weights are relative
+MIXES: dict[str, list[tuple[int, Operation]]] = {
+    "read_heavy": [
+        (40, lambda s, _: s.paginate_items()),
+        (30, lambda s, _: s.read_item()),
+        (25, lambda s, _: s.read_me()),
+        (5, lambda s, _: s.item_crud()),
+    ],
+    "write_heavy": [
+        (60, lambda s, _: s.item_crud()),
+        (20, lambda s, _: s.paginate_items()),
+        (20, lambda s, _: s.read_me()),
+    ],
+    "login": [
+        (20, lambda s, email: s.login(email)),
+        (80, lambda s, _: s.read_me()),
+    ],
+}
+
+
+async def run_client(
+    session: Session,
+    email: str,
+    mix: list[tuple[int, Operation]],
+    deadline: float,
+) -> None:
+    weights = [weight for weight, _ in mix]
+    operations = [operation for _, operation in mix]
+    while time.perf_counter() < deadline:
+        (operation,) = random.choices(operations, weights)
+        await operation(session, email)
+
+
+async def run_mix(
+    base_url: str, emails: list[str], mix: list[tuple[int, Operation]], args: Any
+) -> dict[str, Any]:
+    stats: dict[str, RouteStats] = defaultdict(RouteStats)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+        clients = [
+            (Session(client, stats), emails[i % len(emails)])
+            for i in range(args.concurrency)
+        ]
+        # Log every client in before measuring, only the mix counts
+        await asyncio.gather(*(session.login(email) for session, email in clients))
+        stats.clear()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(
+            *(run_client(session, email, mix, deadline) for session, email in clients)
+        )
+        seconds = time.perf_counter() - start
+    return {route: stats[route].summary(seconds) for route in sorted(stats)}
+
+
+async def create_users(base_url: str, count: int, items: int) -> list[tuple[int, str]]:
+    """Bench users with a few items each, as (id, email)."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        response = await client.post(
+            f"{API}/login/access-token",
+            data={
+                "username": settings.FIRST_SUPERUSER,
+                "password": settings.FIRST_SUPERUSER_PASSWORD,
+            },
+        )
+        response.raise_for_status()
+        admin = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        users = []
+        for i in range(count):
+            email = f"bench-{os.getpid()}-{i}@example.com"
+            response = await client.post(
+                f"{API}/users/",
+                headers=admin,
+                json={"email": email, "password": BENCH_PASSWORD},
+            )
+            response.raise_for_status()
+            users.append((response.json()["id"], email))
+            response = await client.post(
+                f"{API}/login/access-token",
+                data={"username": email, "password": BENCH_PASSWORD},
+            )
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            await client.post(
+                f"{API}/items/bulk",
+                headers=headers,
+                json=[{"title": f"Item {n}"} for n in range(items)],
+            )
+        return users
+
+
+async def delete_users(base_url: str, users: list[tuple[int, str]]) -> None:
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        response = await client.post(
+            f"{API}/login/access-token",
+            data={
+                "username": settings.FIRST_SUPERUSER,
+                "password": settings.FIRST_SUPERUSER_PASSWORD,
+            },
+        )
+        admin = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        for id, _ in users:
+            await client.delete(f"{API}/users/{id}", headers=admin)
+
+
+def start_server(port: int, workers: int) -> subprocess.Popen[bytes]:
+    command = [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "app.main:app",
+        "--port",
+        str(port),
+        "--workers",
+        str(workers),
+        "--log-level",
+        "warning",
+        "--no-access-log",
+    ]
+    # Every client logs in from this host, the load would trip the login limits
+    env = {
+        **os.environ,
+        "RATE_LIMIT_IP_ATTEMPTS": "0",
+        "RATE_LIMIT_ACCOUNT_ATTEMPTS": "0",
+    }
+    server = subprocess.Popen(command, cwd=Path(__file__).parents[2], env=env)
+    for _ in range(100):
+        if server.poll() is not None:
+            raise RuntimeError(f"The app exited with status {server.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}{API}/openapi.json").is_success:
+                return server
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("The app did not start")
+
+
+def compare(
+    results: dict[str, Any], baseline: dict[str, Any], max_regression: float
+) -> list[str]:
+    """Print the change of every route and return the regressions."""
+    regressions = []
+    for mix, routes in results["mixes"].items():
+        for route, current in routes.items():
+            before = baseline["mixes"].get(mix, {}).get(route)
+            if not before:
+                continue
+            p95 = current["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0
+            throughput = (
+                current["throughput"] / before["throughput"] - 1
+                if before["throughput"]
+                else 0
+            )
+            print(
+                f"{mix:<12} {route:<28} p95 {p95:+7.1%}  throughput {throughput:+7.1%}"
+            )
+            if p95 > max_regression or -throughput > max_regression:
+                regressions.append(f"{mix} {route}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--mix", choices=sorted(MIXES), action="append")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per mix")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--items", type=int, default=100, help="items per user")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--output", type=Path, help="defaults to results/<time>.json")
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    port = args.port
+    if not port:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}"
+
+    server = start_server(port, args.workers)
+    try:
+        users = asyncio.run(create_users(base_url, args.users, args.items))
+        emails = [email for _, email in users]
+        results: dict[str, Any] = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "options": {
+                "duration": args.duration,
+                "concurrency": args.concurrency,
+                "users": args.users,
+                "items": args.items,
+                "workers": args.workers,
+            },
+            "mixes": {},
+        }
+        for name in args.mix or sorted(MIXES):
+            routes = asyncio.run(run_mix(base_url, emails, MIXES[name], args))
+            results["mixes"][name] = routes
+            print(f"\n{name}")
+            for route, summary in routes.items():
+                print(
+                    f"  {route:<28} {summary['throughput']:8.1f} req/s "
+                    f"p50 {summary['p50_ms']:7.1f} p95 {summary['p95_ms']:7.1f} "
+                    f"p99 {summary['p99_ms']:7.1f} ms  errors {summary['errors']}"
+                )
+        asyncio.run(delete_users(base_url, users))
+    finally:
+        server.terminate()
+        server.wait()
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    output = args.output or RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    if args.save_baseline:
+        output = RESULTS_DIR / "baseline.json"
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        print(f"\nCompared with {args.baseline}")
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"\nRegressed more than {args.max_regression:.0%}:")
+            print("\n".join(f"  {regression}" for regression in regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Latency and allocations of GET /items/?limit=1000.
+
+Compares building the page from Item instances validated into ItemsPublic
+and encoded with the stdlib json module, as read_items used to, with the
+current endpoint, which selects plain rows and encodes them with orjson.
+Seeds the missing items for the first superuser and removes them afterwards.
+Run from the backend directory against a migrated database:
+
+    PYTHONPATH=. python scripts/bench/read_items.py
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import tracemalloc
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+from sqlmodel import Session, col, delete, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.core.config import settings
+from app.core.db import async_engine, engine
+from app.main import app
+from app.models import Item, ItemPublic, ItemsPublic, User
+from app.tests.utils.utils import get_superuser_token_headers
+
+LIMIT = 1000
+
+
+async def build_orm_page() -> bytes:
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        statement = select(Item).order_by(col(Item.id)).limit(LIMIT)
+        items = (await session.exec(statement)).all()
+        page = ItemsPublic.model_validate({"data": items, "count": len(items)})
+    return json.dumps(jsonable_encoder(page)).encode()
+
+
+async def build_row_page() -> bytes:
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        statement = (
+            select(*crud.public_columns(Item, ItemPublic))
+            .order_by(col(Item.id))
+            .limit(LIMIT)
+        )
+        items = [row._asdict() for row in (await session.exec(statement)).all()]
+    return orjson.dumps({"data": items, "count": len(items)})
+
+
+def measure(func: Callable[[], Any], number: int) -> tuple[float, int]:
+    """Median seconds per call and peak bytes allocated during one call."""
+    timings = []
+    for _ in range(number):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak
+
+
+def run(loop: asyncio.AbstractEventLoop, func: Callable[[], Awaitable[bytes]]) -> Any:
+    return lambda: loop.run_until_complete(func())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=50)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        owner = session.exec(
+            select(User).where(User.email == settings.FIRST_SUPERUSER)
+        ).one()
+        owner_id: int = owner.id  # type: ignore[assignment]
+        missing = LIMIT - session.exec(select(func.count()).select_from(Item)).one()
+        seeded_items = [
+            Item(title=f"Item {i}", description="Benchmark", owner_id=owner_id)
+            for i in range(max(missing, 0))
+        ]
+        session.add_all(seeded_items)
+        crud.add_item_counts(session=session, counts={owner_id: len(seeded_items)})
+        session.commit()
+        seeded = [item.id for item in seeded_items]
+
+    try:
+        loop = asyncio.new_event_loop()
+        for name, build in [
+            ("ORM + ItemsPublic + json", run(loop, build_orm_page)),
+            ("rows + orjson", run(loop, build_row_page)),
+        ]:
+            seconds, peak = measure(build, args.number)
+            print(f"{name:<28} {seconds * 1000:8.2f} ms {peak / 1024:10.0f} KiB peak")
+        loop.run_until_complete(async_engine.dispose())
+        loop.close()
+
+        with TestClient(app) as client:
+            headers = get_superuser_token_headers(client)
+
+            def get_items() -> None:
+                r = client.get(
+                    f"{settings.API_V1_STR}/items/",
+                    headers=headers,
+                    params={"limit": LIMIT, "include_count": False},
+                )
+                r.raise_for_status()
+
+            seconds, peak = measure(get_items, args.number)
+            name = f"GET /items/?limit={LIMIT}"
+            print(f"{name:<28} {seconds * 1000:8.2f} ms {peak / 1024:10.0f} KiB peak")
+    finally:
+        with Session(engine) as session:
+            session.exec(delete(Item).where(col(Item.id).in_(seeded)))  # type: ignore
+            crud.add_item_counts(session=session, counts={owner_id: -len(seeded)})
+            session.commit()
+
+
+if __name__ == "__main__":
+    main()